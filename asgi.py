@@ -0,0 +1,303 @@
+"""
+ASGI entry point. Upstream bound endpoints (historical data, quotes and orders)
+run as coroutines on AsyncKiteApp, so slow historical pulls never hold a worker
+while orders wait. Every other route is served by the Flask app in a thread pool.
+
+    gunicorn asgi:app   # gunicorn.conf.py selects the uvicorn worker
+"""
+import asyncio
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask import Response, jsonify, request
+
+from async_kite import AsyncKiteApp
+from candles import parse_aggregation
+from kite_api import (CANDLE_FORMATS, IMMUTABLE, SSE_HEADERS, TICKER_KEEPALIVE, app as flask_app, error_response,
+                      get_kite_instance, historical_etag, historical_response, instrument_args, not_modified,
+                      orders_response, ticker_tokens, user_ticker)
+from kite_pool import KiteAppPool, pool
+from order_book import MAX_WAIT, POLL_INTERVAL, order_books
+from read_cache import ORDER_WRITE_RESOURCES, read_cache
+from ticker import MODE_QUOTE, sse_events
+
+async_pool = KiteAppPool(pool.max_size, pool.ttl, factory=AsyncKiteApp)
+
+# Threads serving the synchronous Flask routes
+WSGI_THREADS = int(os.environ.get('KAPI_WSGI_THREADS', 32))
+_wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+class WsgiBridge(WsgiToAsgiInstance):
+    # asgiref runs every WSGI call on one shared thread by default, use a pool instead
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func,
+                                 thread_sensitive=False, executor=_wsgi_executor)
+
+
+def _unauthorized():
+    return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+
+async def get_historical_data():
+    kite = get_kite_instance(async_pool)
+    if not kite:
+        return _unauthorized()
+
+    try:
+        fmt = request.args.get('format', 'records')
+        if fmt not in CANDLE_FORMATS:
+            raise ValueError(f"Unsupported format {fmt}, expected one of {', '.join(CANDLE_FORMATS)}")
+        etag = historical_etag()
+        unchanged = etag and not_modified(etag, IMMUTABLE)
+        if unchanged:
+            return unchanged
+        candles = await kite.historical_columns(
+            instrument_token=int(request.args.get('instrument_token')),
+            from_date=request.args.get('from_date'),
+            to_date=request.args.get('to_date'),
+            interval=request.args.get('interval'),
+            oi=request.args.get('oi', '').lower() in ('1', 'true'),
+            resample=request.args.get('resample') or None,
+            session=request.args.get('session', 'NSE'),
+            aggregation=parse_aggregation(request.args.get('agg'))
+        )
+        return historical_response(CANDLE_FORMATS[fmt](candles), etag)
+    except Exception as e:
+        return error_response(e)
+
+
+def _market_data(mode):
+    async def view():
+        kite = get_kite_instance(async_pool)
+        if not kite:
+            return _unauthorized()
+
+        try:
+            if request.method == 'POST':
+                instruments = request.get_json()['instruments']
+            else:
+                instruments = instrument_args()
+            if not instruments:
+                raise ValueError("No instruments given")
+            data = await kite.market_data(instruments, mode)
+            return jsonify({"status": "success", "data": data})
+        except Exception as e:
+            return error_response(e)
+    return view
+
+
+def _order_operation(method, key="order_id", filters=None):
+    # Order writes, answered as {"status": "success", key: result}
+    async def view():
+        kite = get_kite_instance(async_pool)
+        if not kite:
+            return _unauthorized()
+
+        try:
+            data = request.get_json(silent=filters is not None) or {}
+            if filters is not None:
+                result = await getattr(kite, method)(**{k: data[k] for k in filters if k in data})
+            elif method == 'place_orders':
+                result = await kite.place_orders(data['orders'], simultaneous=bool(data.get('simultaneous')))
+            else:
+                result = await getattr(kite, method)(**data)
+            await asyncio.to_thread(read_cache.invalidate, kite.enctoken, ORDER_WRITE_RESOURCES)
+            return jsonify({"status": "success", key: result})
+        except Exception as e:
+            return error_response(e)
+    return view
+
+
+async def get_orders():
+    kite = get_kite_instance(async_pool)
+    if not kite:
+        return _unauthorized()
+
+    try:
+        book = order_books.get(kite.enctoken)
+        # The book records and reads its changes in the shared SQLite order log, off the loop
+        await asyncio.to_thread(book.refresh, await _cached(kite, 'orders', kite.orders))
+        since = request.args.get('since')
+        wait = min(float(request.args.get('wait', 0)), MAX_WAIT)
+        if since is None and not wait:
+            return orders_response(book)
+        orders, cursor = await _order_changes(kite, book, book.cursor if since is None else int(since), wait)
+        return jsonify({"status": "success", "data": orders, "cursor": cursor})
+    except Exception as e:
+        return error_response(e)
+
+
+async def _order_changes(kite, book, since, wait):
+    # Postbacks and ticker order messages seen by this worker wake the wait early; upstream and
+    # the changes other workers recorded are polled meanwhile
+    deadline = time.monotonic() + wait
+    while True:
+        orders, cursor = await asyncio.to_thread(book.changes, since)
+        remaining = deadline - time.monotonic()
+        if orders or remaining <= 0:
+            return orders, cursor
+        await book.await_change(since, min(POLL_INTERVAL, remaining))
+        await asyncio.to_thread(book.refresh, await _cached(kite, 'orders', kite.orders))
+
+
+class AsyncStream(Response):
+    """Streamed response whose chunks come from an async iterator on the event loop."""
+
+    def __init__(self, chunks, **kwargs):
+        super().__init__(iter(()), **kwargs)
+        self.chunks = chunks
+
+
+async def _cached(kite, resource, fetch):
+    """read_cache.get for coroutine `fetch`, which runs on this loop when the cache misses."""
+    loop = asyncio.get_running_loop()
+
+    def fetch_on_loop():
+        return asyncio.run_coroutine_threadsafe(fetch(), loop).result()
+    return await asyncio.to_thread(read_cache.get, kite.enctoken, resource, fetch_on_loop)
+
+
+async def ticker_stream():
+    kite = get_kite_instance(async_pool)
+    if not kite:
+        return _unauthorized()
+
+    try:
+        ticker = user_ticker(kite, (await _cached(kite, 'profile', kite.profile))['user_id'])
+        instruments = instrument_args()
+        table = None
+        if any(not instrument.isdigit() for instrument in instruments):
+            table = await kite.instrument_table()
+        tokens = ticker_tokens(instruments, table.lookup if table else None)
+        if tokens:
+            ticker.subscribe(tokens, request.args.get('mode', MODE_QUOTE))
+        subscriber = ticker.listen(tokens, asyncio.get_running_loop())
+        return AsyncStream(_ticker_events(ticker, subscriber), mimetype='text/event-stream', headers=SSE_HEADERS)
+    except Exception as e:
+        return error_response(e)
+
+
+async def _ticker_events(ticker, subscriber):
+    try:
+        yield ': connected\n\n'
+        while not ticker.stopped:
+            yield sse_events(*await subscriber.aget(TICKER_KEEPALIVE))
+        yield f'event: error\ndata: {json.dumps(ticker.error)}\n\n'
+    finally:
+        ticker.remove(subscriber)
+
+
+ASYNC_ROUTES = {
+    ('/ticker/stream', 'GET'): ticker_stream,
+    ('/orders', 'GET'): get_orders,
+    ('/historical-data', 'GET'): get_historical_data,
+    ('/quote', 'GET'): _market_data('quote'),
+    ('/quote', 'POST'): _market_data('quote'),
+    ('/ohlc', 'GET'): _market_data('ohlc'),
+    ('/ohlc', 'POST'): _market_data('ohlc'),
+    ('/ltp', 'GET'): _market_data('ltp'),
+    ('/ltp', 'POST'): _market_data('ltp'),
+    ('/place-order', 'POST'): _order_operation('place_order'),
+    ('/place-orders', 'POST'): _order_operation('place_orders', key="data"),
+    ('/modify-order', 'PUT'): _order_operation('modify_order'),
+    ('/cancel-order', 'DELETE'): _order_operation('cancel_order'),
+    ('/cancel-all-orders', 'POST'): _order_operation(
+        'cancel_all_orders', "data", ('tag', 'tradingsymbol', 'product', 'exchange')),
+    ('/exit-sl-orders', 'POST'): _order_operation(
+        'exit_sl_orders', "data", ('tag', 'tradingsymbol', 'product', 'exchange')),
+    ('/square-off-positions', 'POST'): _order_operation(
+        'square_off_positions', "data", ('product', 'tradingsymbol', 'exchange', 'tag')),
+}
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _serve_async(view, scope, receive, send):
+    """
+    Run a coroutine view inside a Flask request context, so request parsing,
+    the session cookie, CORS and after_request hooks behave as for Flask routes.
+    """
+    bridge = WsgiToAsgiInstance(flask_app)
+    bridge.scope = scope
+    environ = bridge.build_environ(scope, io.BytesIO(await _read_body(receive)))
+    ctx = flask_app.request_context(environ)
+    ctx.push()
+    error = None
+    try:
+        try:
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await view()
+            response = flask_app.make_response(rv)
+        except Exception as e:
+            error = e
+            response = flask_app.make_response(flask_app.handle_exception(e))
+        response = flask_app.process_response(response)
+        body, status, headers = response.get_wsgi_response(environ)
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers],
+        })
+        if isinstance(response, AsyncStream):
+            await _send_stream(response.chunks, receive, send)
+        else:
+            for chunk in body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+    finally:
+        ctx.pop(error)
+
+
+async def _send_stream(chunks, receive, send):
+    # Stop producing once the client goes away, servers drop sends after a disconnect
+    async def disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnected = asyncio.ensure_future(disconnect())
+    try:
+        async for chunk in chunks:
+            if disconnected.done():
+                break
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    finally:
+        disconnected.cancel()
+        await chunks.aclose()
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.gather(*(kite.aclose() for kite in async_pool.clear()))
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    view = ASYNC_ROUTES.get((scope['path'], scope['method']))
+    if view is None:
+        return await WsgiBridge(flask_app)(scope, receive, send)
+    return await _serve_async(view, scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
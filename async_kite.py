@@ -0,0 +1,505 @@
+import asyncio
+import hashlib
+import random
+import time
+import weakref
+
+import aiohttp
+
+from candle_store import candle_store, format_bound, request_bounds, split_range, today_start
+from candles import Candles, candle_datetime, candle_epoch, interval_minutes
+from instrument_cache import IST
+from kite_trade import (BACKOFF, HISTORICAL_RATE, KITE_API_URL, KITE_URL, OPEN_ORDER_STATUSES, ORDER_RATE,
+                        QUOTE_BATCH_SIZE, RATE_LIMITS, RETRIES_429, KiteApp, KiteConstants, _matches, _retry_after,
+                        validate_order)
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_POOL_SIZE, observe_upstream
+from quote_cache import quote_cache
+from rate_limit import RateLimiter
+from ticker import live_modes, live_quotes
+from tracing import span
+from transport import (CONNECT_TIMEOUT, READ_TIMEOUT, RETRIES, RETRY_BACKOFF, RETRY_METHODS, RETRY_STATUSES,
+                       KiteError, check_payload, network_error)
+
+
+def _query(params):
+    # aiohttp wants a flat list of string pairs; lists become repeated keys like requests does
+    items = []
+    for key, value in params.items():
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            items.append((key, str(item)))
+    return items
+
+
+def _form(params):
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+_semaphores = weakref.WeakValueDictionary()
+
+
+def loop_semaphore(limiter, limit):
+    """kite_trade.limiter_semaphore for the coroutines of the worker's event loop."""
+    semaphore = _semaphores.get(limiter.key)
+    if semaphore is None:
+        semaphore = _semaphores[limiter.key] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+class AsyncKiteApp(KiteConstants):
+    """
+    asyncio counterpart of KiteApp with the same methods as coroutines. Upstream
+    calls share one pooled keep-alive aiohttp session per user, so a single event
+    loop can keep hundreds of them in flight. Rate limit buckets, the candle store
+    and the quote cache are the same ones KiteApp uses.
+    """
+
+    # Upstream connection pool
+    CONNECTION_LIMIT = 100
+    KEEPALIVE_TIMEOUT = 30
+
+    def __init__(self, enctoken):
+        self.enctoken = enctoken
+        self.headers = {
+            "x-kite-version": "3",
+            'Authorization': 'enctoken {}'.format(self.enctoken)
+        }
+        self.invalidated = False
+        user = hashlib.sha256(enctoken.encode()).hexdigest()[:16]
+        self.limiters = {name: RateLimiter(f"{user}:{name}", rate) for name, rate in RATE_LIMITS.items()}
+        self.api_key = "kite"
+        self.user_id = "KK7143"
+        self.root2 = f"{KITE_URL}/oms"
+        self.root_url_new = KITE_API_URL
+        self.root_url = f"{KITE_URL}/oms"
+        self._session = None
+        self._sync = None
+
+    @property
+    def session(self):
+        # Created on first use, inside the event loop that will drive it
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.CONNECTION_LIMIT, keepalive_timeout=self.KEEPALIVE_TIMEOUT)
+            timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers, timeout=timeout)
+            UPSTREAM_POOL_SIZE.labels('async').set(self.CONNECTION_LIMIT)
+        return self._session
+
+    def close(self):
+        """Close from synchronous code such as KiteAppPool eviction."""
+        if self._sync is not None:
+            self._sync.close()
+        if self._session is not None and not self._session.closed:
+            try:
+                asyncio.get_running_loop().create_task(self._session.close())
+            except RuntimeError:
+                pass
+
+    async def aclose(self):
+        if self._sync is not None:
+            self._sync.close()
+        if self._session is not None:
+            await self._session.close()
+
+    async def _request(self, method, url, endpoint="other", acquire=True, params=None, data=None):
+        """
+        Send a request through the rate limiter of its endpoint class and return the
+        HTTP status and decoded JSON body, retrying upstream 429s like
+        KiteApp._request. Waiting for a rate slot suspends only the calling coroutine.
+        Args:
+            endpoint: Rate limit class, one of RATE_LIMITS
+            acquire: False when the caller already reserved the slot
+        """
+        limiter = self.limiters[endpoint]
+        for attempt in range(RETRIES_429 + 1):
+            if acquire or attempt:
+                # The limiter's SQLite transactions may wait on other workers' locks, so off the loop
+                wait = await asyncio.to_thread(limiter.reserve)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            status, body, retry_after = await self._send(method, url, params, data)
+            if status == 403:
+                self.invalidated = True
+            if status != 429 or attempt == RETRIES_429:
+                return status, body
+            delay = retry_after or BACKOFF * 2 ** attempt
+            await asyncio.to_thread(limiter.penalize, delay + random.uniform(0, BACKOFF))
+
+    async def _send(self, method, url, params, data):
+        in_flight = UPSTREAM_IN_FLIGHT.labels('async')
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            status, body, retry_after = await self._attempt(method, url, params, data)
+        except KiteError as e:
+            observe_upstream(method, url, time.perf_counter() - start, error=e.error_type)
+            raise
+        finally:
+            in_flight.dec()
+        observe_upstream(method, url, time.perf_counter() - start, status)
+        return status, body, retry_after
+
+    async def _attempt(self, method, url, params, data):
+        # Same policy as transport.Transport: connection failures are always retried,
+        # timeouts and 5xx answers only for reads Kite cannot have acted on
+        idempotent = method in RETRY_METHODS
+        for retry in range(RETRIES + 1):
+            try:
+                async with self.session.request(method, url, params=_query(params) if params else None,
+                                                data=_form(data) if data is not None else None) as response:
+                    if not (idempotent and response.status in RETRY_STATUSES and retry < RETRIES):
+                        try:
+                            body = await response.json(content_type=None)
+                        except ValueError:
+                            body = None
+                        return response.status, body, _retry_after(response)
+            except aiohttp.ClientConnectorError as e:
+                if retry == RETRIES:
+                    raise network_error(e, method, sent=False) from e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not idempotent or retry == RETRIES:
+                    raise network_error(e, method) from e
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** retry)
+
+    async def _call(self, method, url, endpoint="other", **kwargs):
+        """`data` of a Kite API call; transport.KiteError if it failed in any way."""
+        return check_payload(*await self._request(method, url, endpoint, **kwargs))
+
+    async def _json(self, method, url, endpoint="other", **kwargs):
+        # Raw response body, for the helpers that hand Kite's answer back unchanged
+        return (await self._request(method, url, endpoint, **kwargs))[1]
+
+    def rate_limits(self):
+        return KiteApp.rate_limits(self)
+
+    def _sync_app(self):
+        # The instrument master is loaded and indexed by KiteApp in a worker thread
+        if self._sync is None:
+            self._sync = KiteApp(self.enctoken)
+        return self._sync
+
+    async def instrument_table(self, refresh=False):
+        return await asyncio.to_thread(self._sync_app().instrument_table, refresh)
+
+    async def instruments(self, exchange=None, refresh=False):
+        return await asyncio.to_thread(self._sync_app().instruments, exchange, refresh)
+
+    async def get_instrument(self, instrument_token):
+        return (await self.instrument_table()).get(instrument_token)
+
+    async def lookup(self, exchange, tradingsymbol):
+        return (await self.instrument_table()).lookup(exchange, tradingsymbol)
+
+    async def search_instruments(self, **filters):
+        return (await self.instrument_table()).select(**filters)
+
+    async def _live_quotes(self, instruments, mode):
+        if not live_modes():
+            return {}
+        # Resolving EXCHANGE:TRADINGSYMBOL keys may load the instrument table
+        return await asyncio.to_thread(live_quotes, instruments, mode, self._sync_app().lookup)
+
+    async def quote(self, instruments):
+        instruments = [instruments] if isinstance(instruments, (str, int)) else list(instruments)
+        data = await self._live_quotes(instruments, "quote")
+        missing = [i for i in instruments if str(i) not in data]
+        if missing:
+            data.update(await self._call("GET", f"{self.root_url}/quote", "quote", params={"i": missing}))
+        return data
+
+    async def ltp(self, instruments):
+        instruments = [instruments] if isinstance(instruments, (str, int)) else list(instruments)
+        local = await self._live_quotes(instruments, "ltp")
+        missing = [i for i in instruments if str(i) not in local]
+        if not missing:
+            return {"status": "success", "data": local}
+        data = await self._json("GET", f"{self.root_url}/quote/ltp", "quote", params={"i": missing})
+        if isinstance(data, dict) and isinstance(data.get("data"), dict):
+            data["data"].update(local)
+        return data
+
+    async def market_data(self, instruments, mode="quote"):
+        """See KiteApp.market_data."""
+        if mode not in QUOTE_BATCH_SIZE:
+            raise ValueError(f"Unsupported quote mode {mode}")
+        instruments = list(instruments)
+        data = await self._live_quotes(instruments, mode)
+        missing = [i for i in instruments if str(i) not in data]
+        if missing:
+            data.update(await quote_cache.aget(mode, missing, lambda missing: self._quote_batches(mode, missing)))
+        return data
+
+    async def _quote_batches(self, mode, instruments):
+        size = QUOTE_BATCH_SIZE[mode]
+        batches = [instruments[i:i + size] for i in range(0, len(instruments), size)]
+        data = {}
+        for result in await asyncio.gather(*(self._quote_batch(mode, batch) for batch in batches)):
+            data.update(result)
+        return data
+
+    async def _quote_batch(self, mode, instruments):
+        path = "/quote" if mode == "quote" else f"/quote/{mode}"
+        return await self._call("GET", f"{self.root_url}{path}", "quote", params={"i": instruments})
+
+    async def historical_data(self, instrument_token, from_date, to_date, interval, continuous=False, oi=False):
+        params = {"from": from_date,
+                  "to": to_date,
+                  "interval": interval,
+                  "continuous": 1 if continuous else 0,
+                  "oi": 1 if oi else 0}
+        lst = (await self._call(
+            "GET", f"{self.root_url}/instruments/historical/{instrument_token}/{interval}", "historical",
+            params=params))["candles"]
+        return [self._record(candle) for candle in lst]
+
+    async def historical_data_v2(self, instrument_token, from_date, to_date, interval="minute", oi=False):
+        candles = await self._historical_candles(instrument_token, from_date, to_date, interval, oi)
+        if candles is None:
+            return []
+        return [self._record(candle) for candle in candles]
+
+    @staticmethod
+    def _record(candle):
+        record = {"date": candle_datetime(candle[0]), "open": candle[1], "high": candle[2], "low": candle[3],
+                  "close": candle[4], "volume": candle[5]}
+        if len(candle) == 7:
+            record["oi"] = candle[6]
+        return record
+
+    async def _historical_candles(self, instrument_token, from_date, to_date, interval, oi):
+        """See KiteApp._historical_candles; chunks are fetched concurrently on the event loop."""
+        try:
+            chunks = split_range(*request_bounds(from_date, to_date), interval)
+        except ValueError:
+            chunks = []
+        if len(chunks) <= 1:
+            return await self._historical_request(instrument_token, from_date, to_date, interval, oi)
+        results = await self._paced("historical", HISTORICAL_RATE, lambda chunk: self._historical_request(
+            instrument_token, format_bound(chunk[0]), format_bound(chunk[1] - 1), interval, oi), chunks)
+        candles = []
+        last = None
+        for result in results:
+            if result is None:
+                return None
+            for candle in result:
+                ts = candle_epoch(candle[0])
+                if last is None or ts > last:
+                    candles.append(candle)
+                    last = ts
+        return candles
+
+    async def _paced(self, endpoint, limit, fn, items):
+        """
+        Results of coroutine fn(item) for every item, at most `limit` of the user's
+        at a time, so they join the rate limit queue as KiteApp._paced feeds it
+        instead of all at once, which would fail the tail with RateLimitExceeded.
+        """
+        slots = loop_semaphore(self.limiters[endpoint], limit)
+
+        async def run(item):
+            async with slots:
+                return await fn(item)
+        return await asyncio.gather(*(run(item) for item in items))
+
+    async def _historical_request(self, instrument_token, from_date, to_date, interval, oi):
+        params = {
+            "user_id": self.user_id,
+            "from": from_date,
+            "to": to_date,
+            "oi": 1 if oi else 0
+        }
+        data = await self._call(
+            "GET", f"{self.root2}/instruments/historical/{instrument_token}/{interval}", "historical",
+            params=params)
+        return data.get("candles")
+
+    async def historical_data_cached(self, instrument_token, from_date, to_date, interval="minute", oi=False):
+        return (await self.historical_columns(instrument_token, from_date, to_date, interval, oi)).to_records(IST)
+
+    async def historical_columns(self, instrument_token, from_date, to_date, interval="minute", oi=False,
+                                 resample=None, session="NSE", aggregation=None):
+        """See KiteApp.historical_columns. Missing sub-ranges are fetched concurrently."""
+        if resample is not None:
+            minutes = interval_minutes(resample)
+            if minutes % interval_minutes(interval):
+                raise ValueError(f"Cannot resample {interval} candles to {resample}")
+        key, start, end, gaps = await asyncio.to_thread(
+            candle_store.plan, instrument_token, interval, oi, from_date, to_date)
+        live_from = today_start()
+
+        async def fill(lo, hi):
+            candles = await self._historical_candles(
+                instrument_token, format_bound(lo), format_bound(hi - 1), interval, oi)
+            if candles is None:
+                raise Exception(f"Historical data unavailable for {instrument_token} "
+                                f"{format_bound(lo)} - {format_bound(hi - 1)}")
+            await asyncio.to_thread(candle_store.write, key, candles, lo, hi, live_from)
+
+        await asyncio.gather(*(fill(lo, hi) for lo, hi in gaps))
+        rows = await asyncio.to_thread(candle_store.read, key, start, end)
+        with span('parse'):
+            candles = Candles.from_rows(rows, oi)
+            if resample is not None:
+                candles = candles.resample(minutes, session, aggregation)
+        return candles
+
+    async def margins(self):
+        return await self._call("GET", f"{self.root_url}/user/margins")
+
+    async def profile(self):
+        return await self._call("GET", f"{self.root_url}/user/profile/full")
+
+    async def orders(self):
+        return await self._call("GET", f"{self.root_url}/orders")
+
+    async def positions(self):
+        return await self._call("GET", f"{self.root_url}/portfolio/positions")
+
+    async def holdings(self):
+        return await self._call("GET", f"{self.root_url}/portfolio/holdings")
+
+    async def place_order(self, variety, exchange, tradingsymbol, transaction_type, quantity, product, order_type,
+                          price=None, validity=None, disclosed_quantity=None, trigger_price=None, squareoff=None,
+                          stoploss=None, trailing_stoploss=None, tag=None):
+        params = locals()
+        del params["self"]
+        for k in list(params.keys()):
+            if params[k] is None:
+                del params[k]
+        return await self._place_order(params)
+
+    async def _place_order(self, params, acquire=True):
+        return (await self._call("POST", f"{self.root_url}/orders/{params['variety']}", "order",
+                                 acquire=acquire, data=params))["order_id"]
+
+    async def place_orders(self, orders, simultaneous=False):
+        """See KiteApp.place_orders."""
+        errors = {i: problems for i, problems in enumerate(map(validate_order, orders)) if problems}
+        if errors:
+            raise ValueError("; ".join(f"order {i}: {', '.join(problems)}" for i, problems in errors.items()))
+        legs = [{k: v for k, v in order.items() if v is not None} for order in orders]
+        if simultaneous and len(legs) > ORDER_RATE:
+            raise ValueError(f"At most {ORDER_RATE} orders can be placed simultaneously")
+
+        async def submit(params, acquire=True):
+            try:
+                return {"status": "success", "order_id": await self._place_order(params, acquire)}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        if simultaneous:
+            # Reserve every rate slot up front so all legs leave together
+            wait = await asyncio.to_thread(self.limiters["order"].reserve, len(legs))
+            if wait > 0:
+                await asyncio.sleep(wait)
+            return list(await asyncio.gather(*(submit(params, acquire=False) for params in legs)))
+        return list(await self._paced("order", ORDER_RATE, submit, legs))
+
+    async def modify_order(self, variety, order_id, parent_order_id=None, quantity=None, price=None, order_type=None,
+                           trigger_price=None, validity=None, disclosed_quantity=None):
+        params = locals()
+        del params["self"]
+        for k in list(params.keys()):
+            if params[k] is None:
+                del params[k]
+        return (await self._call("PUT", f"{self.root_url}/orders/{variety}/{order_id}", "order",
+                                 data=params))["order_id"]
+
+    async def cancel_order(self, variety, order_id, parent_order_id=None):
+        return (await self._call("DELETE", f"{self.root_url}/orders/{variety}/{order_id}", "order",
+                                 data={"parent_order_id": parent_order_id} if parent_order_id else {}))["order_id"]
+
+    async def _market_order(self, params):
+        return await self._json("POST", f"{self.root_url}/orders/regular", "order", data=params)
+
+    async def buy_equity(self, tradingsymbol, quantity, transaction_type, tag=None):
+        return await self._market_order({'exchange': 'NSE', 'tradingsymbol': tradingsymbol,
+                                         'transaction_type': transaction_type, 'quantity': quantity,
+                                         'product': 'CNC', 'order_type': 'MARKET', 'tag': tag})
+
+    async def buy(self, tradingsymbol, quantity, transaction_type, tag=None):
+        return await self._market_order({'exchange': 'NFO', 'tradingsymbol': tradingsymbol,
+                                         'transaction_type': transaction_type, 'quantity': quantity,
+                                         'product': 'MIS', 'order_type': 'MARKET', 'tag': tag})
+
+    async def buy_limit(self, tradingsymbol, quantity, price, transaction_type, tag=None):
+        return await self._market_order({'exchange': 'NFO', 'tradingsymbol': tradingsymbol,
+                                         'transaction_type': transaction_type, 'quantity': quantity,
+                                         'product': 'MIS', 'price': price, 'order_type': 'LIMIT', 'tag': tag})
+
+    async def sell_target(self, tradingsymbol, quantity, price, tag=None):
+        return await self._market_order({'exchange': 'NFO', 'tradingsymbol': tradingsymbol,
+                                         'transaction_type': 'SELL', 'price': price, 'quantity': quantity,
+                                         'product': 'MIS', 'order_type': 'LIMIT', 'tag': tag})
+
+    async def sell_sl(self, tradingsymbol, quantity, price, trigger_price, tag=None):
+        return await self._market_order({'exchange': 'NFO', 'tradingsymbol': tradingsymbol,
+                                         'transaction_type': 'SELL', 'price': price,
+                                         'trigger_price': trigger_price, 'quantity': quantity,
+                                         'product': 'MIS', 'order_type': 'SL', 'tag': tag})
+
+    async def modify_order_exit(self, order_id, quantity):
+        params = {'order_id': order_id,
+                  'quantity': quantity,
+                  'order_type': 'MARKET',
+                  'validity': 'DAY'}
+        return await self._json("PUT", f"{self.root_url}/orders/regular/{order_id}", "order", data=params)
+
+    async def cancel_all_orders(self, tag=None, tradingsymbol=None, product=None, exchange=None):
+        orders = [o for o in await self.orders()
+                  if o.get("status") in OPEN_ORDER_STATUSES and _matches(o, tag, tradingsymbol, product, exchange)]
+        return await self._bulk(
+            orders, lambda o: self.cancel_order(o["variety"], o["order_id"], o.get("parent_order_id")))
+
+    async def exit_sl_orders(self, tag=None, tradingsymbol=None, product=None, exchange=None):
+        orders = [o for o in await self.orders()
+                  if o.get("status") == "TRIGGER PENDING"
+                  and o.get("order_type") in (self.ORDER_TYPE_SL, self.ORDER_TYPE_SLM)
+                  and _matches(o, tag, tradingsymbol, product, exchange)]
+
+        async def exit_order(o):
+            response = await self.modify_order_exit(o["order_id"], o.get("pending_quantity") or o["quantity"])
+            if "data" not in response:
+                raise Exception(response.get("message", "Order modification failed"))
+            return response["data"]["order_id"]
+
+        return await self._bulk(orders, exit_order)
+
+    async def square_off_positions(self, product=KiteConstants.PRODUCT_MIS, tradingsymbol=None, exchange=None,
+                                   tag=None):
+        positions = [p for p in (await self.positions())["net"]
+                     if p.get("quantity") and _matches(p, None, tradingsymbol, product, exchange)]
+
+        def close(p):
+            return self.place_order(
+                variety=self.VARIETY_REGULAR,
+                exchange=p["exchange"],
+                tradingsymbol=p["tradingsymbol"],
+                transaction_type=self.TRANSACTION_TYPE_SELL if p["quantity"] > 0 else self.TRANSACTION_TYPE_BUY,
+                quantity=abs(p["quantity"]),
+                product=p["product"],
+                order_type=self.ORDER_TYPE_MARKET,
+                tag=tag)
+
+        return await self._bulk(positions, close)
+
+    async def _bulk(self, items, action):
+        async def run(item):
+            result = {"tradingsymbol": item.get("tradingsymbol"), "exchange": item.get("exchange")}
+            if item.get("order_id"):
+                result["order_id"] = item["order_id"]
+            try:
+                result["order_id"] = await action(item)
+                result["status"] = "success"
+            except Exception as e:
+                result["status"] = "error"
+                result["message"] = str(e)
+            return result
+
+        results = await self._paced("order", ORDER_RATE, run, items)
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        return {
+            "requested": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": list(results)
+        }
@@ -0,0 +1,92 @@
+"""
+Micro-benchmark: instrument CSV parsing, legacy split/dateutil loop vs instrument_parser.
+
+    python benchmarks/bench_instrument_parser.py [--rows 100000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dateutil.parser  # noqa: E402
+
+from instrument_parser import parse_instruments  # noqa: E402
+
+HEADER = "instrument_token,exchange_token,tradingsymbol,name,last_price,expiry,strike,tick_size,lot_size,instrument_type,segment,exchange\n"
+
+
+def synthetic_dump(rows, seed=7):
+    """A dump shaped like the real one: mostly NFO options over a few dozen expiries."""
+    rnd = random.Random(seed)
+    expiries = [(date(2024, 10, 3) + timedelta(weeks=i)).isoformat() for i in range(40)]
+    names = ["NIFTY", "BANKNIFTY", "FINNIFTY", "RELIANCE", "INFY", "TCS", "HDFCBANK", "SBIN"]
+    lines = [HEADER]
+    for i in range(rows):
+        token = 100000 + i
+        if i % 10 == 0:
+            name = rnd.choice(names)
+            lines.append(f'{token},{token >> 8},{name}-EQ,"{name} LTD",0,,0,0.05,1,EQ,NSE,NSE\n')
+            continue
+        name = rnd.choice(names)
+        expiry = rnd.choice(expiries)
+        strike = rnd.randrange(100, 600) * 50
+        kind = rnd.choice(("CE", "PE"))
+        lines.append(f'{token},{token >> 8},{name}{expiry[2:4]}{strike}{kind},"{name}",0,{expiry},'
+                     f'{strike},0.05,{rnd.choice((15, 25, 50))},{kind},NFO-OPT,NFO\n')
+    return "".join(lines).encode()
+
+
+def legacy_parse(text):
+    """The loop KiteApp.instruments() used before the dedicated parser."""
+    data = text.split("\n")
+    out = []
+    for i in data[1:-1]:
+        row = i.split(",")
+        out.append({
+            'instrument_token': int(row[0]),
+            'exchange_token': row[1],
+            'tradingsymbol': row[2],
+            'name': row[3][1:-1],
+            'last_price': float(row[4]),
+            'expiry': dateutil.parser.parse(row[5]).date() if row[5] != "" else None,
+            'strike': float(row[6]),
+            'tick_size': float(row[7]),
+            'lot_size': int(row[8]),
+            'instrument_type': row[9],
+            'segment': row[10],
+            'exchange': row[11]
+        })
+    return out
+
+
+def best_of(repeat, fn, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw = synthetic_dump(args.rows)
+    legacy = best_of(args.repeat, lambda: legacy_parse(raw.decode()))
+    fast = best_of(args.repeat, parse_instruments, raw)
+
+    print(f"rows: {args.rows}  ({len(raw) / 1e6:.1f} MB)")
+    print(f"legacy split+dateutil : {legacy:8.3f}s  {args.rows / legacy:12,.0f} rows/s")
+    print(f"instrument_parser     : {fast:8.3f}s  {args.rows / fast:12,.0f} rows/s")
+    print(f"speedup               : {legacy / fast:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
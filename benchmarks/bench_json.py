@@ -0,0 +1,82 @@
+"""
+Micro-benchmark: encoding large responses with Flask's default JSON provider,
+the stdlib provider and the orjson provider (json_provider.py).
+
+    python benchmarks/bench_json.py [--rows 100000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+from json_provider import OrjsonProvider, StdlibProvider, orjson  # noqa: E402
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+
+def instrument_rows(count, seed=7):
+    """Rows shaped like /instruments answers, with a date expiry."""
+    rnd = random.Random(seed)
+    return [{
+        "instrument_token": 12000000 + i,
+        "exchange_token": str(47000 + i),
+        "tradingsymbol": f"NIFTY24OCT{20000 + 50 * (i % 400)}{'CE' if i % 2 else 'PE'}",
+        "name": "NIFTY",
+        "last_price": round(rnd.uniform(0, 500), 2),
+        "expiry": date(2024, 10, 31) + timedelta(weeks=i % 8),
+        "strike": 20000.0 + 50 * (i % 400),
+        "tick_size": 0.05,
+        "lot_size": 25,
+        "instrument_type": "CE" if i % 2 else "PE",
+        "segment": "NFO-OPT",
+        "exchange": "NFO",
+    } for i in range(count)]
+
+
+def candle_records(count, seed=7):
+    """Records shaped like /historical-data answers, with an aware datetime per candle."""
+    rnd = random.Random(seed)
+    start = datetime(2024, 1, 1, 9, 15, tzinfo=IST)
+    return [{"date": start + timedelta(minutes=i), "open": rnd.uniform(100, 200), "high": rnd.uniform(200, 300),
+             "low": rnd.uniform(50, 100), "close": rnd.uniform(100, 200), "volume": rnd.randrange(10 ** 6)}
+            for i in range(count)]
+
+
+def best_of(repeat, fn, payload):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    providers = [("flask default", DefaultJSONProvider(app)), ("stdlib", StdlibProvider(app))]
+    if orjson is not None:
+        providers.append(("orjson", OrjsonProvider(app)))
+    for label, rows in (("instruments", instrument_rows(args.rows)), ("candle records", candle_records(args.rows))):
+        payload = {"status": "success", "data": rows}
+        print(f"{label}: {args.rows:,} rows")
+        baseline = None
+        for name, provider in providers:
+            elapsed = best_of(args.repeat, provider.dumps, payload)
+            baseline = baseline or elapsed
+            print(f"  {name:14}: {elapsed:8.3f}s  {args.rows / elapsed:12,.0f} rows/s  {baseline / elapsed:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
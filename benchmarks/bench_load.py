@@ -0,0 +1,340 @@
+"""
+Load benchmark: the API under gunicorn, talking to mock_kite.py instead of the
+broker. Measures
+  - parse throughput of KiteApp against the mock (instrument dump, historical candles)
+  - latency percentiles and throughput per endpoint at a fixed concurrency
+  - the most requests per second a mix of endpoints sustains within a p99 budget
+Each run is saved as JSON; --compare prints the change against an earlier run
+and exits 1 when a metric got worse by more than --tolerance.
+
+    python benchmarks/bench_load.py [--workers 2] [--latency 20] [--concurrency 8] [--duration 5]
+                                    [--endpoints ltp,orders] [--mix orders,positions] [--slo-ms 250]
+                                    [--compare benchmarks/results/<run>.json]
+
+The load generator shares the machine with gunicorn and the mock, so compare
+runs made on the same machine only.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import aiohttp  # noqa: E402
+
+from mock_kite import MockServer, wait_ready  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# Requests by name, all served from the mock's synthetic data
+ENDPOINTS = {
+    "ltp": ("GET", "/ltp?i=NSE:INFY&i=NSE:TCS&i=256265"),
+    "quote": ("GET", "/quote?i=NSE:INFY&i=NSE:TCS&i=256265"),
+    "historical": ("GET", "/historical-data?instrument_token=100001&from_date=2024-01-01&to_date=2024-01-31"
+                          "&interval=minute"),
+    "historical-columns": ("GET", "/historical-data?instrument_token=100001&from_date=2024-01-01"
+                                  "&to_date=2024-01-31&interval=minute&format=columns"),
+    "instruments": ("GET", "/instruments?exchange=NFO&name=NIFTY"
+                           "&fields=instrument_token,tradingsymbol,expiry,strike"),
+    "instrument-lookup": ("GET", "/instruments/lookup?instrument_token=100001"),
+    "orders": ("GET", "/orders"),
+    "positions": ("GET", "/positions"),
+    "holdings": ("GET", "/holdings"),
+    "margins": ("GET", "/margins"),
+    "profile": ("GET", "/profile"),
+}
+# Light reads a busy dashboard polls, large answers (historical, instruments) are measured on their own
+DEFAULT_MIX = "orders,positions,holdings,margins,instrument-lookup"
+
+# Metrics where a larger value is better, the rest are latencies
+HIGHER_IS_BETTER = ("per_s", "rps")
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 0.5) * 1000, 2) if ordered else None,
+        "p90_ms": round(percentile(ordered, 0.9) * 1000, 2) if ordered else None,
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2) if ordered else None,
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def drive(base_url, requests_, enctokens, concurrency, duration):
+    """
+    Closed loop load: `concurrency` clients each send the next of `requests_` as
+    soon as their previous answer arrived, for `duration` seconds.
+    """
+    latencies = []
+    statuses = Counter()
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(base_url, connector=connector) as session:
+        async def client(n):
+            headers = {"X-Enctoken": enctokens[n % len(enctokens)], "Accept-Encoding": "gzip"}
+            i = n
+            while time.perf_counter() < deadline:
+                method, path = requests_[i % len(requests_)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    async with session.request(method, path, headers=headers) as response:
+                        await response.read()
+                        status = response.status
+                except aiohttp.ClientError:
+                    status = 599
+                latencies.append(time.perf_counter() - start)
+                statuses[status] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(n) for n in range(concurrency)))
+        return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def local_kite(mock_url, cache_dir):
+    """KiteApp in this process talking to the mock, caching where the app under test will."""
+    os.environ["KAPI_KITE_URL"] = os.environ["KAPI_KITE_API_URL"] = mock_url
+    os.environ["KAPI_CACHE_DIR"] = cache_dir
+    from kite_trade import KiteApp
+    return KiteApp("bench-local")
+
+
+def parse_throughput(kite):
+    """Rows or candles per second KiteApp decodes, timed in this process against the mock."""
+    from instrument_cache import instrument_cache
+    from instrument_parser import parse_instruments
+
+    results = {}
+
+    def timed(name, fn, count_of):
+        start = time.perf_counter()
+        count = count_of(fn())
+        elapsed = time.perf_counter() - start
+        results[name] = {"count": count, "seconds": round(elapsed, 4), "per_s": round(count / elapsed, 1)}
+
+    timed("instruments_download_parse", lambda: kite.instrument_table(refresh=True), len)
+    timed("instruments_parse", lambda: parse_instruments(instrument_cache.path), len)
+    # 60 days of minute candles, the most Kite serves in one call
+    span = ("2024-01-01", "2024-02-29")
+    timed("historical_data_v2", lambda: kite.historical_data_v2(100001, *span, "minute"), len)
+    timed("historical_columns_fetch", lambda: kite.historical_columns(100002, *span, "minute"), len)
+    timed("historical_columns_store", lambda: kite.historical_columns(100002, *span, "minute"), len)
+    return results
+
+
+class App:
+    """gunicorn serving kite_api:app with gunicorn.conf.py, pointed at the mock, for a `with` block."""
+
+    def __init__(self, port, mock_url, cache_dir, workers, threads, env=()):
+        self.url = f"http://127.0.0.1:{port}"
+        self.args = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+                     "--workers", str(workers)]
+        if threads > 1:
+            self.args += ["--worker-class", "gthread", "--threads", str(threads)]
+        else:
+            self.args += ["--worker-class", "sync"]
+        self.args.append("kite_api:app")
+        # Prewarmed as recommended for production, or every worker gunicorn forks (again after each
+        # max_requests) parses the instrument table on its first lookup
+        self.env = dict(os.environ, KAPI_KITE_URL=mock_url, KAPI_KITE_API_URL=mock_url, KAPI_CACHE_DIR=cache_dir,
+                        PROMETHEUS_MULTIPROC_DIR=os.path.join(cache_dir, "metrics"), KAPI_PREWARM="1")
+        self.env.update(item.split("=", 1) for item in env)
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.args, cwd=ROOT, env=self.env, stderr=subprocess.DEVNULL)
+        wait_ready(f"{self.url}/swagger.json", self.process)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+def login(app_url, users):
+    import requests
+    enctokens = []
+    for n in range(users):
+        response = requests.post(f"{app_url}/login", json={"userid": f"BENCH{n}", "password": "x", "twofa": "1"},
+                                 timeout=30)
+        response.raise_for_status()
+        enctokens.append(response.json()["enctoken"])
+    return enctokens
+
+
+def max_rps(app_url, requests_, enctokens, slo_ms, max_concurrency, duration):
+    """Double the concurrency until p99 exceeds `slo_ms`, errors pass 1% or throughput stops growing."""
+    best, steps = None, []
+    concurrency = 1
+    while concurrency <= max_concurrency:
+        result = asyncio.run(drive(app_url, requests_, enctokens, concurrency, duration))
+        result["concurrency"] = concurrency
+        steps.append(result)
+        print(f"  concurrency {concurrency:4}: {result['rps']:8.1f} rps  p99 {result['p99_ms']:8.2f} ms  "
+              f"errors {result['errors']}")
+        if result["p99_ms"] > slo_ms or result["errors"] > 0.01 * result["count"]:
+            break
+        if best is not None and result["rps"] < best["rps"] * 1.05:
+            best = max(best, result, key=lambda r: r["rps"])
+            break
+        best = result
+        concurrency *= 2
+    summary = {"rps": best["rps"], "concurrency": best["concurrency"], "p99_ms": best["p99_ms"]} if best else \
+        {"rps": 0, "concurrency": 0, "p99_ms": None}
+    summary["steps"] = steps
+    return summary
+
+
+def flatten(results):
+    """Comparable metrics of a run as {"section.name.metric": value}."""
+    metrics = {}
+    for name, values in results["parse"].items():
+        metrics[f"parse.{name}.per_s"] = values["per_s"]
+    for name, values in results["latency"].items():
+        for key in ("rps", "p50_ms", "p90_ms", "p99_ms"):
+            metrics[f"latency.{name}.{key}"] = values[key]
+    if "max_rps" in results:
+        metrics["max_rps.rps"] = results["max_rps"]["rps"]
+    return metrics
+
+
+def compare(baseline, current, tolerance):
+    """Print the change of every metric the two runs share, returning the names of regressions."""
+    old, new = flatten(baseline), flatten(current)
+    regressions = []
+    print(f"\n{'metric':48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(old.keys() & new.keys()):
+        if not old[name] or new[name] is None:
+            continue
+        change = new[name] / old[name] - 1
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if worse > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:48} {old[name]:12,.2f} {new[name]:12,.2f} {change:+8.1%}{flag}")
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per worker, gthread workers when above 1")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Environment of the app, e.g. KAPI_JSON_PROVIDER=stdlib")
+    parser.add_argument("--latency", type=float, default=20.0, help="Milliseconds the mock adds to every answer")
+    parser.add_argument("--jitter", type=float, default=5.0, help="Random extra milliseconds of the mock")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of mock answers that are 500s")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of mock answers that are 429s")
+    parser.add_argument("--users", type=int, default=4, help="Sessions the load is spread over")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Endpoints to measure one by one")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per endpoint")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds of load per endpoint or step")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Endpoints cycled through to find the maximum RPS")
+    parser.add_argument("--slo-ms", type=float, default=250.0, help="p99 latency the maximum RPS must stay within")
+    parser.add_argument("--max-concurrency", type=int, default=256)
+    parser.add_argument("--skip", default="", help="Comma separated stages to skip: parse, latency, max-rps")
+    parser.add_argument("--port", type=int, default=18700, help="Port of the app, the mock listens on the next one")
+    parser.add_argument("--save", default=RESULTS_DIR, help="Directory for the JSON results, '' to not save")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Change counted as a regression")
+    args = parser.parse_args()
+    skip = set(filter(None, args.skip.split(",")))
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    mix = [ENDPOINTS[name] for name in args.mix.split(",") if name]
+
+    results = {"meta": {
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+    }, "parse": {}, "latency": {}}
+    cache_dir = tempfile.mkdtemp(prefix="kapi-bench-")
+    try:
+        with MockServer(args.port + 1) as mock:
+            kite = local_kite(mock.url, cache_dir)
+            if "parse" not in skip:
+                print("parse throughput (in process, mock without latency)")
+                results["parse"] = parse_throughput(kite)
+                for name, values in results["parse"].items():
+                    print(f"  {name:28}: {values['count']:8,} in {values['seconds']:7.3f}s  {values['per_s']:12,.0f}/s")
+            else:
+                # The instrument dump on disk for the gunicorn master to prewarm from
+                kite.instrument_table()
+            mock.configure(latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+                           throttle_rate=args.throttle_rate)
+            with App(args.port, mock.url, cache_dir, args.workers, args.threads, args.app_env) as app:
+                enctokens = login(app.url, args.users)
+                # Reach every worker and fill the candle store the way a running deployment would have
+                asyncio.run(drive(app.url, list(ENDPOINTS.values()), enctokens, 2 * args.workers * args.threads,
+                                  2.0))
+                if "latency" not in skip:
+                    print(f"latency per endpoint ({args.concurrency} clients, {args.duration:g}s each, "
+                          f"mock latency {args.latency:g}ms)")
+                    for name in endpoints:
+                        result = asyncio.run(drive(app.url, [ENDPOINTS[name]], enctokens, args.concurrency,
+                                                   args.duration))
+                        results["latency"][name] = result
+                        print(f"  {name:20}: {result['rps']:8.1f} rps  p50 {result['p50_ms']:8.2f}  "
+                              f"p90 {result['p90_ms']:8.2f}  p99 {result['p99_ms']:8.2f} ms  "
+                              f"errors {result['errors']}")
+                if "max-rps" not in skip:
+                    print(f"maximum rps of {args.mix} within p99 {args.slo_ms:g}ms")
+                    results["max_rps"] = max_rps(app.url, mix, enctokens, args.slo_ms, args.max_concurrency,
+                                                 args.duration)
+                    print(f"  sustained {results['max_rps']['rps']:,.1f} rps at concurrency "
+                          f"{results['max_rps']['concurrency']}")
+            results["mock_stats"] = mock.stats()["requests"]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(args.save, f"load-{stamp}-{results['meta']['commit'] or 'nogit'}.json")
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved {path}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark: Candles.resample with NumPy reduceat vs a per-candle Python loop
+over the same bucketing, on minute candles resampled to common bar widths.
+
+    python benchmarks/bench_resample.py [--days 250] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from candles import IST_OFFSET, Candles  # noqa: E402
+
+# 09:15 to 15:30 IST
+SESSION_MINUTES = 375
+SESSION_OPEN = 9 * 3600 + 15 * 60
+
+
+def synthetic_candles(days, seed=7):
+    """`days` NSE sessions of minute candles with open interest."""
+    rnd = random.Random(seed)
+    candles = Candles(oi=True)
+    day = 1727740800 - IST_OFFSET + SESSION_OPEN
+    price = 20000.0
+    for _ in range(days):
+        for i in range(SESSION_MINUTES):
+            price += rnd.uniform(-5, 5)
+            candles.timestamp.append(day + i * 60)
+            candles.open.append(price)
+            candles.high.append(price + rnd.random() * 3)
+            candles.low.append(price - rnd.random() * 3)
+            candles.close.append(price + rnd.uniform(-2, 2))
+            candles.volume.append(rnd.randrange(10 ** 6))
+            candles.oi.append(rnd.randrange(10 ** 7))
+        day += 86400
+    return candles
+
+
+def loop_resample(candles, minutes):
+    """The per-candle loop resample used before, kept as the baseline."""
+    step = minutes * 60
+    starts, buckets, previous = [], [], None
+    for i, ts in enumerate(candles.timestamp):
+        local = ts + IST_OFFSET
+        session_open = local - local % 86400 + SESSION_OPEN
+        bucket = session_open + (local - session_open) // step * step - IST_OFFSET
+        if bucket != previous:
+            starts.append(i)
+            buckets.append(bucket)
+            previous = bucket
+    bounds = list(zip(starts, starts[1:] + [len(candles)]))
+    return ([candles.open[lo] for lo, hi in bounds], [max(candles.high[lo:hi]) for lo, hi in bounds],
+            [min(candles.low[lo:hi]) for lo, hi in bounds], [candles.close[hi - 1] for lo, hi in bounds],
+            [sum(candles.volume[lo:hi]) for lo, hi in bounds], [candles.oi[hi - 1] for lo, hi in bounds])
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    candles = synthetic_candles(args.days)
+    print(f"candles: {len(candles):,}  ({args.days} sessions of minute bars)")
+    for minutes in (5, 75, 375):
+        loop = best_of(args.repeat, lambda: loop_resample(candles, minutes))
+        vectorized = best_of(args.repeat, lambda: candles.resample(minutes))
+        print(f"{minutes} minute bars")
+        print(f"  per-candle loop : {loop * 1000:8.2f}ms")
+        print(f"  numpy reduceat  : {vectorized * 1000:8.2f}ms")
+        print(f"  speedup         : {loop / vectorized:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
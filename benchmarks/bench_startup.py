@@ -0,0 +1,68 @@
+"""
+Startup benchmark: wall time for a fresh interpreter to import the app and to
+answer its first request, plus the slowest imports by cumulative time.
+
+    python benchmarks/bench_startup.py [--module kite_api] [--runs 5] [--top 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from kite_api import app
+app.test_client().get('/swagger.json')
+answered = time.perf_counter()
+print(imported - start, answered - start)
+"""
+
+
+def run(module, env, importtime=False):
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE.format(module=module)]
+    result = subprocess.run(args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return result
+
+
+def slowest_imports(stderr, top):
+    # -X importtime lines read "import time: <self us> | <cumulative us> | <module>"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="kite_api")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ, KAPI_CACHE_DIR=tempfile.mkdtemp(prefix="kapi-startup-"))
+    run(args.module, env)  # warm the filesystem and bytecode caches
+    imports, firsts = [], []
+    for _ in range(args.runs):
+        imported, answered = map(float, run(args.module, env).stdout.split())
+        imports.append(imported)
+        firsts.append(answered)
+    print(f"{args.module}: {args.runs} fresh interpreters")
+    print(f"  import          : min {min(imports) * 1000:7.1f}ms  median {statistics.median(imports) * 1000:7.1f}ms")
+    print(f"  first response  : min {min(firsts) * 1000:7.1f}ms  median {statistics.median(firsts) * 1000:7.1f}ms")
+    print("  slowest imports (cumulative):")
+    for cumulative, name in slowest_imports(run(args.module, env, importtime=True).stderr, args.top):
+        print(f"    {cumulative / 1000:7.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark: ticker frame decoding, per-packet struct dicts (ticker.decode_frame)
+vs the batch decoder writing into the latest-tick table (tick_table.TickTable.update).
+
+    python benchmarks/bench_tick_decoder.py [--instruments 3000] [--frames 50] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tick_table import TickTable  # noqa: E402
+from ticker import decode_frame  # noqa: E402
+
+
+def full_packet(rnd, token):
+    ltp = rnd.randrange(1000, 5000000)
+    head = struct.pack(">16I", token, ltp, rnd.randrange(1, 500), ltp - 5, rnd.randrange(10 ** 6, 10 ** 8),
+                       rnd.randrange(10 ** 5), rnd.randrange(10 ** 5), ltp - 100, ltp + 100, ltp - 200, ltp - 50,
+                       1700000000, rnd.randrange(10 ** 6), 2 * 10 ** 6, 10 ** 5, 1700000001)
+    depth = b"".join(struct.pack(">IIH2x", rnd.randrange(1, 5000), ltp + i - 5, rnd.randrange(1, 50))
+                     for i in range(10))
+    return head + depth
+
+
+def quote_packet(rnd, token):
+    ltp = rnd.randrange(1000, 5000000)
+    return struct.pack(">11I", token, ltp, 1, ltp, 1000, 10, 10, ltp, ltp, ltp, ltp)
+
+
+def frame(packets):
+    return struct.pack(">H", len(packets)) + b"".join(struct.pack(">H", len(p)) + p for p in packets)
+
+
+def synthetic_frames(instruments, frames, mixed, seed=7):
+    """Full mode frames over NFO option tokens, optionally with every fifth packet in quote mode."""
+    rnd = random.Random(seed)
+    tokens = [(12000000 + i) << 8 | 2 for i in range(instruments)]
+    out = []
+    for _ in range(frames):
+        packets = [quote_packet(rnd, t) if mixed and i % 5 == 0 else full_packet(rnd, t)
+                   for i, t in enumerate(tokens)]
+        out.append(frame(packets))
+    return out
+
+
+def best_of(repeat, fn, frames):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for data in frames:
+            fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instruments", type=int, default=3000)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    ticks = args.instruments * args.frames
+    print(f"ticks: {ticks:,}  ({args.instruments} instruments x {args.frames} frames)")
+    for mixed in (False, True):
+        frames = synthetic_frames(args.instruments, args.frames, mixed)
+        table = TickTable()
+        per_packet = best_of(args.repeat, decode_frame, frames)
+        batch = best_of(args.repeat, table.update, frames)
+        label = "mixed full/quote" if mixed else "full mode"
+        print(f"{label}")
+        print(f"  struct dicts per packet : {per_packet:8.3f}s  {ticks / per_packet:12,.0f} ticks/s")
+        print(f"  batch into TickTable    : {batch:8.3f}s  {ticks / batch:12,.0f} ticks/s")
+        print(f"  speedup                 : {per_packet / batch:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
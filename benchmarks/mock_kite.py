@@ -0,0 +1,411 @@
+"""
+Local stand-in for the Kite endpoints KiteApp calls: login, the instrument dump,
+historical candles, quotes, orders and portfolio reads. Responses are synthetic
+but shaped like Kite's, and latency, 5xx errors and 429s can be injected to see
+how the API behaves when the broker is slow or pushes back.
+
+    python benchmarks/mock_kite.py [--port 8800] [--latency 20] [--jitter 10]
+                                   [--error-rate 0.01] [--throttle-rate 0.01] [--enforce-limits]
+
+Run the API against it with
+
+    KAPI_KITE_URL=http://127.0.0.1:8800 KAPI_KITE_API_URL=http://127.0.0.1:8800 gunicorn kite_api:app
+
+The injection settings can be changed while it runs with POST /_mock/config
+(a JSON object of the settings below), GET /_mock/stats answers the requests
+served per route and status, and POST /_mock/reset clears orders and stats.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict, deque
+from datetime import date, datetime, timedelta, timezone
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_instrument_parser import synthetic_dump  # noqa: E402
+
+IST = timezone(timedelta(hours=5, minutes=30))
+SESSION_MINUTES = 375  # 09:15 to 15:30
+
+# Settings POST /_mock/config accepts, with their defaults
+DEFAULTS = {
+    "latency_ms": 0.0,     # Added to every answer
+    "jitter_ms": 0.0,      # Uniformly random extra latency up to this much
+    "error_rate": 0.0,     # Share of calls answered 500 GeneralException
+    "throttle_rate": 0.0,  # Share of calls answered 429
+    "retry_after": None,   # Retry-After seconds sent with the 429s, none by default like Kite
+    "enforce_limits": False,  # Answer 429 past Kite's per-user requests per second
+}
+
+# Kite's per-user limits, requests per second per class of endpoint
+LIMITS = {"quote": 1, "historical": 3, "order": 10, "other": 10}
+
+
+def error(status, message, error_type, headers=None):
+    return web.json_response({"status": "error", "message": message, "error_type": error_type},
+                             status=status, headers=headers)
+
+
+def success(data):
+    return web.Response(body=json.dumps({"status": "success", "data": data}, separators=(",", ":")),
+                        content_type="application/json")
+
+
+def instrument_token(key):
+    return int(key) if key.isdigit() else zlib.crc32(key.encode()) & 0xFFFFFF
+
+
+def price(token, ts):
+    """Deterministic price for an instrument at an epoch second, so repeated calls agree."""
+    rnd = random.Random(token * 1000003 + ts // 60)
+    return round(100 + token % 900 + rnd.uniform(-5, 5), 2)
+
+
+def interval_minutes(interval):
+    if interval == "day":
+        return SESSION_MINUTES
+    value = interval[:-len("minute")] if interval.endswith("minute") else interval
+    return int(value or 1)
+
+
+def parse_bound(value, end=False):
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        bound = datetime(day.year, day.month, day.day, tzinfo=IST)
+        return bound + timedelta(days=1, seconds=-1) if end else bound
+    return datetime.fromisoformat(value).replace(tzinfo=IST)
+
+
+def candles(token, start, end, interval, oi):
+    """Bars of the NSE session between start and end inclusive, weekdays only."""
+    step = interval_minutes(interval)
+    rows = []
+    day = start.date()
+    while day <= end.date():
+        if day.weekday() < 5:
+            session = datetime(day.year, day.month, day.day, 9, 15, tzinfo=IST)
+            for minute in range(0, SESSION_MINUTES, step):
+                bar = session + timedelta(minutes=minute)
+                if bar < start or bar > end:
+                    continue
+                ts = int(bar.timestamp())
+                o, c = price(token, ts), price(token, ts + step * 60)
+                row = [bar.strftime("%Y-%m-%dT%H:%M:%S+0530"), o, max(o, c) + 0.5, min(o, c) - 0.5, c,
+                       (token * 31 + ts) % 100000]
+                if oi:
+                    row.append((token * 17 + ts) % 1000000)
+                rows.append(row)
+        day += timedelta(days=1)
+    return rows
+
+
+def quote(key, mode, now):
+    token = instrument_token(key)
+    last = price(token, now)
+    data = {"instrument_token": token, "last_price": last}
+    if mode == "ltp":
+        return data
+    data["ohlc"] = {"open": price(token, now - 3600), "high": last + 2, "low": last - 2,
+                    "close": price(token, now - 86400)}
+    if mode == "ohlc":
+        return data
+    data.update({
+        "timestamp": datetime.fromtimestamp(now, IST).strftime("%Y-%m-%d %H:%M:%S"),
+        "last_trade_time": datetime.fromtimestamp(now, IST).strftime("%Y-%m-%d %H:%M:%S"),
+        "last_quantity": 25, "average_price": last, "volume": token * 7 % 1000000,
+        "buy_quantity": 5000, "sell_quantity": 4000, "net_change": 0, "oi": 0,
+        "lower_circuit_limit": round(last * 0.9, 2), "upper_circuit_limit": round(last * 1.1, 2),
+        "depth": {side: [{"price": round(last + sign * 0.05 * (i + 1), 2), "quantity": 25 * (i + 1),
+                          "orders": i + 1} for i in range(5)]
+                  for side, sign in (("buy", -1), ("sell", 1))},
+    })
+    return data
+
+
+class MockKite:
+    """
+    State and handlers of the mock server.
+    Args:
+        instruments: Rows in the instrument dump
+        **config: Initial values of the DEFAULTS settings
+    """
+
+    def __init__(self, instruments=100000, **config):
+        self.config = dict(DEFAULTS, **config)
+        self.dump = synthetic_dump(instruments)
+        self.dump_etag = f'"{hashlib.sha1(self.dump).hexdigest()}"'
+        self.orders = defaultdict(dict)
+        self.order_ids = itertools.count(240000000000000)
+        self.stats = Counter()
+        self.calls = defaultdict(deque)
+
+    def app(self):
+        app = web.Application(middlewares=[self.inject])
+        app.router.add_post("/api/login", self.login)
+        app.router.add_post("/api/twofa", self.twofa)
+        app.router.add_get("/instruments", self.instruments)
+        app.router.add_get("/oms/instruments/historical/{token}/{interval}", self.historical)
+        app.router.add_get("/oms/quote", self.quote)
+        app.router.add_get("/oms/quote/{mode}", self.quote)
+        app.router.add_get("/oms/orders", self.list_orders)
+        app.router.add_post("/oms/orders/{variety}", self.place_order)
+        app.router.add_put("/oms/orders/{variety}/{order_id}", self.modify_order)
+        app.router.add_delete("/oms/orders/{variety}/{order_id}", self.cancel_order)
+        app.router.add_get("/oms/portfolio/positions", self.positions)
+        app.router.add_get("/oms/portfolio/holdings", self.holdings)
+        app.router.add_get("/oms/user/margins", self.margins)
+        app.router.add_get("/oms/user/profile/full", self.profile)
+        app.router.add_get("/_mock/stats", self.get_stats)
+        app.router.add_post("/_mock/config", self.set_config)
+        app.router.add_post("/_mock/reset", self.reset)
+        return app
+
+    @web.middleware
+    async def inject(self, request, handler):
+        if request.path.startswith("/_mock/"):
+            return await handler(request)
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource else "unmatched"
+        try:
+            response = await self.answer(request, handler)
+        except web.HTTPException as e:
+            self.stats[f"{request.method} {route} {e.status}"] += 1
+            raise
+        self.stats[f"{request.method} {route} {response.status}"] += 1
+        return response
+
+    async def answer(self, request, handler):
+        config = self.config
+        delay = config["latency_ms"] + random.uniform(0, config["jitter_ms"])
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if request.path.startswith("/oms/"):
+            enctoken = request.headers.get("Authorization", "")[len("enctoken "):]
+            if not enctoken:
+                return error(403, "Invalid session credentials", "TokenException")
+            if config["enforce_limits"] and self.over_limit(enctoken, request):
+                return error(429, "Too many requests", "NetworkException")
+        if random.random() < config["throttle_rate"]:
+            headers = {"Retry-After": str(config["retry_after"])} if config["retry_after"] is not None else None
+            return error(429, "Too many requests", "NetworkException", headers)
+        if random.random() < config["error_rate"]:
+            return error(500, "Something went wrong (injected by mock_kite)", "GeneralException")
+        return await handler(request)
+
+    def over_limit(self, enctoken, request):
+        if request.path.startswith("/oms/quote"):
+            kind = "quote"
+        elif request.path.startswith("/oms/instruments/historical"):
+            kind = "historical"
+        elif request.path.startswith("/oms/orders") and request.method != "GET":
+            kind = "order"
+        else:
+            kind = "other"
+        now = time.monotonic()
+        calls = self.calls[enctoken, kind]
+        while calls and calls[0] <= now - 1:
+            calls.popleft()
+        if len(calls) >= LIMITS[kind]:
+            return True
+        calls.append(now)
+        return False
+
+    async def login(self, request):
+        form = await request.post()
+        if not form.get("user_id") or not form.get("password"):
+            return error(400, "Invalid user_id or password", "InputException")
+        return success({"user_id": form["user_id"], "request_id": hashlib.sha1(form["user_id"].encode()).hexdigest(),
+                        "twofa_type": "totp"})
+
+    async def twofa(self, request):
+        form = await request.post()
+        if not form.get("twofa_value"):
+            return error(400, "Invalid 2FA value", "InputException")
+        response = success({})
+        response.set_cookie("enctoken", f"mock-{form.get('user_id', 'user')}")
+        return response
+
+    async def instruments(self, request):
+        if request.headers.get("If-None-Match") == self.dump_etag:
+            return web.Response(status=304, headers={"ETag": self.dump_etag})
+        return web.Response(body=self.dump, content_type="text/csv", headers={"ETag": self.dump_etag})
+
+    async def historical(self, request):
+        try:
+            token = int(request.match_info["token"])
+            interval = request.match_info["interval"]
+            interval_minutes(interval)
+            start = parse_bound(request.query["from"])
+            end = parse_bound(request.query["to"], end=True)
+        except (KeyError, ValueError) as e:
+            return error(400, f"Invalid historical request: {e}", "InputException")
+        oi = request.query.get("oi") == "1"
+        return success({"candles": candles(token, start, end, interval, oi)})
+
+    async def quote(self, request):
+        mode = request.match_info.get("mode", "quote")
+        if mode not in ("quote", "ohlc", "ltp"):
+            return error(404, "Route not found", "GeneralException")
+        now = int(time.time())
+        return success({key: quote(key, mode, now) for key in request.query.getall("i", [])})
+
+    def _user_orders(self, request):
+        return self.orders[request.headers["Authorization"]]
+
+    async def list_orders(self, request):
+        return success(list(self._user_orders(request).values()))
+
+    async def place_order(self, request):
+        form = await request.post()
+        now = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
+        order_id = str(next(self.order_ids))
+        status = "COMPLETE" if form.get("order_type") == "MARKET" else (
+            "TRIGGER PENDING" if form.get("order_type") in ("SL", "SL-M") else "OPEN")
+        self._user_orders(request)[order_id] = {
+            "order_id": order_id, "status": status, "variety": request.match_info["variety"],
+            "exchange": form.get("exchange"), "tradingsymbol": form.get("tradingsymbol"),
+            "transaction_type": form.get("transaction_type"), "order_type": form.get("order_type"),
+            "product": form.get("product"), "quantity": int(form.get("quantity") or 0),
+            "price": float(form.get("price") or 0), "trigger_price": float(form.get("trigger_price") or 0),
+            "tag": form.get("tag"), "placed_by": "MOCK", "order_timestamp": now, "exchange_update_timestamp": now,
+        }
+        return success({"order_id": order_id})
+
+    async def modify_order(self, request):
+        order = self._user_orders(request).get(request.match_info["order_id"])
+        if order is None:
+            return error(400, "Order not found", "InputException")
+        form = await request.post()
+        for field in ("quantity", "price", "trigger_price", "order_type"):
+            if form.get(field):
+                order[field] = form[field] if field == "order_type" else float(form[field])
+        order["exchange_update_timestamp"] = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
+        return success({"order_id": order["order_id"]})
+
+    async def cancel_order(self, request):
+        order = self._user_orders(request).get(request.match_info["order_id"])
+        if order is None:
+            return error(400, "Order not found", "InputException")
+        order["status"] = "CANCELLED"
+        order["exchange_update_timestamp"] = datetime.now(IST).strftime("%Y-%m-%d %H:%M:%S")
+        return success({"order_id": order["order_id"]})
+
+    async def positions(self, request):
+        rows = [{"tradingsymbol": f"NIFTY24OCT{25000 + 50 * i}CE", "exchange": "NFO", "product": "MIS",
+                 "quantity": 25 * (i % 3), "average_price": 100.0 + i, "last_price": 101.0 + i, "pnl": 25.0}
+                for i in range(20)]
+        return success({"net": rows, "day": rows})
+
+    async def holdings(self, request):
+        return success([{"tradingsymbol": f"STOCK{i}", "exchange": "NSE", "isin": f"INE{i:09d}",
+                         "quantity": 10 + i, "average_price": 500.0 + i, "last_price": 510.0 + i,
+                         "pnl": 10.0 * (10 + i)} for i in range(50)])
+
+    async def margins(self, request):
+        segment = {"enabled": True, "net": 100000.0, "available": {"cash": 100000.0, "live_balance": 100000.0},
+                   "utilised": {"debits": 0.0, "exposure": 0.0, "span": 0.0}}
+        return success({"equity": segment, "commodity": segment})
+
+    async def profile(self, request):
+        return success({"user_id": "MOCK01", "user_name": "Mock User", "email": "mock@example.com",
+                        "exchanges": ["NSE", "NFO", "BSE"], "products": ["CNC", "NRML", "MIS"]})
+
+    async def get_stats(self, request):
+        return web.json_response({"config": self.config, "requests": dict(self.stats)})
+
+    async def set_config(self, request):
+        changes = await request.json()
+        unknown = set(changes) - set(DEFAULTS)
+        if unknown:
+            return web.json_response({"status": "error", "message": f"Unknown settings {sorted(unknown)}"}, status=400)
+        self.config.update(changes)
+        return web.json_response(self.config)
+
+    async def reset(self, request):
+        self.orders.clear()
+        self.stats.clear()
+        self.calls.clear()
+        return web.json_response({"status": "success"})
+
+
+class MockServer:
+    """
+    mock_kite.py in a child process for the length of a `with` block, so it
+    does not compete with the load generator for the GIL.
+    Args:
+        port: Port to listen on, on 127.0.0.1
+        args: Extra command line arguments, e.g. ["--latency", "20"]
+    """
+
+    def __init__(self, port=8800, args=()):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.args = list(args)
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--port", str(self.port),
+                                         *self.args], stdout=subprocess.DEVNULL)
+        wait_ready(f"{self.url}/_mock/stats", self.process)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+    def configure(self, **config):
+        import requests
+        requests.post(f"{self.url}/_mock/config", json=config, timeout=5).raise_for_status()
+
+    def stats(self):
+        import requests
+        return requests.get(f"{self.url}/_mock/stats", timeout=5).json()
+
+
+def wait_ready(url, process, timeout=30):
+    """Poll `url` until it answers, failing early if `process` exits."""
+    import requests
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[1]} exited with {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not answer within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--instruments", type=int, default=100000, help="Rows in the instrument dump")
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds added to every answer")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra milliseconds, up to this much")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls answered 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of calls answered 429")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--enforce-limits", action="store_true", help="Answer 429 past Kite's per-user limits")
+    args = parser.parse_args()
+
+    mock = MockKite(args.instruments, latency_ms=args.latency, jitter_ms=args.jitter, error_rate=args.error_rate,
+                    throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                    enforce_limits=args.enforce_limits)
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
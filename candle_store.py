@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from candles import candle_epoch
+from instrument_cache import CACHE_DIR, IST
+from metrics import count_cache
+from tracing import span
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    instrument_token INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    oi INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    open, high, low, close,
+    volume,
+    open_interest,
+    PRIMARY KEY (instrument_token, interval, oi, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    instrument_token INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    oi INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_key ON coverage (instrument_token, interval, oi);
+"""
+
+
+def request_bounds(from_date, to_date):
+    """
+    Half open epoch range [start, end) covered by a historical request. Bounds may be
+    dates or `YYYY-MM-DD[ HH:MM:SS]` strings in exchange time; a bare `to_date`
+    includes the whole day.
+    """
+    return _epoch(from_date), _epoch(to_date, end_of_day=True)
+
+
+def _epoch(value, end_of_day=False):
+    if isinstance(value, datetime):
+        moment = value if value.tzinfo else value.replace(tzinfo=IST)
+        return int(moment.timestamp()) + (1 if end_of_day else 0)
+    if isinstance(value, date):
+        value = value.isoformat()
+    value = value.strip().replace("T", " ")
+    if len(value) == 10:
+        day = datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=IST)
+        if end_of_day:
+            day += timedelta(days=1)
+        return int(day.timestamp())
+    moment = datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=IST)
+    return int(moment.timestamp()) + (1 if end_of_day else 0)
+
+
+def format_bound(ts):
+    return datetime.fromtimestamp(ts, IST).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Longest span in days Kite serves in one historical request, per interval
+HISTORICAL_MAX_DAYS = {
+    "minute": 60,
+    "3minute": 100,
+    "5minute": 100,
+    "10minute": 100,
+    "15minute": 200,
+    "30minute": 200,
+    "60minute": 400,
+    "day": 2000,
+}
+
+
+def split_range(start, end, interval):
+    """Split [start, end) into consecutive chunks upstream accepts in one request."""
+    span = HISTORICAL_MAX_DAYS.get(interval, 60) * 86400
+    return [(lo, min(lo + span, end)) for lo in range(start, end, span)]
+
+
+def today_start(now=None):
+    now = now or datetime.now(IST)
+    return int(now.astimezone(IST).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+
+
+def missing_ranges(covered, start, end):
+    """Sub-ranges of [start, end) not inside any of the sorted, merged `covered` ranges."""
+    gaps = []
+    cursor = start
+    for lo, hi in covered:
+        if hi <= cursor:
+            continue
+        if lo >= end:
+            break
+        if lo > cursor:
+            gaps.append((cursor, lo))
+        cursor = max(cursor, hi)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def merge_ranges(ranges):
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class CandleStore:
+    """
+    Persistent candle cache keyed by (instrument_token, interval, oi), shared by all
+    workers through one SQLite file in WAL mode, read through mmap.
+
+    Only finished days are recorded as covered. Anything from the start of the
+    current trading day onwards is a live tail that is refetched on every request
+    and upserted over what was stored before.
+    Args:
+        path: SQLite database file
+    """
+
+    MMAP_SIZE = 256 << 20
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+            db.executescript(SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def covered(self, key):
+        rows = self._db().execute(
+            "SELECT start, end FROM coverage WHERE instrument_token=? AND interval=? AND oi=? ORDER BY start",
+            key).fetchall()
+        return merge_ranges(rows)
+
+    def read(self, key, start, end):
+        with span('store'):
+            return self._db().execute(
+                "SELECT ts, open, high, low, close, volume, open_interest FROM candles "
+                "WHERE instrument_token=? AND interval=? AND oi=? AND ts>=? AND ts<? ORDER BY ts",
+                key + (start, end)).fetchall()
+
+    def write(self, key, candles, start, end, live_from):
+        """Upsert raw upstream `candles` fetched for [start, end), marking the part before `live_from` covered."""
+        with span('store'):
+            rows = [key + (candle_epoch(c[0]), c[1], c[2], c[3], c[4], c[5], c[6] if len(c) > 6 else None)
+                    for c in candles]
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                if start < min(end, live_from):
+                    ranges = db.execute(
+                        "SELECT start, end FROM coverage WHERE instrument_token=? AND interval=? AND oi=?",
+                        key).fetchall()
+                    ranges.append((start, min(end, live_from)))
+                    db.execute("DELETE FROM coverage WHERE instrument_token=? AND interval=? AND oi=?", key)
+                    db.executemany("INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                                   [key + r for r in merge_ranges(ranges)])
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def fetch(self, instrument_token, interval, oi, from_date, to_date, fetch_upstream):
+        """
+        Candles for the request, fetching only the missing sub-ranges through
+        `fetch_upstream(from_str, to_str)`, which returns raw upstream candle lists.
+        Rows are (ts, open, high, low, close, volume, oi) tuples ordered by ts.
+        """
+        key, start, end, gaps = self.plan(instrument_token, interval, oi, from_date, to_date)
+        live_from = today_start()
+        for lo, hi in gaps:
+            candles = fetch_upstream(format_bound(lo), format_bound(hi - 1))
+            self.write(key, candles, lo, hi, live_from)
+        return self.read(key, start, end)
+
+    def plan(self, instrument_token, interval, oi, from_date, to_date):
+        """Store key, epoch bounds and the sub-ranges still to be fetched for a request."""
+        key = (instrument_token, interval, 1 if oi else 0)
+        start, end = request_bounds(from_date, to_date)
+        with span('store'):
+            gaps = missing_ranges(self.covered(key), start, end)
+        count_cache('candles', hits=0 if gaps else 1, misses=1 if gaps else 0)
+        return key, start, end, gaps
+
+
+candle_store = CandleStore(os.path.join(CACHE_DIR, 'candles.sqlite'))
@@ -0,0 +1,205 @@
+import calendar
+import io
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Binary layout: header, then one little-endian column after another
+#   magic "KCDL", version u16, flags u16 (bit 0: oi column present), count u32
+#   timestamp int64[count]  epoch seconds
+#   open, high, low, close float64[count]
+#   volume int64[count]
+#   oi int64[count]  when flagged
+BINARY_MAGIC = b"KCDL"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHI")
+FLAG_OI = 1
+
+# Session open in exchange time, resampled bars are aligned to it
+SESSION_OPEN = {
+    "NSE": (9, 15),
+    "BSE": (9, 15),
+    "NFO": (9, 15),
+    "BFO": (9, 15),
+    "CDS": (9, 0),
+    "MCX": (9, 0),
+}
+IST_OFFSET = 19800
+
+DEFAULT_AGGREGATION = {
+    "open": "first",
+    "high": "max",
+    "low": "min",
+    "close": "last",
+    "volume": "sum",
+    "oi": "last",
+}
+# Column, index of each bar's first candle, index past each bar's last candle -> one value per bar
+_REDUCERS = {
+    "first": lambda col, starts, ends: col[starts],
+    "last": lambda col, starts, ends: col[ends - 1],
+    "max": lambda col, starts, ends: np.maximum.reduceat(col, starts),
+    "min": lambda col, starts, ends: np.minimum.reduceat(col, starts),
+    "sum": lambda col, starts, ends: np.add.reduceat(col, starts),
+}
+
+_offsets = {}
+
+
+def _tz(value):
+    # Offset suffix such as +0530, one tzinfo per distinct offset
+    tz = _offsets.get(value)
+    if tz is None:
+        seconds = int(value[1:3]) * 3600 + int(value[3:5]) * 60
+        tz = _offsets[value] = timezone(timedelta(seconds=-seconds if value[0] == "-" else seconds))
+    return tz
+
+
+def candle_epoch(value):
+    """Epoch seconds for an upstream candle timestamp such as 2024-10-01T09:15:00+0530."""
+    if len(value) == 24 and value[10] == "T":
+        offset = int(value[20:22]) * 3600 + int(value[22:24]) * 60
+        if value[19] == "-":
+            offset = -offset
+        return calendar.timegm((int(value[:4]), int(value[5:7]), int(value[8:10]),
+                                int(value[11:13]), int(value[14:16]), int(value[17:19]))) - offset
+    import dateutil.parser
+    return int(dateutil.parser.parse(value).timestamp())
+
+
+def candle_datetime(value):
+    """Aware datetime for an upstream candle timestamp, without going through dateutil."""
+    if len(value) == 24 and value[10] == "T":
+        return datetime(int(value[:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]), int(value[17:19]), tzinfo=_tz(value[19:]))
+    import dateutil.parser
+    return dateutil.parser.parse(value)
+
+
+def interval_minutes(interval):
+    """Minutes in a bar for `minute`, `5minute`, `75m`, `75` or an int."""
+    if isinstance(interval, int):
+        return interval
+    value = interval.strip().lower()
+    for suffix in ("minute", "min", "m"):
+        if value.endswith(suffix):
+            value = value[:-len(suffix)] or "1"
+            break
+    if not value.isdigit() or int(value) <= 0:
+        raise ValueError(f"Unsupported interval {interval}")
+    return int(value)
+
+
+def parse_aggregation(spec):
+    """`volume:sum,oi:max` -> aggregation rules layered over DEFAULT_AGGREGATION."""
+    rules = dict(DEFAULT_AGGREGATION)
+    for item in filter(None, (spec or "").split(",")):
+        column, _, how = item.partition(":")
+        if column not in rules or how not in _REDUCERS:
+            raise ValueError(f"Invalid aggregation {item}, expected <column>:<{'|'.join(_REDUCERS)}>")
+        rules[column] = how
+    return rules
+
+
+class Candles:
+    """
+    Column oriented candles: epoch second timestamps plus one typed array per field.
+    `oi` is None when open interest was not requested.
+    """
+
+    COLUMNS = ("timestamp", "open", "high", "low", "close", "volume", "oi")
+
+    def __init__(self, oi=False):
+        self.timestamp = array("q")
+        self.open = array("d")
+        self.high = array("d")
+        self.low = array("d")
+        self.close = array("d")
+        self.volume = array("q")
+        self.oi = array("q") if oi else None
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def columns(self):
+        names = self.COLUMNS if self.oi is not None else self.COLUMNS[:-1]
+        return names, [getattr(self, name) for name in names]
+
+    @classmethod
+    def from_rows(cls, rows, oi=False):
+        """Build from candle store rows, (ts, open, high, low, close, volume, oi) tuples."""
+        candles = cls(oi)
+        if rows:
+            cols = list(zip(*rows))
+            for column, values in zip(candles.columns()[1], cols):
+                column.extend(int(v or 0) if column.typecode == "q" else v for v in values)
+        return candles
+
+    def resample(self, minutes, session="NSE", aggregation=None):
+        """
+        Aggregate into `minutes` wide bars aligned to the exchange session open, so
+        75 minute NSE bars start at 09:15, 10:30, ... Candles must be in time order.
+        Args:
+            minutes: Target bar width in minutes
+            session: Exchange whose session open anchors the bars (see SESSION_OPEN)
+            aggregation: Column -> first|last|max|min|sum, defaults to DEFAULT_AGGREGATION
+        """
+        if session not in SESSION_OPEN:
+            raise ValueError(f"Unknown session {session}, expected one of {', '.join(SESSION_OPEN)}")
+        hour, minute = SESSION_OPEN[session]
+        anchor = hour * 3600 + minute * 60
+        step = minutes * 60
+        rules = dict(DEFAULT_AGGREGATION, **(aggregation or {}))
+
+        out = Candles(self.oi is not None)
+        if not len(self):
+            return out
+        local = np.frombuffer(self.timestamp, dtype=np.int64) + IST_OFFSET
+        session_open = local - local % 86400 + anchor
+        buckets = session_open + (local - session_open) // step * step - IST_OFFSET
+        # A bar starts wherever the bucket changes, the reductions then run per bar
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        ends = np.append(starts[1:], len(self))
+
+        out.timestamp.frombytes(buckets[starts].tobytes())
+        names, cols = self.columns()
+        for name, col in zip(names[1:], cols[1:]):
+            values = _REDUCERS[rules[name]](np.frombuffer(col, dtype=col.typecode), starts, ends)
+            getattr(out, name).frombytes(values.astype(col.typecode, copy=False).tobytes())
+        return out
+
+    def to_records(self, tz):
+        """The historical_data_v2 record layout, one dict per candle."""
+        names, cols = self.columns()
+        records = []
+        names = names[1:]
+        for row in zip(*cols):
+            record = {"date": datetime.fromtimestamp(row[0], tz)}
+            record.update(zip(names, row[1:]))
+            records.append(record)
+        return records
+
+    def to_dict(self):
+        names, cols = self.columns()
+        return {name: col.tolist() for name, col in zip(names, cols)}
+
+    def to_csv(self):
+        names, cols = self.columns()
+        buf = io.StringIO()
+        buf.write(",".join(names) + "\n")
+        for row in zip(*cols):
+            buf.write(",".join(map(repr, row)) + "\n")
+        return buf.getvalue()
+
+    def to_binary(self):
+        names, cols = self.columns()
+        parts = [BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, FLAG_OI if self.oi is not None else 0, len(self))]
+        for col in cols:
+            if sys.byteorder != "little":
+                col = array(col.typecode, col)
+                col.byteswap()
+            parts.append(col.tobytes())
+        return b"".join(parts)
@@ -0,0 +1,118 @@
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# Bodies smaller than this many bytes are sent as is, compressing them saves less than it costs
+MIN_SIZE = int(os.environ.get('KAPI_COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html',
+                'text/css', 'application/javascript')
+# Levels for bodies held in memory, and lower ones for streamed bodies so the
+# compressor keeps pace with the rows being encoded
+LEVELS = {'br': 5, 'zstd': 6, 'gzip': 6}
+STREAM_LEVELS = {'br': 3, 'zstd': 3, 'gzip': 4}
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+# Encodings offered, in order of preference when a client accepts several equally
+ENCODERS = {name: encoder for name, encoder, available in (
+    ('br', _Brotli, brotli is not None),
+    ('zstd', _Zstd, zstandard is not None),
+    ('gzip', _Gzip, True),
+) if available}
+
+
+def encoding_etag(etag, encoding):
+    """Strong ETag of the `encoding` representation of a resource tagged `etag`."""
+    return f"{etag}-{encoding}"
+
+
+def identity_etag(etag):
+    """The resource ETag behind a tag made by encoding_etag()."""
+    tag, _, encoding = etag.rpartition('-')
+    return tag if tag and encoding in ENCODERS else etag
+
+
+def _compressed_chunks(chunks, encoder):
+    try:
+        for chunk in chunks:
+            data = encoder.compress(chunk)
+            if data:
+                yield data
+        yield encoder.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress(response, accept_encodings):
+    """
+    Compress `response` with the best encoding in `accept_encodings` (the request's
+    Accept-Encoding). Buffered bodies below MIN_SIZE are left alone; streamed bodies
+    are compressed chunk by chunk. Strong ETags get the encoding appended, since
+    each encoding is a different representation.
+    """
+    if response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code < 200 or response.status_code in (204, 304) or 'Content-Encoding' in response.headers:
+        return response
+    encoding = accept_encodings.best_match(list(ENCODERS))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        encoder = ENCODERS[encoding](STREAM_LEVELS[encoding])
+        response.response = _compressed_chunks(response.iter_encoded(), encoder)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        encoder = ENCODERS[encoding](LEVELS[encoding])
+        response.set_data(encoder.compress(data) + encoder.flush())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encoding_etag(etag, encoding))
+    return response
@@ -1,11 +1,42 @@
 # Gunicorn configuration file
+import gc
+import os
+import tempfile
+
+# Workers write their metrics here for /metrics to aggregate (see metrics.py). Set
+# before the app is imported and emptied on every start so counts begin at zero.
+_metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'kapi-metrics'))
+os.makedirs(_metrics_dir, exist_ok=True)
+for _name in os.listdir(_metrics_dir):
+    if _name.endswith('.db'):
+        os.remove(os.path.join(_metrics_dir, _name))
+
 bind = "0.0.0.0:10000"
 workers = 2
-worker_class = "sync"
+# asgi:app runs the event loop serving streams, long-polls, historical, quote and order calls; the
+# synchronous app (app:app) needs `-k sync`, and then holds a worker per open stream
+worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
 timeout = 30
 keepalive = 2
 max_requests = 1000
 max_requests_jitter = 50
 preload_app = True
-app_name = "kite_api:app" 
\ No newline at end of file
+app_name = "asgi:app"
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported and before workers fork
+    if os.environ.get('KAPI_PREWARM', '').lower() not in ('1', 'true'):
+        return
+    from kite_trade import KiteApp
+    count = KiteApp.prewarm()
+    # Keep the loaded objects out of the workers' garbage collection so their pages stay shared
+    gc.freeze()
+    server.log.info("Prewarmed %d instruments", count)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of a worker that exited, its counters stay in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,134 @@
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from metrics import count_cache
+from transport import KiteError
+
+try:
+    import fcntl
+except ImportError:  # Windows, fall back to a best-effort unlocked refresh
+    fcntl = None
+
+IST = timezone(timedelta(hours=5, minutes=30))
+# Kite regenerates the instrument dump once a day before the pre-open session
+REFRESH_AFTER = timedelta(hours=8, minutes=30)
+
+
+def trading_day(now=None):
+    """The instrument dump generation `now` falls into, as an ISO date string."""
+    now = now or datetime.now(IST)
+    return (now.astimezone(IST) - REFRESH_AFTER).date().isoformat()
+
+
+def next_refresh(now=None):
+    """Epoch seconds at which the trading day `now` falls into rolls over."""
+    now = now or datetime.now(IST)
+    day = (now.astimezone(IST) - REFRESH_AFTER).date() + timedelta(days=1)
+    return datetime.combine(day, datetime.min.time(), IST).timestamp() + REFRESH_AFTER.total_seconds()
+
+
+@contextmanager
+def _file_lock(path):
+    with open(path, "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_write(path, chunks):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class InstrumentCache:
+    """
+    Instrument master CSV cached on disk once per trading day and shared by all
+    workers. Only the worker holding the lock downloads, the rest wait and read
+    the file it wrote.
+    Args:
+        cache_dir: Directory holding the CSV and its metadata
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, "instruments.csv")
+        self.meta_path = os.path.join(cache_dir, "instruments.meta.json")
+        self.lock_path = os.path.join(cache_dir, "instruments.lock")
+
+    def meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def is_fresh(self, meta=None):
+        meta = self.meta() if meta is None else meta
+        return meta.get("trading_day") == trading_day() and os.path.exists(self.path)
+
+    def version(self):
+        """Identifies the cached file so in-process copies can tell when it changed."""
+        meta = self.meta()
+        return meta.get("trading_day"), meta.get("fetched_at")
+
+    def load(self, kite, force=False):
+        """Return the path to an up to date instrument CSV, refreshing it via `kite` if needed."""
+        if not force and self.is_fresh():
+            count_cache('instruments', hits=1)
+            return self.path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with _file_lock(self.lock_path):
+            meta = self.meta()
+            # Another worker may have refreshed while we waited for the lock
+            if not force and self.is_fresh(meta):
+                count_cache('instruments', shared=1)
+                return self.path
+            count_cache('instruments', misses=1)
+            self._refresh(kite, meta)
+        return self.path
+
+    def _refresh(self, kite, meta):
+        headers = dict(kite.headers)
+        if os.path.exists(self.path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        response = kite.transport.get(f"{kite.root_url_new}/instruments", headers=headers, stream=True)
+        try:
+            if response.status_code >= 400:
+                raise KiteError(f"Instrument dump request failed with HTTP {response.status_code}",
+                                response.status_code)
+            if response.status_code != 304:
+                _atomic_write(self.path, response.iter_content(chunk_size=1 << 16))
+                meta = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+        finally:
+            response.close()
+        meta["trading_day"] = trading_day()
+        meta["fetched_at"] = datetime.now(timezone.utc).isoformat()
+        _atomic_write(self.meta_path, [json.dumps(meta).encode()])
+
+
+CACHE_DIR = os.environ.get('KAPI_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'kapi'))
+
+instrument_cache = InstrumentCache(CACHE_DIR)
@@ -0,0 +1,82 @@
+import csv
+import io
+import sys
+from datetime import date
+from itertools import islice
+
+from instrument_store import FIELDS, NO_EXPIRY, InstrumentTable
+
+BATCH_SIZE = 8192
+
+# Distinct expiries number in the hundreds, so every value is decoded once per process
+_expiry_ordinals = {"": NO_EXPIRY}
+
+
+def expiry_ordinal(value):
+    """Decode a `YYYY-MM-DD` expiry to a date ordinal, NO_EXPIRY for blanks."""
+    try:
+        return _expiry_ordinals[value]
+    except KeyError:
+        pass
+    if len(value) == 10 and value[4] == "-" and value[7] == "-":
+        ordinal = date(int(value[:4]), int(value[5:7]), int(value[8:])).toordinal()
+    else:
+        import dateutil.parser
+        ordinal = dateutil.parser.parse(value).toordinal()
+    _expiry_ordinals[value] = ordinal
+    return ordinal
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.TextIOWrapper(io.BytesIO(source), encoding="utf-8", newline="")
+    if isinstance(source, str):
+        return open(source, encoding="utf-8", newline="")
+    return source
+
+
+def parse_instruments(source, batch_size=BATCH_SIZE):
+    """
+    Parse a Kite instrument dump into an InstrumentTable.
+    Args:
+        source: Path to the CSV, the raw CSV bytes or a text file object
+        batch_size: Rows converted per column batch
+    """
+    f = _open(source)
+    try:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return InstrumentTable().build_indexes()
+        columns = [header.index(field) for field in FIELDS]
+        width = max(columns) + 1
+        table = InstrumentTable()
+        intern = sys.intern
+        while True:
+            batch = list(islice(reader, batch_size))
+            if not batch:
+                break
+            batch = [row for row in batch if len(row) >= width]
+            if not batch:
+                continue
+            cols = list(zip(*batch))
+            (token, exchange_token, tradingsymbol, name, last_price, expiry, strike,
+             tick_size, lot_size, instrument_type, segment, exchange) = [cols[i] for i in columns]
+            table.extend((
+                map(int, token),
+                map(int, exchange_token),
+                tradingsymbol,
+                map(intern, name),
+                map(float, last_price),
+                map(expiry_ordinal, expiry),
+                map(float, strike),
+                map(float, tick_size),
+                map(int, lot_size),
+                map(intern, instrument_type),
+                map(intern, segment),
+                map(intern, exchange),
+            ))
+        return table.build_indexes()
+    finally:
+        if f is not source:
+            f.close()
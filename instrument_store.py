@@ -0,0 +1,187 @@
+from array import array
+from datetime import date
+
+FIELDS = ('instrument_token', 'exchange_token', 'tradingsymbol', 'name', 'last_price', 'expiry',
+          'strike', 'tick_size', 'lot_size', 'instrument_type', 'segment', 'exchange')
+
+NO_EXPIRY = 0
+_NO_SYMBOLS = {}
+
+
+class Instrument:
+    """Read-only view of one row of an InstrumentTable."""
+    __slots__ = ('_table', '_i')
+
+    def __init__(self, table, i):
+        self._table = table
+        self._i = i
+
+    @property
+    def instrument_token(self):
+        return self._table.instrument_token[self._i]
+
+    @property
+    def exchange_token(self):
+        return str(self._table.exchange_token[self._i])
+
+    @property
+    def tradingsymbol(self):
+        return self._table.tradingsymbol[self._i]
+
+    @property
+    def name(self):
+        return self._table.name[self._i]
+
+    @property
+    def last_price(self):
+        return self._table.last_price[self._i]
+
+    @property
+    def expiry(self):
+        ordinal = self._table.expiry[self._i]
+        return date.fromordinal(ordinal) if ordinal != NO_EXPIRY else None
+
+    @property
+    def strike(self):
+        return self._table.strike[self._i]
+
+    @property
+    def tick_size(self):
+        return self._table.tick_size[self._i]
+
+    @property
+    def lot_size(self):
+        return self._table.lot_size[self._i]
+
+    @property
+    def instrument_type(self):
+        return self._table.instrument_type[self._i]
+
+    @property
+    def segment(self):
+        return self._table.segment[self._i]
+
+    @property
+    def exchange(self):
+        return self._table.exchange[self._i]
+
+    def to_dict(self, fields=FIELDS):
+        return {field: getattr(self, field) for field in fields}
+
+    def __repr__(self):
+        return f"Instrument({self.exchange}:{self.tradingsymbol}, token={self.instrument_token})"
+
+
+class InstrumentTable:
+    """
+    Instrument master held as parallel typed columns instead of a list of dicts.
+    Repeated strings (name, type, segment, exchange) are interned by the parser and
+    expiries are stored as date ordinals. Built by instrument_parser.parse_instruments.
+
+    Indexes:
+        instrument_token -> row
+        exchange -> tradingsymbol -> row, keyed by the column's own strings
+        rows sorted by (name, expiry, strike, instrument_type) for range queries
+    """
+
+    def __init__(self):
+        self.instrument_token = array('q')
+        self.exchange_token = array('q')
+        self.tradingsymbol = []
+        self.name = []
+        self.last_price = array('d')
+        self.expiry = array('l')
+        self.strike = array('d')
+        self.tick_size = array('d')
+        self.lot_size = array('l')
+        self.instrument_type = []
+        self.segment = []
+        self.exchange = []
+        self._by_token = {}
+        self._by_symbol = {}
+        self._sorted_rows = array('I')
+
+    def __len__(self):
+        return len(self.instrument_token)
+
+    def __iter__(self):
+        return (Instrument(self, i) for i in range(len(self)))
+
+    def extend(self, columns):
+        """Append a batch of already decoded columns, given in FIELDS order."""
+        for column, values in zip(self._columns(), columns):
+            column.extend(values)
+
+    def _columns(self):
+        return (self.instrument_token, self.exchange_token, self.tradingsymbol, self.name,
+                self.last_price, self.expiry, self.strike, self.tick_size, self.lot_size,
+                self.instrument_type, self.segment, self.exchange)
+
+    def build_indexes(self):
+        n = len(self)
+        self._by_token = dict(zip(self.instrument_token, range(n)))
+        self._by_symbol = {}
+        for exchange, tradingsymbol, i in zip(self.exchange, self.tradingsymbol, range(n)):
+            symbols = self._by_symbol.get(exchange)
+            if symbols is None:
+                symbols = self._by_symbol[exchange] = {}
+            symbols[tradingsymbol] = i
+        # Row numbers only, compared through the columns; ties keep row order as sorted() is stable
+        name, expiry, strike, instrument_type = self.name, self.expiry, self.strike, self.instrument_type
+        self._sorted_rows = array('I', sorted(range(n), key=lambda i: (name[i], expiry[i], strike[i],
+                                                                        instrument_type[i])))
+        return self
+
+    def get(self, instrument_token):
+        i = self._by_token.get(instrument_token)
+        return Instrument(self, i) if i is not None else None
+
+    def lookup(self, exchange, tradingsymbol):
+        i = self._by_symbol.get(exchange, _NO_SYMBOLS).get(tradingsymbol)
+        return Instrument(self, i) if i is not None else None
+
+    def _bisect(self, name, expiry, right):
+        # First sorted position whose (name, expiry) is >= the given one, or > it when `right`
+        rows = self._sorted_rows
+        lo, hi = 0, len(rows)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = rows[mid]
+            key = (self.name[row], self.expiry[row])
+            if key < (name, expiry) or (right and key == (name, expiry)):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _name_range(self, name, expiry_from=None, expiry_to=None):
+        lo_expiry = expiry_from.toordinal() if expiry_from else NO_EXPIRY
+        hi_expiry = expiry_to.toordinal() if expiry_to else date.max.toordinal()
+        return self._sorted_rows[self._bisect(name, lo_expiry, False):self._bisect(name, hi_expiry, True)]
+
+    def select(self, exchange=None, segment=None, instrument_type=None, name=None,
+               expiry=None, expiry_from=None, expiry_to=None):
+        """
+        Yield rows matching every given filter. When `name` is given the sorted
+        index narrows the scan to that underlying, ordered by expiry and strike.
+        """
+        if expiry is not None:
+            expiry_from = expiry_to = expiry
+        if name is not None:
+            candidates = self._name_range(name, expiry_from, expiry_to)
+        else:
+            candidates = range(len(self))
+        lo_expiry = expiry_from.toordinal() if expiry_from else None
+        hi_expiry = expiry_to.toordinal() if expiry_to else None
+        for i in candidates:
+            if exchange is not None and self.exchange[i] != exchange:
+                continue
+            if segment is not None and self.segment[i] != segment:
+                continue
+            if instrument_type is not None and self.instrument_type[i] != instrument_type:
+                continue
+            if lo_expiry is not None and self.expiry[i] < lo_expiry:
+                continue
+            if hi_expiry is not None and (self.expiry[i] > hi_expiry or self.expiry[i] == NO_EXPIRY):
+                continue
+            yield Instrument(self, i)
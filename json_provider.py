@@ -0,0 +1,93 @@
+import dataclasses
+import decimal
+import json
+import os
+import uuid
+from datetime import date
+
+from flask.json.provider import JSONProvider
+
+from tracing import span
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+# Encoder used for every response: orjson when installed, or stdlib
+PROVIDER = os.environ.get('KAPI_JSON_PROVIDER', 'orjson' if orjson else 'stdlib')
+# Send the upstream body of positions, holdings and margins reads as received
+PASSTHROUGH = os.environ.get('KAPI_JSON_PASSTHROUGH', '1').lower() in ('1', 'true')
+
+
+def _default(o):
+    # Same output as orjson gives natively: ISO 8601 dates and times, keeping the offset
+    if isinstance(o, date):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, 'tolist'):
+        # NumPy arrays and scalars
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class StdlibProvider(JSONProvider):
+    """Compact stdlib JSON with keys in insertion order and ISO 8601 dates."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        kwargs.setdefault('default', _default)
+        kwargs.setdefault('separators', (',', ':'))
+        kwargs.setdefault('ensure_ascii', False)
+        return json.dumps(obj, **kwargs)
+
+    def dumpb(self, obj):
+        return self.dumps(obj).encode()
+
+    def loads(self, s, **kwargs):
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with span('serialize'):
+            body = self.dumpb(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+class OrjsonProvider(StdlibProvider):
+    """
+    orjson encoding, several times faster than the stdlib on large lists of
+    dicts. datetime, date, dataclasses and NumPy values are encoded natively;
+    the output matches StdlibProvider's.
+    """
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Formatting options only the stdlib encoder knows
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj).decode()
+
+    def dumpb(self, obj):
+        return orjson.dumps(obj, default=_default, option=self.options)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+PROVIDERS = {'orjson': OrjsonProvider, 'stdlib': StdlibProvider}
+
+
+def provider_class(name=PROVIDER):
+    if name == 'orjson' and orjson is None:
+        return StdlibProvider
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown JSON provider {name}, expected one of {', '.join(PROVIDERS)}")
+    return PROVIDERS[name]
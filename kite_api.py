@@ -1,12 +1,34 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, g
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask_cors import CORS
-from kite_trade import KiteApp, get_enctoken
+from kite_trade import get_enctoken
+from kite_pool import pool
+from candles import SESSION_OPEN, parse_aggregation
+from instrument_cache import IST, instrument_cache
+from instrument_store import FIELDS
+from read_cache import ORDER_WRITE_RESOURCES, read_cache
+from candle_store import request_bounds, today_start
+from compression import compress, identity_etag
+from json_provider import PASSTHROUGH, provider_class
+from metrics import REQUEST_LATENCY, REQUESTS_IN_FLIGHT, render as render_metrics
+from order_book import order_books, verify_postback
+from profiler import MAX_SECONDS, profile_path, start_profile
+from rate_limit import RateLimitExceeded
+from transport import KiteError
+from ticker import MODE_QUOTE, get_ticker, running_ticker
+import tracing
+import csv
+import functools
+import hashlib
+import hmac
+import io
 import json
 import os
-from datetime import timedelta
+import time
+from datetime import date, timedelta
 
 app = Flask(__name__)
+app.json = provider_class()(app)
 app.secret_key = os.urandom(24)  # Required for session
 app.permanent_session_lifetime = timedelta(days=1)  # Session expires after 1 day
 
@@ -33,8 +55,14 @@ app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
 @app.route('/swagger.json')
 def swagger_json():
-    with open('swagger.json', 'r') as f:
-        return f.read(), 200, {'Content-Type': 'application/json'}
+    body, etag = swagger_spec()
+    return not_modified(etag) or with_etag(raw_json(body), etag)
+
+@functools.lru_cache(maxsize=None)
+def swagger_spec():
+    """The encoded spec and its ETag, built on first request rather than at import."""
+    body = app.json.dumpb(swagger_config)
+    return body, make_etag(body)
 
 # Create Swagger JSON
 swagger_config = {
@@ -89,6 +117,60 @@ swagger_config = {
                         "in": "query",
                         "type": "string",
                         "required": False
+                    },
+                    {
+                        "name": "segment",
+                        "in": "query",
+                        "type": "string",
+                        "required": False
+                    },
+                    {
+                        "name": "instrument_type",
+                        "in": "query",
+                        "type": "string",
+                        "required": False
+                    },
+                    {
+                        "name": "name",
+                        "in": "query",
+                        "type": "string",
+                        "required": False
+                    },
+                    {
+                        "name": "expiry",
+                        "in": "query",
+                        "type": "string",
+                        "format": "date",
+                        "required": False
+                    },
+                    {
+                        "name": "expiry_from",
+                        "in": "query",
+                        "type": "string",
+                        "format": "date",
+                        "required": False
+                    },
+                    {
+                        "name": "expiry_to",
+                        "in": "query",
+                        "type": "string",
+                        "format": "date",
+                        "required": False
+                    },
+                    {
+                        "name": "fields",
+                        "in": "query",
+                        "type": "string",
+                        "description": "Comma separated list of columns to return",
+                        "required": False
+                    },
+                    {
+                        "name": "format",
+                        "in": "query",
+                        "type": "string",
+                        "enum": ["json", "ndjson", "csv"],
+                        "default": "json",
+                        "required": False
                     }
                 ],
                 "responses": {
@@ -98,6 +180,51 @@ swagger_config = {
                 }
             }
         },
+        "/instruments/lookup": {
+            "get": {
+                "summary": "Look up one instrument by token or exchange and tradingsymbol",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "instrument_token",
+                        "in": "query",
+                        "type": "integer",
+                        "required": False
+                    },
+                    {
+                        "name": "exchange",
+                        "in": "query",
+                        "type": "string",
+                        "required": False
+                    },
+                    {
+                        "name": "tradingsymbol",
+                        "in": "query",
+                        "type": "string",
+                        "required": False
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Instrument"
+                    },
+                    "404": {
+                        "description": "Instrument not found"
+                    }
+                }
+            }
+        },
+        "/instruments/refresh": {
+            "post": {
+                "summary": "Refresh the cached instrument master",
+                "security": [{"ApiKeyAuth": []}],
+                "responses": {
+                    "200": {
+                        "description": "Instrument cache refreshed"
+                    }
+                }
+            }
+        },
        
         "/historical-data": {
             "get": {
@@ -127,18 +254,541 @@ swagger_config = {
                         "in": "query",
                         "type": "string",
                         "required": True
+                    },
+                    {
+                        "name": "oi",
+                        "in": "query",
+                        "type": "boolean",
+                        "required": False
+                    },
+                    {
+                        "name": "format",
+                        "in": "query",
+                        "type": "string",
+                        "enum": ["records", "columns", "csv", "binary"],
+                        "default": "records",
+                        "description": "records: one object per candle; columns: one array per field with epoch timestamps; csv; binary: little-endian columns (see candles.py)",
+                        "required": False
+                    },
+                    {
+                        "name": "resample",
+                        "in": "query",
+                        "type": "string",
+                        "description": "Target bar width in minutes (e.g. 5, 75 or 15minute), a multiple of interval",
+                        "required": False
+                    },
+                    {
+                        "name": "session",
+                        "in": "query",
+                        "type": "string",
+                        "enum": sorted(SESSION_OPEN),
+                        "default": "NSE",
+                        "description": "Exchange session resampled bars are aligned to",
+                        "required": False
+                    },
+                    {
+                        "name": "agg",
+                        "in": "query",
+                        "type": "string",
+                        "description": "Aggregation overrides such as volume:sum,oi:max (first|last|max|min|sum)",
+                        "required": False
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Historical data"
+                    }
+                }
+            }
+        },
+        "/quote": {
+            "get": {
+                "summary": "Get full market quotes",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "i",
+                        "in": "query",
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "collectionFormat": "multi",
+                        "description": "Instrument as EXCHANGE:TRADINGSYMBOL or instrument token, repeatable",
+                        "required": False
+                    },
+                    {
+                        "name": "instruments",
+                        "in": "query",
+                        "type": "string",
+                        "description": "Comma separated instruments",
+                        "required": False
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Quotes keyed by instrument"
+                    }
+                }
+            },
+            "post": {
+                "summary": "Get full market quotes for a large instrument list",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "instruments": {"type": "array", "items": {"type": "string"}}
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Quotes keyed by instrument"
+                    }
+                }
+            }
+        },
+        "/ohlc": {
+            "get": {
+                "summary": "Get OHLC quotes",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "i",
+                        "in": "query",
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "collectionFormat": "multi",
+                        "description": "Instrument as EXCHANGE:TRADINGSYMBOL or instrument token, repeatable",
+                        "required": False
+                    },
+                    {
+                        "name": "instruments",
+                        "in": "query",
+                        "type": "string",
+                        "description": "Comma separated instruments",
+                        "required": False
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OHLC and last price keyed by instrument"
+                    }
+                }
+            },
+            "post": {
+                "summary": "Get OHLC quotes for a large instrument list",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "instruments": {"type": "array", "items": {"type": "string"}}
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "OHLC and last price keyed by instrument"
+                    }
+                }
+            }
+        },
+        "/ltp": {
+            "get": {
+                "summary": "Get last traded prices",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "i",
+                        "in": "query",
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "collectionFormat": "multi",
+                        "description": "Instrument as EXCHANGE:TRADINGSYMBOL or instrument token, repeatable",
+                        "required": False
+                    },
+                    {
+                        "name": "instruments",
+                        "in": "query",
+                        "type": "string",
+                        "description": "Comma separated instruments",
+                        "required": False
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Last traded prices keyed by instrument"
+                    }
+                }
+            },
+            "post": {
+                "summary": "Get last traded prices for a large instrument list",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "instruments": {"type": "array", "items": {"type": "string"}}
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Last traded prices keyed by instrument"
+                    }
+                }
+            }
+        },
+        "/place-order": {
+            "post": {
+                "summary": "Place a new order",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "variety": {"type": "string"},
+                                "exchange": {"type": "string"},
+                                "tradingsymbol": {"type": "string"},
+                                "transaction_type": {"type": "string"},
+                                "quantity": {"type": "integer"},
+                                "product": {"type": "string"},
+                                "order_type": {"type": "string"},
+                                "price": {"type": "number"},
+                                "validity": {"type": "string"},
+                                "disclosed_quantity": {"type": "integer"},
+                                "trigger_price": {"type": "number"},
+                                "squareoff": {"type": "number"},
+                                "stoploss": {"type": "number"},
+                                "trailing_stoploss": {"type": "number"},
+                                "tag": {"type": "string"}
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Order placed successfully"
+                    }
+                }
+            }
+        },
+        "/place-orders": {
+            "post": {
+                "summary": "Place several orders concurrently",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "orders": {
+                                    "type": "array",
+                                    "items": {"type": "object", "description": "Same fields as /place-order"}
+                                },
+                                "simultaneous": {
+                                    "type": "boolean",
+                                    "description": "Release all legs at once (at most 10)"
+                                }
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "One result per order, in input order"
+                    },
+                    "400": {
+                        "description": "Validation failed, no order was placed"
+                    }
+                }
+            }
+        },
+        "/orders": {
+            "get": {
+                "summary": "Get all orders, or the orders changed since a cursor",
+                "description": "Every answer carries a `cursor`; pass it back as `since` to receive only the orders changed after it. Full lists carry an ETag for If-None-Match. With `wait`, the request blocks until an order changes or the seconds pass.",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "since",
+                        "in": "query",
+                        "type": "integer",
+                        "required": False,
+                        "description": "Cursor of an earlier answer"
+                    },
+                    {
+                        "name": "wait",
+                        "in": "query",
+                        "type": "number",
+                        "required": False,
+                        "description": "Seconds to wait for the next change (max 25), from `since` or from now. Only in the async serving mode, synchronous workers answer 501"
+                    },
+                    {
+                        "name": "If-None-Match",
+                        "in": "header",
+                        "type": "string",
+                        "required": False
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "List of all orders, or of the orders changed since the cursor"
+                    },
+                    "304": {
+                        "description": "Orders unchanged since the ETag"
+                    }
+                }
+            }
+        },
+        "/postback": {
+            "post": {
+                "summary": "Kite order postback",
+                "description": "Order updates pushed by Kite, verified against KAPI_POSTBACK_SECRET, merged into the order books of the user.",
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {"type": "object"}
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Update applied"
+                    },
+                    "403": {
+                        "description": "Postbacks not configured or checksum mismatch"
+                    }
+                }
+            }
+        },
+        "/holdings": {
+            "get": {
+                "summary": "Get holdings",
+                "security": [{"ApiKeyAuth": []}],
+                "responses": {
+                    "200": {
+                        "description": "List of holdings"
+                    }
+                }
+            }
+        },
+        "/positions": {
+            "get": {
+                "summary": "Get positions",
+                "security": [{"ApiKeyAuth": []}],
+                "responses": {
+                    "200": {
+                        "description": "List of positions"
+                    }
+                }
+            }
+        },
+        "/profile": {
+            "get": {
+                "summary": "Get user profile",
+                "security": [{"ApiKeyAuth": []}],
+                "responses": {
+                    "200": {
+                        "description": "User profile information"
+                    }
+                }
+            }
+        },
+        "/margins": {
+            "get": {
+                "summary": "Get user margins",
+                "security": [{"ApiKeyAuth": []}],
+                "responses": {
+                    "200": {
+                        "description": "User margin information"
+                    }
+                }
+            }
+        },
+        "/modify-order": {
+            "put": {
+                "summary": "Modify an existing order",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "variety": {"type": "string"},
+                                "order_id": {"type": "string"},
+                                "parent_order_id": {"type": "string"},
+                                "quantity": {"type": "integer"},
+                                "price": {"type": "number"},
+                                "order_type": {"type": "string"},
+                                "trigger_price": {"type": "number"},
+                                "validity": {"type": "string"},
+                                "disclosed_quantity": {"type": "integer"}
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Order modified successfully"
+                    }
+                }
+            }
+        },
+        "/cancel-order": {
+            "delete": {
+                "summary": "Cancel an existing order",
+                "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "variety": {"type": "string"},
+                                "order_id": {"type": "string"},
+                                "parent_order_id": {"type": "string"}
+                            }
+                        }
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "Order cancelled successfully"
+                    }
+                }
+            }
+        },
+        "/metrics": {
+            "get": {
+                "summary": "Prometheus metrics of all workers",
+                "description": "Request latency per route and status, Kite call latency and errors per KiteApp call, in-flight requests, upstream connection use and cache hits. Needs `Authorization: Bearer <KAPI_METRICS_TOKEN>`, disabled when that is unset.",
+                "produces": ["text/plain"],
+                "responses": {
+                    "200": {
+                        "description": "Prometheus text exposition format"
+                    },
+                    "401": {
+                        "description": "Invalid metrics token"
+                    },
+                    "404": {
+                        "description": "KAPI_METRICS_TOKEN is unset"
+                    }
+                }
+            }
+        },
+        "/debug/profile": {
+            "post": {
+                "summary": "Sample the stacks of the worker answering for a few seconds",
+                "description": "Needs `Authorization: Bearer <KAPI_ADMIN_TOKEN>`, disabled when that is unset. Only the worker that answers is profiled; download the result from the returned URL once `seconds` have passed.",
+                "parameters": [
+                    {
+                        "name": "seconds",
+                        "in": "query",
+                        "type": "number",
+                        "required": False,
+                        "description": f"How long to sample (default 10, max {MAX_SECONDS})"
+                    },
+                    {
+                        "name": "interval",
+                        "in": "query",
+                        "type": "number",
+                        "required": False,
+                        "description": "Seconds between samples (default 0.01)"
+                    }
+                ],
+                "responses": {
+                    "202": {
+                        "description": "Profile started, with its id and download URL"
+                    },
+                    "401": {
+                        "description": "Invalid admin token"
+                    },
+                    "409": {
+                        "description": "A profile is already running in this worker"
+                    }
+                }
+            }
+        },
+        "/debug/profile/{profile_id}": {
+            "get": {
+                "summary": "Download a finished profile as folded stacks (flamegraph.pl, speedscope)",
+                "description": "Needs `Authorization: Bearer <KAPI_ADMIN_TOKEN>`.",
+                "produces": ["text/plain"],
+                "parameters": [
+                    {
+                        "name": "profile_id",
+                        "in": "path",
+                        "type": "string",
+                        "required": True
+                    }
+                ],
+                "responses": {
+                    "200": {
+                        "description": "One `thread;outer;...;inner count` line per sampled stack"
+                    },
+                    "401": {
+                        "description": "Invalid admin token"
+                    },
+                    "404": {
+                        "description": "Profile still running or unknown"
+                    }
+                }
+            }
+        },
+        "/rate-limits": {
+            "get": {
+                "summary": "Available slots, queue depth and upstream 429 penalty of the caller's upstream rate limit buckets",
+                "security": [{"ApiKeyAuth": []}],
+                "responses": {
+                    "200": {
+                        "description": "Rate limit state per endpoint class"
                     }
-                ],
+                }
+            }
+        },
+        "/ticker": {
+            "get": {
+                "summary": "State of the caller's market data WebSocket",
+                "security": [{"ApiKeyAuth": []}],
                 "responses": {
                     "200": {
-                        "description": "Historical data"
+                        "description": "Connection state, subscriptions by mode and connected stream clients"
                     }
                 }
             }
         },
-        "/place-order": {
+        "/ticker/subscribe": {
             "post": {
-                "summary": "Place a new order",
+                "summary": "Stream instruments on the caller's market data WebSocket",
                 "security": [{"ApiKeyAuth": []}],
                 "parameters": [
                     {
@@ -148,141 +798,159 @@ swagger_config = {
                         "schema": {
                             "type": "object",
                             "properties": {
-                                "variety": {"type": "string"},
-                                "exchange": {"type": "string"},
-                                "tradingsymbol": {"type": "string"},
-                                "transaction_type": {"type": "string"},
-                                "quantity": {"type": "integer"},
-                                "product": {"type": "string"},
-                                "order_type": {"type": "string"},
-                                "price": {"type": "number"},
-                                "validity": {"type": "string"},
-                                "disclosed_quantity": {"type": "integer"},
-                                "trigger_price": {"type": "number"},
-                                "squareoff": {"type": "number"},
-                                "stoploss": {"type": "number"},
-                                "trailing_stoploss": {"type": "number"},
-                                "tag": {"type": "string"}
+                                "instruments": {
+                                    "type": "array",
+                                    "items": {"type": "string"},
+                                    "description": "Instrument tokens or EXCHANGE:TRADINGSYMBOL keys"
+                                },
+                                "mode": {"type": "string", "enum": ["ltp", "quote", "full"], "default": "quote"}
                             }
                         }
                     }
                 ],
                 "responses": {
                     "200": {
-                        "description": "Order placed successfully"
+                        "description": "Ticker state after subscribing"
                     }
                 }
             }
         },
-        "/orders": {
-            "get": {
-                "summary": "Get all orders",
+        "/ticker/unsubscribe": {
+            "post": {
+                "summary": "Stop streaming instruments",
                 "security": [{"ApiKeyAuth": []}],
-                "responses": {
-                    "200": {
-                        "description": "List of all orders"
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": True,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "instruments": {"type": "array", "items": {"type": "string"}}
+                            }
+                        }
                     }
-                }
-            }
-        },
-        "/holdings": {
-            "get": {
-                "summary": "Get holdings",
-                "security": [{"ApiKeyAuth": []}],
+                ],
                 "responses": {
                     "200": {
-                        "description": "List of holdings"
+                        "description": "Ticker state after unsubscribing"
                     }
                 }
             }
         },
-        "/positions": {
+        "/ticker/stream": {
             "get": {
-                "summary": "Get positions",
+                "summary": "Server-Sent Events stream of live ticks",
+                "description": "`ticks` events carry a JSON array with the latest tick of every instrument that changed, `order` events carry order updates. Instruments given are subscribed first.",
                 "security": [{"ApiKeyAuth": []}],
-                "responses": {
-                    "200": {
-                        "description": "List of positions"
+                "produces": ["text/event-stream"],
+                "parameters": [
+                    {
+                        "name": "i",
+                        "in": "query",
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "collectionFormat": "multi",
+                        "required": False,
+                        "description": "Instruments to receive, all streamed instruments when omitted"
+                    },
+                    {
+                        "name": "mode",
+                        "in": "query",
+                        "type": "string",
+                        "enum": ["ltp", "quote", "full"],
+                        "default": "quote",
+                        "required": False
                     }
-                }
-            }
-        },
-        "/profile": {
-            "get": {
-                "summary": "Get user profile",
-                "security": [{"ApiKeyAuth": []}],
+                ],
                 "responses": {
                     "200": {
-                        "description": "User profile information"
+                        "description": "Event stream"
+                    },
+                    "501": {
+                        "description": "Not served by synchronous workers, run the async serving mode"
                     }
                 }
             }
         },
-        "/margins": {
-            "get": {
-                "summary": "Get user margins",
+        "/cancel-all-orders": {
+            "post": {
+                "summary": "Cancel all open orders, optionally filtered",
                 "security": [{"ApiKeyAuth": []}],
+                "parameters": [
+                    {
+                        "name": "body",
+                        "in": "body",
+                        "required": False,
+                        "schema": {
+                            "type": "object",
+                            "properties": {
+                                "tag": {"type": "string"},
+                                "tradingsymbol": {"type": "string"},
+                                "product": {"type": "string"},
+                                "exchange": {"type": "string"}
+                            }
+                        }
+                    }
+                ],
                 "responses": {
                     "200": {
-                        "description": "User margin information"
+                        "description": "Bulk report with one result per order"
                     }
                 }
             }
         },
-        "/modify-order": {
-            "put": {
-                "summary": "Modify an existing order",
+        "/exit-sl-orders": {
+            "post": {
+                "summary": "Convert all trigger pending SL orders to market orders",
                 "security": [{"ApiKeyAuth": []}],
                 "parameters": [
                     {
                         "name": "body",
                         "in": "body",
-                        "required": True,
+                        "required": False,
                         "schema": {
                             "type": "object",
                             "properties": {
-                                "variety": {"type": "string"},
-                                "order_id": {"type": "string"},
-                                "parent_order_id": {"type": "string"},
-                                "quantity": {"type": "integer"},
-                                "price": {"type": "number"},
-                                "order_type": {"type": "string"},
-                                "trigger_price": {"type": "number"},
-                                "validity": {"type": "string"},
-                                "disclosed_quantity": {"type": "integer"}
+                                "tag": {"type": "string"},
+                                "tradingsymbol": {"type": "string"},
+                                "product": {"type": "string"},
+                                "exchange": {"type": "string"}
                             }
                         }
                     }
                 ],
                 "responses": {
                     "200": {
-                        "description": "Order modified successfully"
+                        "description": "Bulk report with one result per order"
                     }
                 }
             }
         },
-        "/cancel-order": {
-            "delete": {
-                "summary": "Cancel an existing order",
+        "/square-off-positions": {
+            "post": {
+                "summary": "Square off all open positions of a product (default MIS)",
                 "security": [{"ApiKeyAuth": []}],
                 "parameters": [
                     {
                         "name": "body",
                         "in": "body",
-                        "required": True,
+                        "required": False,
                         "schema": {
                             "type": "object",
                             "properties": {
-                                "variety": {"type": "string"},
-                                "order_id": {"type": "string"},
-                                "parent_order_id": {"type": "string"}
+                                "product": {"type": "string"},
+                                "tradingsymbol": {"type": "string"},
+                                "exchange": {"type": "string"},
+                                "tag": {"type": "string"}
                             }
                         }
                     }
                 ],
                 "responses": {
                     "200": {
-                        "description": "Order cancelled successfully"
+                        "description": "Bulk report with one result per order"
                     }
                 }
             }
@@ -290,11 +958,7 @@ swagger_config = {
     }
 }
 
-# Save Swagger configuration
-with open('swagger.json', 'w') as f:
-    json.dump(swagger_config, f)
-
-def get_kite_instance():
+def get_kite_instance(apps=pool):
     # First try to get enctoken from session
     enctoken = session.get('enctoken')
     # If not in session, try to get from header
@@ -306,7 +970,152 @@ def get_kite_instance():
             session.permanent = True
     if not enctoken:
         return None
-    return KiteApp(enctoken)
+    g.kite = apps.get(enctoken)
+    g.kite_apps = apps
+    return g.kite
+
+def raw_json(body):
+    """Response for JSON bytes encoded elsewhere, upstream bodies passed through as they came."""
+    return Response(body, mimetype='application/json')
+
+def error_response(e):
+    # Upstream failures keep Kite's status and error_type, anything else is a bad request
+    if isinstance(e, RateLimitExceeded):
+        return jsonify(e.to_dict()), e.status, {'Retry-After': str(e.retry_after)}
+    if isinstance(e, KiteError):
+        return jsonify(e.to_dict()), e.status
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.after_request
+def evict_invalid_session(response):
+    # Drop sessions whose enctoken upstream rejected so the next request can log in afresh
+    kite = g.get('kite')
+    if kite is not None and kite.invalidated:
+        g.kite_apps.evict(kite.enctoken)
+        session.pop('enctoken', None)
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    # Registered before compress_response so it runs after it and sees the compression span
+    trace = tracing.current_trace()
+    if trace is not None:
+        total = time.perf_counter() - g.request_start
+        response.headers['Server-Timing'] = trace.server_timing(total)
+        tracing.log_request(trace, request.method, g.route, response.status_code, total)
+    return response
+
+@app.after_request
+def compress_response(response):
+    with tracing.span('compress'):
+        return compress(response, request.accept_encodings)
+
+@app.before_request
+def start_request_metrics():
+    g.route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.labels(g.route).inc()
+    if tracing.TRACING:
+        g.trace_token = tracing.start_trace()
+
+@app.after_request
+def record_status(response):
+    g.status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    start = g.get('request_start')
+    if start is None:
+        return
+    REQUESTS_IN_FLIGHT.labels(g.route).dec()
+    # Without an after_request the view raised, which Flask answers with a 500
+    REQUEST_LATENCY.labels(g.route, request.method, g.get('status', 500)).observe(time.perf_counter() - start)
+    token = g.pop('trace_token', None)
+    if token is not None:
+        tracing.end_trace(token)
+
+def bearer_ok(token):
+    """Whether the request carries `Authorization: Bearer <token>`."""
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+# Bearer tokens of the operator endpoints, each disabled while its token is unset
+METRICS_TOKEN = os.environ.get('KAPI_METRICS_TOKEN')
+ADMIN_TOKEN = os.environ.get('KAPI_ADMIN_TOKEN')
+
+def token_error(token, what, setting):
+    """404 while the endpoint's token is unset, 401 unless the request carries it, else None."""
+    if not token:
+        return jsonify({"status": "error", "message": f"{what} disabled, set {setting}"}), 404
+    if not bearer_ok(token):
+        return jsonify({"status": "error", "message": "Invalid token"}), 401
+    return None
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    error = token_error(METRICS_TOKEN, "Metrics are", "KAPI_METRICS_TOKEN")
+    if error:
+        return error
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+def _admin_error():
+    return token_error(ADMIN_TOKEN, "Debug endpoints are", "KAPI_ADMIN_TOKEN")
+
+@app.route('/debug/profile', methods=['POST'])
+def start_debug_profile():
+    error = _admin_error()
+    if error:
+        return error
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.01))
+        profile = start_profile(seconds, interval)
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except Exception as e:
+        return error_response(e)
+    return jsonify({"status": "success", "data": {
+        "id": profile.id,
+        "pid": os.getpid(),
+        "seconds": profile.seconds,
+        "url": f"/debug/profile/{profile.id}",
+    }}), 202
+
+@app.route('/debug/profile/<profile_id>', methods=['GET'])
+def download_debug_profile(profile_id):
+    error = _admin_error()
+    if error:
+        return error
+    path = profile_path(profile_id)
+    if path is None:
+        return jsonify({"status": "error", "message": f"Profile {profile_id} is not ready or does not exist"}), 404
+    with open(path, 'rb') as f:
+        body = f.read()
+    return Response(body, mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename="{profile_id}.folded"'})
+
+# Cache-Control of resources clients must revalidate, and of ones that never change
+REVALIDATE = 'private, no-cache'
+IMMUTABLE = 'private, max-age=86400, immutable'
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def not_modified(etag, cache_control=REVALIDATE):
+    """304 answer when If-None-Match names `etag` in any content encoding, None otherwise."""
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if identity_etag(tag) == etag:
+            response = Response(status=304)
+            response.set_etag(tag)
+            response.headers['Cache-Control'] = cache_control
+            return response
+    return None
+
+def with_etag(response, etag, cache_control=REVALIDATE):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -322,7 +1131,7 @@ def login():
             "enctoken": enctoken
         })
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 @app.route('/instruments', methods=['GET'])
 def get_instruments():
@@ -330,12 +1139,117 @@ def get_instruments():
     if not kite:
         return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
     
-    exchange = request.args.get('exchange')
     try:
-        instruments = kite.instruments(exchange)
-        return jsonify({"status": "success", "data": instruments})
+        args = request.args
+        fmt = args.get('format', 'json')
+        if fmt not in INSTRUMENT_FORMATS:
+            raise ValueError(f"Unsupported format {fmt}, expected one of {', '.join(INSTRUMENT_FORMATS)}")
+        fields = tuple(args['fields'].split(',')) if args.get('fields') else FIELDS
+        unknown = [field for field in fields if field not in FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        instruments = kite.search_instruments(
+            exchange=args.get('exchange'),
+            segment=args.get('segment'),
+            instrument_type=args.get('instrument_type'),
+            name=args.get('name'),
+            expiry=_parse_date(args.get('expiry')),
+            expiry_from=_parse_date(args.get('expiry_from')),
+            expiry_to=_parse_date(args.get('expiry_to'))
+        )
+        # The master changes once a day, so a repeated query is answered from its version alone
+        etag = make_etag(instrument_cache.version(), sorted(args.items(multi=True)))
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        encode, mimetype = INSTRUMENT_FORMATS[fmt]
+        return with_etag(Response(encode(instruments, fields), mimetype=mimetype), etag)
+    except Exception as e:
+        return error_response(e)
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+# Rows encoded per chunk written to the socket
+STREAM_BATCH = 500
+
+def _batched(rows, fields):
+    batch = []
+    for row in rows:
+        batch.append(row.to_dict(fields))
+        if len(batch) == STREAM_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _instruments_json(rows, fields):
+    # Same envelope as jsonify, written incrementally
+    dumps = app.json.dumps
+    yield '{"status": "success", "data": ['
+    sep = ''
+    for batch in _batched(rows, fields):
+        yield sep + ','.join(dumps(row) for row in batch)
+        sep = ','
+    yield ']}\n'
+
+def _instruments_ndjson(rows, fields):
+    dumps = app.json.dumps
+    for batch in _batched(rows, fields):
+        yield ''.join(dumps(row) + '\n' for row in batch)
+
+def _instruments_csv(rows, fields):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(fields)
+    for batch in _batched(rows, fields):
+        writer.writerows([('' if row[f] is None else row[f]) for f in fields] for row in batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+INSTRUMENT_FORMATS = {
+    'json': (_instruments_json, 'application/json'),
+    'ndjson': (_instruments_ndjson, 'application/x-ndjson'),
+    'csv': (_instruments_csv, 'text/csv'),
+}
+
+@app.route('/instruments/lookup', methods=['GET'])
+def lookup_instrument():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        instrument_token = request.args.get('instrument_token')
+        if instrument_token:
+            instrument = kite.get_instrument(int(instrument_token))
+        else:
+            instrument = kite.lookup(request.args['exchange'], request.args['tradingsymbol'])
+        if instrument is None:
+            return jsonify({"status": "error", "message": "Instrument not found"}), 404
+        return jsonify({"status": "success", "data": instrument.to_dict()})
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/instruments/refresh', methods=['POST'])
+def refresh_instruments():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        instruments = kite.instruments(refresh=True)
+        trading_day, fetched_at = instrument_cache.version()
+        return jsonify({
+            "status": "success",
+            "trading_day": trading_day,
+            "fetched_at": fetched_at,
+            "count": len(instruments)
+        })
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 
 @app.route('/historical-data', methods=['GET'])
@@ -349,16 +1263,98 @@ def get_historical_data():
         from_date = request.args.get('from_date')
         to_date = request.args.get('to_date')
         interval = request.args.get('interval')
+        oi = request.args.get('oi', '').lower() in ('1', 'true')
+        
+        fmt = request.args.get('format', 'records')
+        if fmt not in CANDLE_FORMATS:
+            raise ValueError(f"Unsupported format {fmt}, expected one of {', '.join(CANDLE_FORMATS)}")
+        etag = historical_etag()
+        unchanged = etag and not_modified(etag, IMMUTABLE)
+        if unchanged:
+            return unchanged
         
-        historical_data = kite.historical_data_v2(
+        candles = kite.historical_columns(
             instrument_token=instrument_token,
             from_date=from_date,
             to_date=to_date,
-            interval=interval
+            interval=interval,
+            oi=oi,
+            resample=request.args.get('resample') or None,
+            session=request.args.get('session', 'NSE'),
+            aggregation=parse_aggregation(request.args.get('agg'))
         )
-        return jsonify({"status": "success", "data": historical_data})
+        return historical_response(CANDLE_FORMATS[fmt](candles), etag)
+    except Exception as e:
+        return error_response(e)
+
+def historical_etag():
+    """
+    ETag of a historical request whose range ended before today: past candles are
+    final, so the answer is fixed by the query. None for ranges still being written.
+    """
+    args = request.args
+    try:
+        _, end = request_bounds(args['from_date'], args['to_date'])
+    except (KeyError, ValueError):
+        return None
+    if end > today_start():
+        return None
+    return make_etag('historical', sorted(args.items(multi=True)))
+
+def historical_response(response, etag):
+    return with_etag(response, etag, IMMUTABLE) if etag else response
+
+def _candles_records(candles):
+    return jsonify({"status": "success", "data": candles.to_records(IST)})
+
+def _candles_columns(candles):
+    return jsonify({"status": "success", "data": candles.to_dict()})
+
+def _candles_csv(candles):
+    with tracing.span('serialize'):
+        body = candles.to_csv()
+    return Response(body, mimetype='text/csv')
+
+def _candles_binary(candles):
+    with tracing.span('serialize'):
+        body = candles.to_binary()
+    return Response(body, mimetype='application/octet-stream')
+
+CANDLE_FORMATS = {
+    'records': _candles_records,
+    'columns': _candles_columns,
+    'csv': _candles_csv,
+    'binary': _candles_binary,
+}
+
+@app.route('/quote', methods=['GET', 'POST'])
+def get_quote():
+    return _market_data('quote')
+
+@app.route('/ohlc', methods=['GET', 'POST'])
+def get_ohlc():
+    return _market_data('ohlc')
+
+@app.route('/ltp', methods=['GET', 'POST'])
+def get_ltp():
+    return _market_data('ltp')
+
+def _market_data(mode):
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        if request.method == 'POST':
+            instruments = request.get_json()['instruments']
+        else:
+            instruments = instrument_args()
+        if not instruments:
+            raise ValueError("No instruments given")
+        data = kite.market_data(instruments, mode)
+        return jsonify({"status": "success", "data": data})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 @app.route('/place-order', methods=['POST'])
 def place_order():
@@ -369,9 +1365,24 @@ def place_order():
     try:
         data = request.get_json()
         order_id = kite.place_order(**data)
+        read_cache.invalidate(kite.enctoken, ORDER_WRITE_RESOURCES)
         return jsonify({"status": "success", "order_id": order_id})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
+
+@app.route('/place-orders', methods=['POST'])
+def place_orders():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        data = request.get_json()
+        results = kite.place_orders(data['orders'], simultaneous=bool(data.get('simultaneous')))
+        read_cache.invalidate(kite.enctoken, ORDER_WRITE_RESOURCES)
+        return jsonify({"status": "success", "data": results})
+    except Exception as e:
+        return error_response(e)
 
 @app.route('/orders', methods=['GET'])
 def get_orders():
@@ -380,10 +1391,38 @@ def get_orders():
         return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
     
     try:
-        orders = kite.orders()
-        return jsonify({"status": "success", "data": orders})
+        if float(request.args.get('wait', 0)) > 0:
+            # asgi.py serves long-polls on its event loop, here each one would hold a whole worker
+            return jsonify({"status": "error", "message": "wait needs the async serving mode (asgi:app)"}), 501
+        book = order_books.get(kite.enctoken)
+        book.refresh(read_cache.get(kite.enctoken, 'orders', kite.orders))
+        since = request.args.get('since')
+        if since is None:
+            return orders_response(book)
+        orders, cursor = book.changes(int(since))
+        return jsonify({"status": "success", "data": orders, "cursor": cursor})
+    except Exception as e:
+        return error_response(e)
+
+def orders_response(book):
+    """The whole order list with its cursor, encoded once per change and reused for every poller."""
+    orders, etag, cursor = book.encoded(app.json.dumpb)
+    return not_modified(etag) or with_etag(
+        raw_json(b'{"status":"success","data":%s,"cursor":%d}' % (orders, cursor)), etag)
+
+@app.route('/postback', methods=['POST'])
+def order_postback():
+    try:
+        order = request.get_json(force=True)
+        verify_postback(order)
+    except PermissionError as e:
+        return jsonify({"status": "error", "message": str(e)}), 403
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
+
+    order = {key: value for key, value in order.items() if key not in ('checksum', 'app_id')}
+    order_books.postback(order)
+    return jsonify({"status": "success"})
 
 @app.route('/holdings', methods=['GET'])
 def get_holdings():
@@ -392,10 +1431,12 @@ def get_holdings():
         return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
     
     try:
-        holdings = kite.holdings()
+        if PASSTHROUGH:
+            return raw_json(read_cache.get(kite.enctoken, 'holdings', lambda: kite.holdings(raw=True)))
+        holdings = read_cache.get(kite.enctoken, 'holdings', kite.holdings)
         return jsonify({"status": "success", "data": holdings})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 @app.route('/positions', methods=['GET'])
 def get_positions():
@@ -404,10 +1445,12 @@ def get_positions():
         return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
     
     try:
-        positions = kite.positions()
+        if PASSTHROUGH:
+            return raw_json(read_cache.get(kite.enctoken, 'positions', lambda: kite.positions(raw=True)))
+        positions = read_cache.get(kite.enctoken, 'positions', kite.positions)
         return jsonify({"status": "success", "data": positions})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 @app.route('/profile', methods=['GET'])
 def get_profile():
@@ -416,10 +1459,10 @@ def get_profile():
         return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
     
     try:
-        profile = kite.profile()
+        profile = read_cache.get(kite.enctoken, 'profile', kite.profile)
         return jsonify({"status": "success", "data": profile})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
     
 @app.route('/margins', methods=['GET'])
 def get_margins():
@@ -428,10 +1471,12 @@ def get_margins():
         return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
     
     try:
-        margins = kite.margins()
+        if PASSTHROUGH:
+            return raw_json(read_cache.get(kite.enctoken, 'margins', lambda: kite.margins(raw=True)))
+        margins = read_cache.get(kite.enctoken, 'margins', kite.margins)
         return jsonify({"status": "success", "data": margins})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 @app.route('/modify-order', methods=['PUT'])
 def modify_order():
@@ -442,9 +1487,10 @@ def modify_order():
     try:
         data = request.get_json()
         order_id = kite.modify_order(**data)
+        read_cache.invalidate(kite.enctoken, ORDER_WRITE_RESOURCES)
         return jsonify({"status": "success", "order_id": order_id})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
 
 @app.route('/cancel-order', methods=['DELETE'])
 def cancel_order():
@@ -455,9 +1501,135 @@ def cancel_order():
     try:
         data = request.get_json()
         order_id = kite.cancel_order(**data)
+        read_cache.invalidate(kite.enctoken, ORDER_WRITE_RESOURCES)
         return jsonify({"status": "success", "order_id": order_id})
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return error_response(e)
+
+@app.route('/cancel-all-orders', methods=['POST'])
+def cancel_all_orders():
+    return _bulk_order_operation('cancel_all_orders', ('tag', 'tradingsymbol', 'product', 'exchange'))
+
+@app.route('/exit-sl-orders', methods=['POST'])
+def exit_sl_orders():
+    return _bulk_order_operation('exit_sl_orders', ('tag', 'tradingsymbol', 'product', 'exchange'))
+
+@app.route('/square-off-positions', methods=['POST'])
+def square_off_positions():
+    return _bulk_order_operation('square_off_positions', ('product', 'tradingsymbol', 'exchange', 'tag'))
+
+def _bulk_order_operation(method, filters):
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        data = request.get_json(silent=True) or {}
+        report = getattr(kite, method)(**{k: data[k] for k in filters if k in data})
+        read_cache.invalidate(kite.enctoken, ORDER_WRITE_RESOURCES)
+        return jsonify({"status": "success", "data": report})
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/rate-limits', methods=['GET'])
+def get_rate_limits():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        return jsonify({"status": "success", "data": kite.rate_limits()})
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/ticker', methods=['GET'])
+def get_ticker_status():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        return jsonify({"status": "success", "data": user_ticker(kite).status()})
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/ticker/subscribe', methods=['POST'])
+def ticker_subscribe():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        data = request.get_json()
+        ticker = user_ticker(kite)
+        ticker.subscribe(ticker_tokens(data['instruments'], kite.lookup), data.get('mode', MODE_QUOTE))
+        return jsonify({"status": "success", "data": ticker.status()})
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/ticker/unsubscribe', methods=['POST'])
+def ticker_unsubscribe():
+    kite = get_kite_instance()
+    if not kite:
+        return jsonify({"status": "error", "message": "Missing or invalid enctoken"}), 401
+
+    try:
+        data = request.get_json()
+        ticker = user_ticker(kite)
+        ticker.unsubscribe(ticker_tokens(data['instruments'], kite.lookup))
+        return jsonify({"status": "success", "data": ticker.status()})
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/ticker/stream', methods=['GET'])
+def ticker_stream():
+    # asgi.py serves the stream on its event loop, so this view only runs under WSGI workers, where
+    # every client would hold a whole worker until gunicorn's timeout kills it
+    return jsonify({"status": "error", "message": "Live tick streams need the async serving mode (asgi:app)"}), 501
+
+# Seconds between keepalive comments on an idle event stream
+TICKER_KEEPALIVE = 15
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def profile_user_id(kite):
+    """Kite user id of the enctoken's session, from its cached profile."""
+    return read_cache.get(kite.enctoken, 'profile', kite.profile)['user_id']
+
+def user_ticker(kite, user_id=None):
+    """
+    The enctoken's ticker, feeding its order messages to the user's order book.
+    Args:
+        kite: KiteApp of the enctoken
+        user_id: Kite user id for a new ticker, looked up from the profile when not given
+    """
+    ticker = running_ticker(kite.enctoken)
+    if ticker is None:
+        ticker = get_ticker(kite.enctoken, user_id or profile_user_id(kite))
+    handler = order_books.get(kite.enctoken).handle_message
+    if handler not in ticker.message_handlers:
+        ticker.message_handlers.append(handler)
+    return ticker
+
+def instrument_args():
+    """Instruments of a GET request, as repeated `i` or comma separated `instruments`."""
+    instruments = request.args.getlist('i')
+    for value in request.args.getlist('instruments'):
+        instruments.extend(filter(None, value.split(',')))
+    return instruments
+
+def ticker_tokens(instruments, lookup):
+    """Instrument tokens for tokens or EXCHANGE:TRADINGSYMBOL keys, resolved with `lookup`."""
+    tokens = []
+    for instrument in map(str, instruments):
+        if instrument.isdigit():
+            tokens.append(int(instrument))
+            continue
+        exchange, _, tradingsymbol = instrument.partition(':')
+        row = lookup(exchange, tradingsymbol)
+        if row is None:
+            raise ValueError(f"Unknown instrument {instrument}")
+        tokens.append(row.instrument_token)
+    return tokens
 
 @app.route('/', methods=['OPTIONS'])
 @app.route('/<path:path>', methods=['OPTIONS'])
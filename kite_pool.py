@@ -0,0 +1,71 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from kite_trade import KiteApp
+from metrics import SESSIONS
+
+
+class KiteAppPool:
+    """
+    Process-wide registry of KiteApp instances keyed by enctoken, so that
+    requests from the same user reuse one session and its keep-alive connections.
+    Args:
+        max_size: Maximum number of cached sessions, least recently used are evicted first
+        ttl: Seconds after which a session is rebuilt
+        factory: Client class built for new enctokens (KiteApp or AsyncKiteApp)
+    """
+
+    def __init__(self, max_size=256, ttl=6 * 60 * 60, factory=KiteApp):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.factory = factory
+        self._apps = OrderedDict()
+        self._lock = threading.Lock()
+        self._sessions = SESSIONS.labels(factory.__name__)
+
+    def get(self, enctoken):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._apps.get(enctoken)
+            if entry is not None:
+                kite, created = entry
+                if not kite.invalidated and now - created < self.ttl:
+                    self._apps.move_to_end(enctoken)
+                    return kite
+                del self._apps[enctoken]
+                kite.close()
+            kite = self.factory(enctoken)
+            self._apps[enctoken] = (kite, now)
+            while len(self._apps) > self.max_size:
+                _, (old, _) = self._apps.popitem(last=False)
+                old.close()
+            self._sessions.set(len(self._apps))
+            return kite
+
+    def evict(self, enctoken):
+        with self._lock:
+            entry = self._apps.pop(enctoken, None)
+            self._sessions.set(len(self._apps))
+        if entry is not None:
+            entry[0].close()
+
+    def clear(self):
+        """Close and drop every session, returning the closed instances."""
+        with self._lock:
+            entries = list(self._apps.values())
+            self._apps.clear()
+            self._sessions.set(0)
+        for kite, _ in entries:
+            kite.close()
+        return [kite for kite, _ in entries]
+
+    def __len__(self):
+        return len(self._apps)
+
+
+pool = KiteAppPool(
+    max_size=int(os.environ.get('KAPI_POOL_SIZE', 256)),
+    ttl=int(os.environ.get('KAPI_SESSION_TTL', 6 * 60 * 60))
+)
@@ -1,28 +1,166 @@
+import requests
+import contextvars
+import hashlib
+import inspect
+import json
 import os
-try:
-    import requests,json
-except ImportError:
-    os.system('python -m pip install requests')
-try:
-    import dateutil
-except ImportError:
-    os.system('python -m pip install python-dateutil')
+import random
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from candle_store import candle_store, format_bound, request_bounds, split_range
+from candles import Candles, candle_datetime, candle_epoch, interval_minutes
+from instrument_cache import IST, instrument_cache, next_refresh
+from instrument_parser import parse_instruments
+from instrument_store import InstrumentTable
+from quote_cache import quote_cache
+from rate_limit import RateLimiter
+from ticker import live_quotes
+from tracing import span
+from transport import KiteError, check_payload, connect_failed, network_error, transport
+
+# Kite's web origin (login and the /oms API) and the Kite Connect API origin serving the
+# instrument dump. Point both at a local server to develop or benchmark without the broker.
+KITE_URL = os.environ.get('KAPI_KITE_URL', 'https://kite.zerodha.com').rstrip('/')
+KITE_API_URL = os.environ.get('KAPI_KITE_API_URL', 'https://api.kite.trade').rstrip('/')
+
+# Requests per second Kite allows per user for each class of endpoint
+RATE_LIMITS = {
+    "quote": 1,
+    "historical": 3,
+    "order": 10,
+    "other": 10,
+}
+HISTORICAL_RATE = RATE_LIMITS["historical"]
+ORDER_RATE = RATE_LIMITS["order"]
+# Threads fetching historical chunks for all users of a worker, each user holding at most HISTORICAL_RATE
+HISTORICAL_THREADS = int(os.environ.get('KAPI_HISTORICAL_THREADS', 16))
+# Threads sending batch and bulk order calls for all users of a worker, each user holding at most ORDER_RATE
+ORDER_THREADS = int(os.environ.get('KAPI_ORDER_THREADS', 32))
+# Seconds the in-process instrument table is served before the on-disk cache is checked again
+INSTRUMENT_RECHECK = float(os.environ.get('KAPI_INSTRUMENT_RECHECK', 60))
+
+# Retries after an upstream 429, backing off from BACKOFF seconds unless told otherwise by Retry-After
+RETRIES_429 = 3
+BACKOFF = 0.5
+
+# Start of Kite's compact success envelope, bodies that begin with it can be passed on undecoded
+SUCCESS_PREFIX = b'{"status":"success","data":'
+
+# Instruments Kite accepts in one request for each quote mode
+QUOTE_BATCH_SIZE = {
+    "quote": 500,
+    "ohlc": 1000,
+    "ltp": 1000,
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class ContextExecutor(ThreadPoolExecutor):
+    """Thread pool running each task in the submitter's contextvars, so the request's trace follows it."""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def executor(name, max_workers):
+    # Created on first use so no threads exist in the gunicorn master before fork
+    with _executors_lock:
+        pool = _executors.get(name)
+        if pool is None:
+            pool = _executors[name] = ContextExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return pool
+
+
+_semaphores = weakref.WeakValueDictionary()
+
+
+def limiter_semaphore(limiter, limit):
+    """Semaphore bounding the concurrent calls of one rate limit bucket, shared by every session of its user."""
+    with _executors_lock:
+        semaphore = _semaphores.get(limiter.key)
+        if semaphore is None:
+            semaphore = _semaphores[limiter.key] = threading.BoundedSemaphore(limit)
+        return semaphore
+
+
+# Rate slot the submitting thread already took for a pooled task, used by its first call of that class
+_reserved_slot = contextvars.ContextVar('kapi_reserved_slot', default=None)
+
+
+def _with_reserved_slot(endpoint, fn, item):
+    _reserved_slot.set([endpoint])
+    return fn(item)
+
+
+# Order statuses that can still be cancelled
+OPEN_ORDER_STATUSES = {
+    "OPEN",
+    "TRIGGER PENDING",
+    "AMO REQ RECEIVED",
+    "OPEN PENDING",
+    "MODIFY PENDING",
+    "VALIDATION PENDING",
+    "PUT ORDER REQ RECEIVED",
+    "MODIFY VALIDATION PENDING",
+}
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def _matches(item, tag, tradingsymbol, product, exchange):
+    return ((tag is None or item.get("tag") == tag)
+            and (tradingsymbol is None or item.get("tradingsymbol") == tradingsymbol)
+            and (product is None or item.get("product") == product)
+            and (exchange is None or item.get("exchange") == exchange))
 
-import requests
-import dateutil.parser
+
+def validate_order(order):
+    """Problems with a place_order argument dict, empty when it can be sent."""
+    if not isinstance(order, dict):
+        return ["not an object"]
+    problems = [f"missing {field}" for field in ORDER_REQUIRED if order.get(field) in (None, "")]
+    problems += [f"unknown field {field}" for field in order if field not in ORDER_FIELDS]
+    quantity = order.get("quantity")
+    if quantity is not None and (not str(quantity).isdigit() or int(quantity) <= 0):
+        problems.append("quantity must be a positive integer")
+    order_type = order.get("order_type")
+    if order_type in (KiteApp.ORDER_TYPE_LIMIT, KiteApp.ORDER_TYPE_SL) and order.get("price") is None:
+        problems.append(f"price is required for {order_type} orders")
+    if order_type in (KiteApp.ORDER_TYPE_SL, KiteApp.ORDER_TYPE_SLM) and order.get("trigger_price") is None:
+        problems.append(f"trigger_price is required for {order_type} orders")
+    return problems
 
 
 def get_enctoken(userid, password, twofa):
+    # A session of its own, the login flow relies on cookies the shared transport drops
     session = requests.Session()
-    response = session.post('https://kite.zerodha.com/api/login', data={
-        "user_id": userid,
-        "password": password
-    })
-    response = session.post('https://kite.zerodha.com/api/twofa', data={
-        "request_id": response.json()['data']['request_id'],
-        "twofa_value": twofa,
-        "user_id": response.json()['data']['user_id']
-    })
+    try:
+        response = session.post(f'{KITE_URL}/api/login', data={
+            "user_id": userid,
+            "password": password
+        }, timeout=transport.timeout)
+        login = check_payload(response.status_code, response.json())
+        response = session.post(f'{KITE_URL}/api/twofa', data={
+            "request_id": login['request_id'],
+            "twofa_value": twofa,
+            "user_id": login['user_id']
+        }, timeout=transport.timeout)
+    except requests.RequestException as e:
+        raise network_error(e, "POST", sent=not connect_failed(e)) from e
+    except ValueError:
+        raise KiteError("Invalid response from Kite login", 502, "DataException")
+    finally:
+        session.close()
     enctoken = response.cookies.get('enctoken')
     if enctoken:
         return enctoken
@@ -30,7 +168,8 @@ def get_enctoken(userid, password, twofa):
         raise Exception("Enter valid details !!!!")
 
 
-class KiteApp:
+class KiteConstants:
+    """Order parameter values shared by KiteApp and async_kite.AsyncKiteApp."""
     # Products
     PRODUCT_MIS = "MIS"
     PRODUCT_CNC = "CNC"
@@ -64,6 +203,9 @@ class KiteApp:
     EXCHANGE_BFO = "BFO"
     EXCHANGE_MCX = "MCX"
 
+
+class KiteApp(KiteConstants):
+
     def __init__(self, enctoken):
         # self.headers = {"Authorization": f"enctoken {enctoken}"}
         # self.session = requests.session()
@@ -76,63 +218,185 @@ class KiteApp:
             "x-kite-version": "3",
             'Authorization': 'enctoken {}'.format(self.enctoken)
         }
-        self.session = requests.session()
+        self.transport = transport
+        self.invalidated = False
+        # Buckets are shared by all workers and keyed by a digest rather than the token itself
+        user = hashlib.sha256(enctoken.encode()).hexdigest()[:16]
+        self.limiters = {name: RateLimiter(f"{user}:{name}", rate) for name, rate in RATE_LIMITS.items()}
         self.api_key = "kite"
         self.user_id = "KK7143"
-        self.root2 = "https://kite.zerodha.com/oms"
-        self.root_url_new = "https://api.kite.trade"
-        self.root_url = "https://kite.zerodha.com/oms"
+        self.root2 = f"{KITE_URL}/oms"
+        self.root_url_new = KITE_API_URL
+        self.root_url = f"{KITE_URL}/oms"
+        # KiteConnect.__init__(self, api_key="kite")
 
+    def close(self):
+        # Connections belong to the process wide transport and outlive this session
+        pass
 
-        self.session.get(self.root_url, headers=self.headers)
-        # KiteConnect.__init__(self, api_key="kite")
+    def _request(self, method, url, endpoint="other", acquire=True, **kwargs):
+        """
+        Send a request through the rate limiter of its endpoint class, retrying
+        upstream 429s with jittered backoff. A 429 also drains the shared bucket so
+        other workers back off too.
+        Args:
+            endpoint: Rate limit class, one of RATE_LIMITS
+            acquire: False when the caller already reserved the slot
+        """
+        limiter = self.limiters[endpoint]
+        reserved = _reserved_slot.get()
+        for attempt in range(RETRIES_429 + 1):
+            if acquire and not attempt and reserved == [endpoint]:
+                # Taken by the thread that submitted this task, see _paced
+                reserved.pop()
+            elif acquire or attempt:
+                limiter.acquire()
+            response = self.transport.request(method, url, headers=self.headers, **kwargs)
+            if response.status_code == 403:
+                # Kite answers 403 once an enctoken has expired or been logged out
+                self.invalidated = True
+            if response.status_code != 429 or attempt == RETRIES_429:
+                return response
+            delay = _retry_after(response) or BACKOFF * 2 ** attempt
+            limiter.penalize(delay + random.uniform(0, BACKOFF))
+        return response
+
+    def _call(self, method, url, endpoint="other", raw=False, **kwargs):
+        """
+        `data` of a Kite API call; transport.KiteError if it failed in any way.
+        Args:
+            raw: Return the undecoded success body, `{"status": "success", "data": ...}` bytes
+        """
+        response = self._request(method, url, endpoint, **kwargs)
+        if raw and response.status_code < 400 and response.content.startswith(SUCCESS_PREFIX):
+            return response.content
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        data = check_payload(response.status_code, body)
+        if raw:
+            return json.dumps({"status": "success", "data": data}, separators=(',', ':')).encode()
+        return data
+
+    def rate_limits(self):
+        """Available slots, queue depth and upstream 429 penalty of this user's rate limit buckets."""
+        return {name: {"rate": RATE_LIMITS[name],
+                       "available": round(limiter.tokens(), 2),
+                       "queue_depth": limiter.queue_depth(),
+                       "penalty": round(limiter.penalty(), 2)}
+                for name, limiter in self.limiters.items()}
 
-    def instruments(self, exchange=None):
-        response = self.session.get(f"{self.root_url_new}/instruments", headers=self.headers)
-        print("Raw response text:", response.text[:500])  # Print first 500 chars for inspection
-        data = response.text.split("\n")
-        print("Instrument CSV lines:", len(data))
-        Exchange = []
-        for i in data[1:-1]:
-            row = i.split(",")
-            if exchange is None or exchange == row[11]:
-                Exchange.append({
-                    'instrument_token': int(row[0]),
-                    'exchange_token': row[1],
-                    'tradingsymbol': row[2],
-                    'name': row[3][1:-1],
-                    'last_price': float(row[4]),
-                    'expiry': dateutil.parser.parse(row[5]).date() if row[5] != "" else None,
-                    'strike': float(row[6]),
-                    'tick_size': float(row[7]),
-                    'lot_size': int(row[8]),
-                    'instrument_type': row[9],
-                    'segment': row[10],
-                    'exchange': row[11]
-                })
-        print("Parsed instruments:", len(Exchange))
-        return Exchange
+    # Instrument table shared by every KiteApp in the process, keyed by cache version
+    _instruments = (None, InstrumentTable())
+    # Epoch seconds until which _instruments is served without looking at the disk cache
+    _instruments_checked = 0.0
+
+    def instrument_table(self, refresh=False):
+        now = time.time()
+        if not refresh and now < KiteApp._instruments_checked:
+            return KiteApp._instruments[1]
+        path = instrument_cache.load(self, force=refresh)
+        version = instrument_cache.version()
+        if KiteApp._instruments[0] != version:
+            KiteApp._instruments = (version, parse_instruments(path))
+        # Recheck after the interval, or as soon as the trading day rolls over
+        KiteApp._instruments_checked = min(now + INSTRUMENT_RECHECK, next_refresh())
+        return KiteApp._instruments[1]
+
+    @staticmethod
+    def prewarm():
+        """
+        Load the instrument table from the on-disk cache when it is current, so
+        workers forked afterwards share it rather than each parsing the file.
+        Returns the number of instruments loaded, 0 when there is no current cache.
+        """
+        if not instrument_cache.is_fresh():
+            return 0
+        KiteApp._instruments = (instrument_cache.version(), parse_instruments(instrument_cache.path))
+        KiteApp._instruments_checked = min(time.time() + INSTRUMENT_RECHECK, next_refresh())
+        return len(KiteApp._instruments[1])
+
+    def instruments(self, exchange=None, refresh=False):
+        return [row.to_dict() for row in self.instrument_table(refresh).select(exchange=exchange)]
+
+    def get_instrument(self, instrument_token):
+        return self.instrument_table().get(instrument_token)
+
+    def lookup(self, exchange, tradingsymbol):
+        return self.instrument_table().lookup(exchange, tradingsymbol)
+
+    def search_instruments(self, **filters):
+        """
+        Range query over the instrument master, e.g.
+        search_instruments(name="NIFTY", expiry=date(2024, 10, 31), segment="NFO-OPT")
+        """
+        return self.instrument_table().select(**filters)
 
     def quote(self, instruments):
-        data = self.session.get(f"{self.root_url}/quote", params={"i": instruments}, headers=self.headers).json()["data"]
+        instruments = [instruments] if isinstance(instruments, (str, int)) else list(instruments)
+        data = live_quotes(instruments, "quote", self.lookup)
+        missing = [i for i in instruments if str(i) not in data]
+        if missing:
+            data.update(self._call("GET", f"{self.root_url}/quote", "quote", params={"i": missing}))
         return data
 
     def ltp(self, instruments):
-        data = self.session.get(f"{self.root_url}/quote/ltp", params={"i": instruments}, headers=self.headers).json()
+        instruments = [instruments] if isinstance(instruments, (str, int)) else list(instruments)
+        local = live_quotes(instruments, "ltp", self.lookup)
+        missing = [i for i in instruments if str(i) not in local]
+        if not missing:
+            return {"status": "success", "data": local}
+        data = self._request("GET", f"{self.root_url}/quote/ltp", "quote", params={"i": missing}).json()
+        if isinstance(data.get("data"), dict):
+            data["data"].update(local)
+        return data
+
+    def market_data(self, instruments, mode="quote"):
+        """
+        Quotes for any number of instruments ("EXCHANGE:TRADINGSYMBOL" or tokens).
+        Instruments streamed live by a ticker are answered from the latest-tick
+        table. The rest are split into upstream sized batches fetched in parallel,
+        and overlapping concurrent requests share upstream calls through quote_cache.
+        Args:
+            instruments: Iterable of instrument keys
+            mode: quote, ohlc or ltp
+        """
+        if mode not in QUOTE_BATCH_SIZE:
+            raise ValueError(f"Unsupported quote mode {mode}")
+        instruments = list(instruments)
+        data = live_quotes(instruments, mode, self.lookup)
+        missing = [i for i in instruments if str(i) not in data]
+        if missing:
+            data.update(quote_cache.get(mode, missing, lambda missing: self._quote_batches(mode, missing)))
+        return data
+
+    def _quote_batches(self, mode, instruments):
+        size = QUOTE_BATCH_SIZE[mode]
+        batches = [instruments[i:i + size] for i in range(0, len(instruments), size)]
+        if len(batches) == 1:
+            return self._quote_batch(mode, batches[0])
+        data = {}
+        for result in executor("quote", 4).map(lambda batch: self._quote_batch(mode, batch), batches):
+            data.update(result)
         return data
 
+    def _quote_batch(self, mode, instruments):
+        path = "/quote" if mode == "quote" else f"/quote/{mode}"
+        return self._call("GET", f"{self.root_url}{path}", "quote", params={"i": instruments})
+
     def historical_data(self, instrument_token, from_date, to_date, interval, continuous=False, oi=False):
         params = {"from": from_date,
                   "to": to_date,
                   "interval": interval,
                   "continuous": 1 if continuous else 0,
                   "oi": 1 if oi else 0}
-        lst = self.session.get(
-            f"{self.root_url}/instruments/historical/{instrument_token}/{interval}", params=params,
-            headers=self.headers).json()["data"]["candles"]
+        lst = self._call(
+            "GET", f"{self.root_url}/instruments/historical/{instrument_token}/{interval}", "historical",
+            params=params)["candles"]
         records = []
         for i in lst:
-            record = {"date": dateutil.parser.parse(i[0]), "open": i[1], "high": i[2], "low": i[3],
+            record = {"date": candle_datetime(i[0]), "open": i[1], "high": i[2], "low": i[3],
                       "close": i[4], "volume": i[5],}
             if len(i) == 7:
                 record["oi"] = i[6]
@@ -149,24 +413,14 @@ class KiteApp:
             interval: Data interval (default: minute)
             oi: Include OI data (default: False)
         """
-        params = {
-            "user_id": self.user_id,
-            "from": from_date,
-            "to": to_date,
-            "oi": 1 if oi else 0
-        }
-        
-        response = self.session.get(
-            f"{self.root2}/instruments/historical/{instrument_token}/{interval}",
-            params=params,
-            headers=self.headers
-        ).json()
-        # print("response",response)
-        if "data" in response and "candles" in response["data"]:
+        candles = self._historical_candles(instrument_token, from_date, to_date, interval, oi)
+        if candles is None:
+            return []
+        with span('parse'):
             records = []
-            for candle in response["data"]["candles"]:
+            for candle in candles:
                 record = {
-                    "date": dateutil.parser.parse(candle[0]),
+                    "date": candle_datetime(candle[0]),
                     "open": candle[1],
                     "high": candle[2],
                     "low": candle[3],
@@ -176,28 +430,129 @@ class KiteApp:
                 if len(candle) == 7:
                     record["oi"] = candle[6]
                 records.append(record)
-            return records
-        return []
+        return records
+
+    def _historical_candles(self, instrument_token, from_date, to_date, interval, oi):
+        """
+        Raw upstream candles for the range, or None if upstream returned no data.
+        Ranges longer than one upstream request allows are split into chunks fetched
+        concurrently, then stitched in order without duplicate boundary candles.
+        """
+        try:
+            chunks = split_range(*request_bounds(from_date, to_date), interval)
+        except ValueError:
+            # Leave formats we do not understand for upstream to interpret
+            chunks = []
+        if len(chunks) <= 1:
+            return self._historical_request(instrument_token, from_date, to_date, interval, oi)
+        futures = self._paced("historical", HISTORICAL_RATE, executor("historical", HISTORICAL_THREADS),
+                              lambda chunk: self._historical_request(
+                                  instrument_token, format_bound(chunk[0]), format_bound(chunk[1] - 1), interval, oi),
+                              chunks)
+        candles = []
+        last = None
+        for result in (future.result() for future in futures):
+            if result is None:
+                return None
+            for candle in result:
+                ts = candle_epoch(candle[0])
+                if last is None or ts > last:
+                    candles.append(candle)
+                    last = ts
+        return candles
+
+    def _paced(self, endpoint, limit, pool, fn, items):
+        """
+        Futures of fn(item) for every item, run on a pool shared by all users. The
+        calling thread waits for each item's rate slot of `endpoint` and for one of
+        the user's `limit` places in the pool before submitting it, so pool threads
+        only ever wait on Kite and one user's backlog never holds up another's.
+        A future fails with RateLimitExceeded when its slot could not be reserved.
+        """
+        limiter = self.limiters[endpoint]
+        slots = limiter_semaphore(limiter, limit)
+        futures = []
+        for item in items:
+            slots.acquire()
+            try:
+                limiter.acquire()
+            except Exception as e:
+                slots.release()
+                future = Future()
+                future.set_exception(e)
+                futures.append(future)
+                continue
+            future = pool.submit(_with_reserved_slot, endpoint, fn, item)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        return futures
+
+    def _historical_request(self, instrument_token, from_date, to_date, interval, oi):
+        params = {
+            "user_id": self.user_id,
+            "from": from_date,
+            "to": to_date,
+            "oi": 1 if oi else 0
+        }
+        
+        data = self._call(
+            "GET",
+            f"{self.root2}/instruments/historical/{instrument_token}/{interval}",
+            "historical",
+            params=params
+        )
+        return data.get("candles")
 
-    def margins(self):
-        margins = self.session.get(f"{self.root_url}/user/margins", headers=self.headers).json()["data"]
+    def historical_data_cached(self, instrument_token, from_date, to_date, interval="minute", oi=False):
+        """Same records as historical_data_v2, served from the local candle store."""
+        return self.historical_columns(instrument_token, from_date, to_date, interval, oi).to_records(IST)
+
+    def historical_columns(self, instrument_token, from_date, to_date, interval="minute", oi=False,
+                           resample=None, session="NSE", aggregation=None):
+        """
+        Column oriented historical data (see candles.Candles) served from the local
+        candle store, fetching only the sub-ranges it does not hold yet.
+        Args:
+            resample: Optional target bar width (e.g. 75 or "15minute"), a multiple of `interval`
+            session: Exchange session the resampled bars are aligned to (default: NSE)
+            aggregation: Column -> first|last|max|min|sum overrides for resampling
+        """
+        if resample is not None:
+            minutes = interval_minutes(resample)
+            if minutes % interval_minutes(interval):
+                raise ValueError(f"Cannot resample {interval} candles to {resample}")
+        def fetch_upstream(start, end):
+            candles = self._historical_candles(instrument_token, start, end, interval, oi)
+            if candles is None:
+                raise Exception(f"Historical data unavailable for {instrument_token} {start} - {end}")
+            return candles
+
+        rows = candle_store.fetch(instrument_token, interval, oi, from_date, to_date, fetch_upstream)
+        with span('parse'):
+            candles = Candles.from_rows(rows, oi)
+            if resample is not None:
+                candles = candles.resample(minutes, session, aggregation)
+        return candles
+
+    def margins(self, raw=False):
+        margins = self._call("GET", f"{self.root_url}/user/margins", raw=raw)
         return margins
     def profile(self):
-        profile = self.session.get(f"{self.root_url}/user/profile/full", headers=self.headers).json()["data"]
+        profile = self._call("GET", f"{self.root_url}/user/profile/full")
         return profile
-    def orders(self):
-        orders = self.session.get(f"{self.root_url}/orders", headers=self.headers).json()["data"]
+    def orders(self, raw=False):
+        orders = self._call("GET", f"{self.root_url}/orders", raw=raw)
         return orders
 
-    def positions(self):
-        positions = self.session.get(f"{self.root_url}/portfolio/positions", headers=self.headers).json()["data"]
+    def positions(self, raw=False):
+        positions = self._call("GET", f"{self.root_url}/portfolio/positions", raw=raw)
         return positions
     def profile(self):
-        profile = self.session.get(f"{self.root_url}/user/profile/full", headers=self.headers).json()["data"]
+        profile = self._call("GET", f"{self.root_url}/user/profile/full")
         return profile
     
-    def holdings(self):
-        holdings = self.session.get(f"{self.root_url}/portfolio/holdings", headers=self.headers).json()["data"]
+    def holdings(self, raw=False):
+        holdings = self._call("GET", f"{self.root_url}/portfolio/holdings", raw=raw)
         return holdings
 
     def place_order(self, variety, exchange, tradingsymbol, transaction_type, quantity, product, order_type, price=None,
@@ -208,9 +563,50 @@ class KiteApp:
         for k in list(params.keys()):
             if params[k] is None:
                 del params[k]
-        order_id = self.session.post(f"{self.root_url}/orders/{variety}",
-                                     data=params, headers=self.headers).json()["data"]["order_id"]
-        return order_id
+        return self._place_order(params)
+
+    def _place_order(self, params, acquire=True):
+        return self._call("POST", f"{self.root_url}/orders/{params['variety']}", "order",
+                          acquire=acquire, data=params)["order_id"]
+
+    def place_orders(self, orders, simultaneous=False):
+        """
+        Place several orders (e.g. the legs of a basket or spread) concurrently.
+        Every order is validated before any is sent; a ValueError listing the
+        problems of each invalid leg is raised instead of placing a partial basket.
+        Args:
+            orders: List of dicts with place_order arguments
+            simultaneous: Release all legs at once instead of as rate slots free up,
+                at most ORDER_RATE legs
+        Returns one {"status": "success", "order_id": ...} or
+        {"status": "error", "message": ...} per order, in input order.
+        """
+        errors = {i: problems for i, problems in enumerate(map(validate_order, orders)) if problems}
+        if errors:
+            raise ValueError("; ".join(f"order {i}: {', '.join(problems)}" for i, problems in errors.items()))
+        legs = [{k: v for k, v in order.items() if v is not None} for order in orders]
+        if simultaneous and len(legs) > ORDER_RATE:
+            raise ValueError(f"At most {ORDER_RATE} orders can be placed simultaneously")
+
+        def submit(params, acquire=True):
+            try:
+                return {"status": "success", "order_id": self._place_order(params, acquire)}
+            except Exception as e:
+                return {"status": "error", "message": str(e)}
+
+        if not simultaneous:
+            results = []
+            for future in self._paced("order", ORDER_RATE, executor("orders", ORDER_THREADS), submit, legs):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append({"status": "error", "message": str(e)})
+            return results
+
+        # Reserve every rate slot up front so no leg waits on the limiter once the pool runs it.
+        # No barrier: on the shared pool it could wait forever for threads held by other requests.
+        self.limiters["order"].acquire(len(legs))
+        return list(executor("orders", ORDER_THREADS).map(lambda params: submit(params, acquire=False), legs))
 
     def modify_order(self, variety, order_id, parent_order_id=None, quantity=None, price=None, order_type=None,
                      trigger_price=None, validity=None, disclosed_quantity=None):
@@ -220,15 +616,14 @@ class KiteApp:
             if params[k] is None:
                 del params[k]
 
-        order_id = self.session.put(f"{self.root_url}/orders/{variety}/{order_id}",
-                                    data=params, headers=self.headers).json()["data"][
-            "order_id"]
+        order_id = self._call("PUT", f"{self.root_url}/orders/{variety}/{order_id}", "order",
+                              data=params)["order_id"]
         return order_id
 
     def cancel_order(self, variety, order_id, parent_order_id=None):
-        order_id = self.session.delete(f"{self.root_url}/orders/{variety}/{order_id}",
-                                       data={"parent_order_id": parent_order_id} if parent_order_id else {},
-                                       headers=self.headers).json()["data"]["order_id"]
+        order_id = self._call("DELETE", f"{self.root_url}/orders/{variety}/{order_id}", "order",
+                              data={"parent_order_id": parent_order_id} if parent_order_id else {}
+                              )["order_id"]
         return order_id
     
 
@@ -242,8 +637,7 @@ class KiteApp:
                      'order_type': 'MARKET', 
                      'tag': tag
                 }
-        reponse = self.session.post(f"{self.root_url}/orders/{variety}",
-                                     data=params, headers=self.headers).json()
+        reponse = self._request("POST", f"{self.root_url}/orders/{variety}", "order", data=params).json()
         return reponse
 
     def buy(self, tradingsymbol, quantity,transaction_type,tag=None):
@@ -256,8 +650,7 @@ class KiteApp:
                      'order_type': 'MARKET', 
                      'tag': tag
                 }
-        reponse = self.session.post(f"{self.root_url}/orders/{variety}",
-                                     data=params, headers=self.headers).json()
+        reponse = self._request("POST", f"{self.root_url}/orders/{variety}", "order", data=params).json()
         return reponse
     def buy_limit(self, tradingsymbol, quantity,price,transaction_type,tag=None):
         variety='regular'
@@ -270,8 +663,7 @@ class KiteApp:
                         'order_type': 'LIMIT', 
                         'tag': tag
                 }
-        reponse = self.session.post(f"{self.root_url}/orders/{variety}",
-                                        data=params, headers=self.headers).json()
+        reponse = self._request("POST", f"{self.root_url}/orders/{variety}", "order", data=params).json()
         return reponse
     
     def sell_target(self, tradingsymbol, quantity,price,tag=None):
@@ -285,7 +677,7 @@ class KiteApp:
                      'order_type': 'LIMIT', 
                      'tag': tag
                 }
-        reponse = self.session.post(f"{self.root_url}/orders/{variety}",data=params, headers=self.headers).json()
+        reponse = self._request("POST", f"{self.root_url}/orders/{variety}", "order", data=params).json()
         return reponse
     
     def sell_sl(self, tradingsymbol, quantity,price,trigger_price,tag=None):
@@ -300,7 +692,7 @@ class KiteApp:
                     'order_type': 'SL', 
                     'tag': tag
             }
-        reponse = self.session.post(f"{self.root_url}/orders/{variety}",data=params, headers=self.headers).json()
+        reponse = self._request("POST", f"{self.root_url}/orders/{variety}", "order", data=params).json()
         return reponse
     
     def modify_order_exit(self, order_id, quantity):
@@ -309,6 +701,83 @@ class KiteApp:
                 'quantity':quantity,
                 'order_type':'MARKET',
                 'validity':'DAY'}
-        response = self.session.put(f"{self.root_url}/orders/{variety}/{order_id}",
-                                    data=params, headers=self.headers).json()
-        return response
\ No newline at end of file
+        response = self._request("PUT", f"{self.root_url}/orders/{variety}/{order_id}", "order",
+                                 data=params).json()
+        return response
+
+    def cancel_all_orders(self, tag=None, tradingsymbol=None, product=None, exchange=None):
+        """Cancel every open order matching the filters, concurrently. Returns a bulk report."""
+        orders = [o for o in self.orders()
+                  if o.get("status") in OPEN_ORDER_STATUSES and _matches(o, tag, tradingsymbol, product, exchange)]
+        return self._bulk(orders, lambda o: self.cancel_order(o["variety"], o["order_id"], o.get("parent_order_id")))
+
+    def exit_sl_orders(self, tag=None, tradingsymbol=None, product=None, exchange=None):
+        """Convert every trigger pending SL / SL-M order matching the filters to a market order."""
+        orders = [o for o in self.orders()
+                  if o.get("status") == "TRIGGER PENDING"
+                  and o.get("order_type") in (self.ORDER_TYPE_SL, self.ORDER_TYPE_SLM)
+                  and _matches(o, tag, tradingsymbol, product, exchange)]
+
+        def exit_order(o):
+            response = self.modify_order_exit(o["order_id"], o.get("pending_quantity") or o["quantity"])
+            if "data" not in response:
+                raise Exception(response.get("message", "Order modification failed"))
+            return response["data"]["order_id"]
+
+        return self._bulk(orders, exit_order)
+
+    def square_off_positions(self, product=KiteConstants.PRODUCT_MIS, tradingsymbol=None, exchange=None, tag=None):
+        """Close every open net position of `product` with market orders, concurrently."""
+        positions = [p for p in self.positions()["net"]
+                     if p.get("quantity") and _matches(p, None, tradingsymbol, product, exchange)]
+
+        def close(p):
+            return self.place_order(
+                variety=self.VARIETY_REGULAR,
+                exchange=p["exchange"],
+                tradingsymbol=p["tradingsymbol"],
+                transaction_type=self.TRANSACTION_TYPE_SELL if p["quantity"] > 0 else self.TRANSACTION_TYPE_BUY,
+                quantity=abs(p["quantity"]),
+                product=p["product"],
+                order_type=self.ORDER_TYPE_MARKET,
+                tag=tag)
+
+        return self._bulk(positions, close)
+
+    def _bulk(self, items, action):
+        # Each action is one order call, paced per user by _paced
+        def report(item):
+            result = {"tradingsymbol": item.get("tradingsymbol"), "exchange": item.get("exchange")}
+            if item.get("order_id"):
+                result["order_id"] = item["order_id"]
+            return result
+
+        def run(item):
+            result = report(item)
+            try:
+                result["order_id"] = action(item)
+                result["status"] = "success"
+            except Exception as e:
+                result["status"] = "error"
+                result["message"] = str(e)
+            return result
+
+        futures = self._paced("order", ORDER_RATE, executor("orders", ORDER_THREADS), run, items)
+        results = []
+        for item, future in zip(items, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(dict(report(item), status="error", message=str(e)))
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        return {
+            "requested": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results
+        }
+
+
+ORDER_FIELDS = [name for name in inspect.signature(KiteApp.place_order).parameters if name != "self"]
+ORDER_REQUIRED = [name for name, p in inspect.signature(KiteApp.place_order).parameters.items()
+                  if name != "self" and p.default is inspect.Parameter.empty]
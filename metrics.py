@@ -0,0 +1,95 @@
+"""
+Prometheus metrics. Under gunicorn every worker writes its samples to files in
+PROMETHEUS_MULTIPROC_DIR (set up by gunicorn.conf.py) and /metrics sums them
+across workers; without it, the metrics of the single process are served.
+"""
+import os
+import re
+from urllib.parse import urlsplit
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+from tracing import record
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    'kapi_request_duration_seconds', 'Time to answer a request, by route and status',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge(
+    'kapi_requests_in_flight', 'Requests being answered', ['route'], multiprocess_mode='livesum')
+UPSTREAM_LATENCY = Histogram(
+    'kapi_upstream_duration_seconds', 'Time until Kite answered, by KiteApp call and status',
+    ['call', 'status'], buckets=LATENCY_BUCKETS)
+UPSTREAM_ERRORS = Counter(
+    'kapi_upstream_errors_total', 'Kite calls that failed, by KiteApp call and HTTP status or NetworkException',
+    ['call', 'error'])
+UPSTREAM_IN_FLIGHT = Gauge(
+    'kapi_upstream_in_flight', 'Kite calls waiting for an answer, each holding a pooled connection',
+    ['client'], multiprocess_mode='livesum')
+UPSTREAM_POOL_SIZE = Gauge(
+    'kapi_upstream_pool_size', 'Most connections kept per Kite host (sync) or per user session (async)',
+    ['client'], multiprocess_mode='max')
+SESSIONS = Gauge(
+    'kapi_sessions', 'Kite sessions cached by the workers', ['client'], multiprocess_mode='livesum')
+CACHE_REQUESTS = Counter(
+    'kapi_cache_requests_total', 'Cache lookups by cache and result (hit, miss, or shared with a call in flight)',
+    ['cache', 'result'])
+
+# Upstream paths -> the KiteApp method making the call, so latency reads per method
+# whichever code path (sync, async, bulk) issued it
+UPSTREAM_CALLS = [
+    ('GET', re.compile(r'/quote/ltp$'), 'ltp'),
+    ('GET', re.compile(r'/quote/ohlc$'), 'ohlc'),
+    ('GET', re.compile(r'/quote$'), 'quote'),
+    ('GET', re.compile(r'/instruments/historical/'), 'historical_data'),
+    ('GET', re.compile(r'/instruments$'), 'instruments'),
+    ('GET', re.compile(r'/orders$'), 'orders'),
+    ('POST', re.compile(r'/orders/[^/]+$'), 'place_order'),
+    ('PUT', re.compile(r'/orders/[^/]+/[^/]+$'), 'modify_order'),
+    ('DELETE', re.compile(r'/orders/[^/]+/[^/]+$'), 'cancel_order'),
+    ('GET', re.compile(r'/portfolio/positions$'), 'positions'),
+    ('GET', re.compile(r'/portfolio/holdings$'), 'holdings'),
+    ('GET', re.compile(r'/user/margins'), 'margins'),
+    ('GET', re.compile(r'/user/profile'), 'profile'),
+]
+
+
+def upstream_call(method, url):
+    path = urlsplit(url).path
+    for call_method, pattern, name in UPSTREAM_CALLS:
+        if method == call_method and pattern.search(path):
+            return name
+    return 'other'
+
+
+def observe_upstream(method, url, elapsed, status=None, error=None):
+    """
+    Record one Kite call.
+    Args:
+        status: HTTP status Kite answered with, None when no answer came
+        error: error_type of the KiteError raised when no answer came
+    """
+    record('upstream', elapsed)
+    call = upstream_call(method, url)
+    UPSTREAM_LATENCY.labels(call, status or 'none').observe(elapsed)
+    if status is None or status >= 400:
+        UPSTREAM_ERRORS.labels(call, status or error or 'NetworkException').inc()
+
+
+def count_cache(cache, hits=0, misses=0, shared=0):
+    for result, count in (('hit', hits), ('miss', misses), ('shared', shared)):
+        if count:
+            CACHE_REQUESTS.labels(cache, result).inc(count)
+
+
+def render():
+    """Exposition text of every worker's metrics and its content type."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
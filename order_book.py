@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from instrument_cache import CACHE_DIR
+
+# Longest a client may block waiting for the next order change, kept under common proxy idle timeouts
+MAX_WAIT = 25.0
+# Seconds between upstream refreshes while a client waits
+POLL_INTERVAL = 1.0
+# Kite app secret that signs order postbacks, postbacks are refused while unset
+POSTBACK_SECRET = os.environ.get('KAPI_POSTBACK_SECRET')
+# Seconds an order change is kept after it was recorded, longer than an enctoken lives
+FORGET_AFTER = 86400.0
+PRUNE_INTERVAL = 3600.0
+
+ORDER_LOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    key TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    updated TEXT NOT NULL,
+    body TEXT NOT NULL,
+    recorded REAL NOT NULL,
+    PRIMARY KEY (key, order_id)
+);
+CREATE INDEX IF NOT EXISTS orders_seq ON orders (key, seq);
+CREATE TABLE IF NOT EXISTS cursors (
+    key TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS owners (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+"""
+
+
+def order_key(enctoken):
+    """Digest the order log stores an enctoken's orders under."""
+    return hashlib.sha256(enctoken.encode()).hexdigest()[:16]
+
+
+def postback_checksum(order, secret):
+    """SHA-256 of order_id + order_timestamp + api secret, as Kite signs postbacks."""
+    payload = f"{order.get('order_id', '')}{order.get('order_timestamp', '')}{secret}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def verify_postback(order, secret=POSTBACK_SECRET):
+    if not secret:
+        raise PermissionError("Order postbacks are not configured")
+    if not hmac.compare_digest(str(order.get('checksum', '')), postback_checksum(order, secret)):
+        raise PermissionError("Invalid postback checksum")
+
+
+class OrderLog:
+    """
+    Every session's latest version of each order in a SQLite file, numbered by a
+    per-session sequence, so the cursors handed out by one gunicorn worker mean
+    the same to all of them. A cursor is the sequence number of the last change
+    a client has seen; every change recorded with a higher number is sent next.
+    Args:
+        path: SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._next_prune = 0.0
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(ORDER_LOG_SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def record(self, key, orders):
+        """
+        Store the orders that are new or changed, each under the next sequence
+        number of `key`; an order older than the version stored is ignored.
+        Returns the sequence number of the last change of `key`.
+        """
+        now = time.time()
+        if now >= self._next_prune:
+            self._next_prune = now + PRUNE_INTERVAL
+            self.prune(now - FORGET_AFTER)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT seq FROM cursors WHERE key=?", (key,)).fetchone()
+            start = seq = row[0] if row else 0
+            for order in orders:
+                body = json.dumps(order, sort_keys=True, separators=(',', ':'), default=str)
+                updated = str(order.get('exchange_update_timestamp') or '')
+                held = db.execute("SELECT updated, body FROM orders WHERE key=? AND order_id=?",
+                                  (key, str(order['order_id']))).fetchone()
+                if held is not None and (held[1] == body or updated < held[0]):
+                    continue
+                seq += 1
+                db.execute("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, str(order['order_id']), seq, updated, body, now))
+                if order.get('placed_by'):
+                    db.execute("INSERT OR REPLACE INTO owners VALUES (?, ?, ?)", (order['placed_by'], key, now))
+            if seq != start:
+                db.execute("INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)", (key, seq, now))
+            db.execute("COMMIT")
+            return seq
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def changes(self, key, since):
+        """Orders of `key` changed after cursor `since`, oldest change first, and the cursor to ask from next."""
+        db = self._db()
+        # One read transaction, so the cursor covers exactly the changes returned
+        db.execute("BEGIN")
+        try:
+            row = db.execute("SELECT seq FROM cursors WHERE key=?", (key,)).fetchone()
+            rows = db.execute("SELECT body FROM orders WHERE key=? AND seq>? ORDER BY seq", (key, since)).fetchall()
+        finally:
+            db.execute("COMMIT")
+        return [json.loads(body) for body, in rows], row[0] if row else 0
+
+    def keys_for(self, user_id):
+        """Keys of the sessions holding orders placed by Kite user `user_id`."""
+        return [key for key, in self._db().execute("SELECT key FROM owners WHERE user_id=?", (user_id,))]
+
+    def prune(self, before):
+        db = self._db()
+        for table, column in (("orders", "recorded"), ("cursors", "updated"), ("owners", "updated")):
+            db.execute(f"DELETE FROM {table} WHERE {column}<?", (before,))
+
+
+class OrderBook:
+    """
+    One session's orders of the day, so clients can ask for what changed instead
+    of the whole list. Changes are recorded in the OrderLog shared by the workers
+    and read back from it, so a cursor is valid against any worker and no change
+    is skipped whichever worker a client asks. The whole list is kept in memory,
+    as of the last change read back. Updates arrive from full upstream snapshots,
+    postbacks and ticker order messages; an update older than the order held is
+    ignored.
+    Args:
+        key: order_key of the session
+        log: OrderLog shared by the workers
+    """
+
+    def __init__(self, key, log):
+        self.key = key
+        self.log = log
+        self.cursor = 0
+        self.etag = None
+        self._orders = {}
+        self._ids = []
+        self._snapshot = None
+        self._encoded = None
+        self._condition = threading.Condition()
+        self._waiters = []
+
+    def refresh(self, orders):
+        """Record a full upstream order list and read back every change, returning whether anything changed."""
+        with self._condition:
+            if orders is not self._snapshot:
+                self._snapshot = orders
+                ids = [order['order_id'] for order in orders]
+                # Orders known only from postbacks stay until upstream lists them
+                listed = set(ids)
+                ids += [order_id for order_id in self._ids if order_id not in listed]
+                reordered = ids != self._ids
+                self._ids = ids
+                self.log.record(self.key, [order for order in orders if self._orders.get(order['order_id']) != order])
+                return self._sync(reordered)
+            return self._sync()
+
+    def update(self, order):
+        """Record one order from a postback or a ticker order message."""
+        with self._condition:
+            self.log.record(self.key, [order])
+            return self._sync()
+
+    def sync(self):
+        """Read back the changes other workers recorded."""
+        with self._condition:
+            return self._sync()
+
+    def handle_message(self, message):
+        """Ticker message handler, applying `order` messages."""
+        data = message.get('data')
+        if message.get('type') == 'order' and isinstance(data, dict) and data.get('order_id'):
+            self.update(data)
+
+    def _sync(self, reordered=False):
+        changed, self.cursor = self.log.changes(self.key, self.cursor)
+        for order in changed:
+            if order['order_id'] not in self._orders and order['order_id'] not in self._ids:
+                self._ids.append(order['order_id'])
+            self._orders[order['order_id']] = order
+        if changed or reordered or self.etag is None:
+            # The cursor pins every order's content and the ids their order, no need to hash the orders
+            self.etag = hashlib.sha1(f"{self.cursor}:{','.join(map(str, self._ids))}".encode()).hexdigest()
+        if changed:
+            self._condition.notify_all()
+            for loop, future in self._waiters:
+                loop.call_soon_threadsafe(_wake, future)
+            self._waiters.clear()
+        return bool(changed)
+
+    def orders(self):
+        """Every order, in upstream order followed by orders only postbacks told of."""
+        return [self._orders[order_id] for order_id in self._ids if order_id in self._orders]
+
+    def changes(self, since):
+        """Orders changed after cursor `since`, oldest change first, and the cursor to ask from next."""
+        return self.log.changes(self.key, since)
+
+    def encoded(self, dumps):
+        """Every order encoded by `dumps` with the book's ETag and cursor, encoding again only after changes."""
+        with self._condition:
+            if self._encoded is None or self._encoded[0] != self.etag:
+                self._encoded = (self.etag, dumps(self.orders()))
+            return self._encoded[1], self.etag, self.cursor
+
+    def wait(self, since, timeout):
+        """Block until an order changes after cursor `since` or `timeout` seconds pass."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.cursor > since, timeout)
+
+    async def await_change(self, since, timeout):
+        """wait() for coroutines, suspending only the caller."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._condition:
+            if self.cursor > since:
+                return True
+            self._waiters.append((loop, future))
+        try:
+            await asyncio.wait((future,), timeout=timeout)
+        finally:
+            with self._condition:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+        return self.cursor > since
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class OrderBooks:
+    """
+    Order books of the process keyed by enctoken, least recently used dropped first.
+    Args:
+        max_size: Maximum number of books kept
+        log: OrderLog the books record to
+    """
+
+    def __init__(self, max_size=256, log=None):
+        self.max_size = max_size
+        self.log = log
+        self._books = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, enctoken):
+        with self._lock:
+            book = self._books.get(enctoken)
+            if book is None:
+                book = self._books[enctoken] = OrderBook(order_key(enctoken), self.log)
+                while len(self._books) > self.max_size:
+                    self._books.popitem(last=False)
+            else:
+                self._books.move_to_end(enctoken)
+            return book
+
+    def postback(self, order):
+        """Record a postback for every session of its user, whichever worker holds their books."""
+        keys = set(self.log.keys_for(order.get('user_id')))
+        for key in keys:
+            self.log.record(key, [order])
+        with self._lock:
+            books = [book for book in self._books.values() if book.key in keys]
+        for book in books:
+            book.sync()
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._books.clear()
+
+
+order_books = OrderBooks(int(os.environ.get('KAPI_POOL_SIZE', 256)),
+                         OrderLog(os.path.join(CACHE_DIR, 'order_log.sqlite')))
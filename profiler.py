@@ -0,0 +1,95 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from instrument_cache import CACHE_DIR
+
+# Profiles are written where every worker can read them, as the download may land on another worker
+PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
+MAX_SECONDS = 60
+DEFAULT_INTERVAL = 0.01
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Wall clock sampling profiler for the threads of this worker. A background
+    thread snapshots every thread's stack each `interval` seconds; the result is
+    written in the folded stack format read by flamegraph.pl and speedscope, one
+    `thread;outer;...;inner count` line per distinct stack.
+    Args:
+        seconds: How long to sample
+        interval: Seconds between samples
+    """
+
+    def __init__(self, seconds, interval=DEFAULT_INTERVAL):
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {MAX_SECONDS}")
+        if interval < 0.001:
+            raise ValueError("interval must be at least 0.001 seconds")
+        self.seconds = seconds
+        self.interval = interval
+        self.id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(PROFILE_DIR, f"{self.id}.folded")
+        self.samples = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        stacks = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        self._write(stacks)
+
+    def _write(self, stacks):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp, self.path)
+
+
+_running = None
+_running_lock = threading.Lock()
+
+
+def start_profile(seconds, interval=DEFAULT_INTERVAL):
+    """Start sampling this worker unless a profile is already running in it."""
+    global _running
+    with _running_lock:
+        if _running is not None and _running._thread.is_alive():
+            raise RuntimeError(f"Profile {_running.id} is still running in this worker")
+        _running = SamplingProfiler(seconds, interval).start()
+        return _running
+
+
+def profile_path(profile_id):
+    """Path of a finished profile, None while it runs or if there is none by that id."""
+    if not all(c.isalnum() or c == '-' for c in profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    return path if os.path.exists(path) else None
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import count_cache
+
+# How long to wait on another request's in-flight upstream call before giving up
+INFLIGHT_TIMEOUT = 10
+# Least seconds between sweeps of expired quotes; until swept they are only skipped
+SWEEP_INTERVAL = 1.0
+# Resolves the futures of other requests waiting on a fetch that failed, so they fetch with
+# their own session instead of seeing another user's error
+_RETRY = object()
+
+
+class QuoteCache:
+    """
+    Short lived per-instrument quote cache shared by every user of the process.
+    Instruments already being fetched by a concurrent request are awaited instead
+    of fetched again, so overlapping watchlists polled together cost one upstream
+    call per instrument per `ttl`.
+    Args:
+        ttl: Seconds a quote is served from memory
+    """
+
+    def __init__(self, ttl=0.25):
+        self.ttl = ttl
+        self._entries = {}
+        self._inflight = {}
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, mode, instruments, fetch):
+        """
+        Quotes keyed by instrument for `mode`. `fetch(missing)` is called with the
+        list of instruments neither cached nor in flight and returns upstream data
+        keyed the same way; instruments upstream does not know are left out.
+        """
+        result, owned, waiting = self._claim(mode, instruments)
+        if owned:
+            try:
+                data = fetch(list(owned))
+            except BaseException:
+                self._fail(mode, owned)
+                raise
+            self._settle(mode, owned, data)
+        retry = []
+        for instrument, future in list(owned.items()) + list(waiting.items()):
+            value = future.result(timeout=INFLIGHT_TIMEOUT)
+            if value is _RETRY:
+                retry.append(instrument)
+            elif value is not None:
+                result[instrument] = value
+        if retry:
+            result.update(self.get(mode, retry, fetch))
+        return result
+
+    async def aget(self, mode, instruments, fetch):
+        """get() for event loops, `fetch(missing)` being a coroutine function."""
+        result, owned, waiting = self._claim(mode, instruments)
+        if owned:
+            try:
+                data = await fetch(list(owned))
+            except BaseException:
+                self._fail(mode, owned)
+                raise
+            self._settle(mode, owned, data)
+        retry = []
+        for instrument, future in list(owned.items()) + list(waiting.items()):
+            value = await asyncio.wait_for(asyncio.wrap_future(future), INFLIGHT_TIMEOUT)
+            if value is _RETRY:
+                retry.append(instrument)
+            elif value is not None:
+                result[instrument] = value
+        if retry:
+            result.update(await self.aget(mode, retry, fetch))
+        return result
+
+    def _claim(self, mode, instruments):
+        # Split into cached values, instruments this caller fetches and ones already in flight
+        now = time.monotonic()
+        result = {}
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for instrument in dict.fromkeys(str(i) for i in instruments):
+                key = (mode, instrument)
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    if entry[1] is not None:
+                        result[instrument] = entry[1]
+                elif key in self._inflight:
+                    waiting[instrument] = self._inflight[key]
+                else:
+                    owned[instrument] = self._inflight[key] = Future()
+        count_cache('quote', hits=len(result), misses=len(owned), shared=len(waiting))
+        return result, owned, waiting
+
+    def _fail(self, mode, owned):
+        # The error is the owner's alone (its enctoken may have expired), waiters claim again
+        with self._lock:
+            for instrument, future in owned.items():
+                self._inflight.pop((mode, instrument), None)
+                future.set_result(_RETRY)
+
+    def _settle(self, mode, owned, data):
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            for instrument, future in owned.items():
+                value = data.get(instrument)
+                self._entries[(mode, instrument)] = (expires, value)
+                self._inflight.pop((mode, instrument), None)
+                future.set_result(value)
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self._evict(now)
+                self._next_sweep = now + max(self.ttl, SWEEP_INTERVAL)
+
+    def _evict(self, now):
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+
+
+quote_cache = QuoteCache(float(os.environ.get('KAPI_QUOTE_TTL', 0.25)))
@@ -0,0 +1,160 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from instrument_cache import CACHE_DIR
+from transport import KiteError
+
+# Longest a request queues for a slot before failing with RateLimitExceeded
+MAX_WAIT = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+# When the last upstream 429 penalty of a bucket ends, to tell it apart from queued requests
+PENALTIES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS penalties (
+    key TEXT PRIMARY KEY,
+    until REAL NOT NULL
+)
+"""
+
+
+class RateLimitExceeded(KiteError):
+    """
+    The rate limit queue is too deep to wait in, answered as 429.
+    Args:
+        message: Description of the queue
+        retry_after: Seconds until the queue is short enough again
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, 429, "NetworkException")
+        self.retry_after = retry_after
+
+
+class BucketStore:
+    """
+    Token bucket state in a SQLite file, so every gunicorn worker draws from the
+    same buckets. Each reservation is one short IMMEDIATE transaction.
+    Args:
+        path: SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Bucket state is disposable, losing the last writes on a crash is harmless
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute(SCHEMA)
+            db.execute(PENALTIES_SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _update(self, key, rate, capacity, change, penalty=None):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT tokens, updated FROM buckets WHERE key=?", (key,)).fetchone()
+            now = time.time()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            tokens = change(tokens)
+            if tokens is None:
+                db.execute("ROLLBACK")
+                return None
+            db.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (key, tokens, now))
+            if penalty is not None:
+                db.execute("INSERT OR REPLACE INTO penalties VALUES (?, ?)", (key, now + penalty))
+            db.execute("COMMIT")
+            return tokens
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def reserve(self, key, rate, capacity, tokens, max_wait):
+        """Take `tokens` from the bucket, returning the seconds to wait before using them."""
+        waits = []
+
+        def take(available):
+            remaining = available - tokens
+            wait = -remaining / rate if remaining < 0 else 0.0
+            waits.append(wait)
+            return remaining if wait <= max_wait else None
+
+        if self._update(key, rate, capacity, take) is None:
+            raise RateLimitExceeded(f"Rate limit queue for {key} is {waits[-1]:.1f}s deep",
+                                    max(1, math.ceil(waits[-1] - max_wait)))
+        return waits[-1]
+
+    def penalize(self, key, rate, capacity, seconds):
+        """Empty the bucket so nobody gets a slot for `seconds`, e.g. after an upstream 429."""
+        self._update(key, rate, capacity, lambda available: min(available, -seconds * rate),
+                     penalty=seconds)
+
+    def state(self, key, rate, capacity):
+        """Tokens in the bucket, negative while requests queue, and seconds left of its last penalty."""
+        row = self._db().execute(
+            "SELECT tokens, updated, until FROM buckets LEFT JOIN penalties USING (key) WHERE key=?",
+            (key,)).fetchone()
+        if row is None:
+            return capacity, 0.0
+        now = time.time()
+        return min(capacity, row[0] + (now - row[1]) * rate), max(0.0, (row[2] or 0.0) - now)
+
+
+class RateLimiter:
+    """
+    Token bucket allowing `rate` calls per `per` seconds with bursts of up to
+    `burst`, shared across processes through `store` under `key`. acquire()
+    reserves a slot and sleeps until it is due, so callers queue instead of
+    failing, unless the queue is longer than `max_wait` seconds.
+    """
+
+    def __init__(self, key, rate, per=1.0, burst=None, store=None, max_wait=MAX_WAIT):
+        self.key = key
+        self.rate = rate / per
+        self.capacity = burst if burst is not None else rate
+        self.store = store or bucket_store
+        self.max_wait = max_wait
+
+    def reserve(self, tokens=1):
+        """Reserve a slot without waiting, returning the seconds until it is due."""
+        return self.store.reserve(self.key, self.rate, self.capacity, tokens, self.max_wait)
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, seconds):
+        self.store.penalize(self.key, self.rate, self.capacity, seconds)
+
+    def queue_depth(self):
+        """Requests currently waiting on this bucket, across all workers, not counting a penalty."""
+        level, penalty = self.store.state(self.key, self.rate, self.capacity)
+        return max(0, math.ceil(round(-level - penalty * self.rate, 6)))
+
+    def penalty(self):
+        """Seconds nobody gets a slot for after an upstream 429."""
+        return self.store.state(self.key, self.rate, self.capacity)[1]
+
+    def tokens(self):
+        return max(0.0, self.store.state(self.key, self.rate, self.capacity)[0])
+
+
+bucket_store = BucketStore(os.path.join(CACHE_DIR, 'ratelimit.sqlite'))
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from instrument_cache import CACHE_DIR
+from metrics import count_cache
+
+# Seconds each portfolio read is served from memory per user
+DEFAULT_TTLS = {
+    "orders": 1.0,
+    "positions": 1.0,
+    "holdings": 5.0,
+    "margins": 2.0,
+    "profile": 60.0,
+}
+# Seconds after its last write a user's generation is forgotten, far longer than any
+# entry lives or fetch runs, so forgetting it cannot make a pre-write value current again
+FORGET_AFTER = 3600.0
+# Resources an order placement, modification or cancellation can change
+ORDER_WRITE_RESOURCES = ("orders", "positions", "holdings", "margins")
+
+
+def parse_ttls(spec):
+    """`orders=0.5,holdings=10` layered over DEFAULT_TTLS."""
+    ttls = dict(DEFAULT_TTLS)
+    for item in filter(None, (spec or "").split(",")):
+        resource, _, seconds = item.partition("=")
+        ttls[resource.strip()] = float(seconds)
+    return ttls
+
+
+GENERATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    key TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+
+class GenerationStore:
+    """
+    Write generation of each user's resources in a SQLite file, so a write
+    answered by one gunicorn worker invalidates the reads cached by all of them.
+    Users are stored by digest rather than enctoken.
+    Args:
+        path: SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(GENERATIONS_SCHEMA)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @staticmethod
+    def _key(user, resource):
+        return f"{hashlib.sha256(user.encode()).hexdigest()[:16]}:{resource}"
+
+    def get(self, user, resource):
+        row = self._db().execute("SELECT generation FROM generations WHERE key=?",
+                                 (self._key(user, resource),)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, user, resources):
+        now = time.time()
+        self._db().executemany(
+            "INSERT INTO generations VALUES (?, 1, ?) "
+            "ON CONFLICT(key) DO UPDATE SET generation=generation+1, updated=excluded.updated",
+            [(self._key(user, resource), now) for resource in resources])
+
+    def prune(self, before):
+        """Forget generations last bumped before `before`, once no entry cached under them can be alive."""
+        self._db().execute("DELETE FROM generations WHERE updated<?", (before,))
+
+
+class ReadCache:
+    """
+    Per-user TTL cache for read endpoints with singleflight: concurrent identical
+    reads share one upstream call. invalidate() bumps the generation of a user's
+    resources, shared by all workers; entries and calls in flight from an older
+    generation are never served, so a client reading after its own write never
+    sees the pre-write value whichever worker answers.
+    Args:
+        ttls: Resource name -> seconds to cache, resources missing are not cached
+        generations: GenerationStore shared by the workers
+    """
+
+    def __init__(self, ttls, generations):
+        self.ttls = ttls
+        self.generations = generations
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self._sweep_interval = max(list(ttls.values()) + [1.0])
+
+    def get(self, user, resource, fetch):
+        ttl = self.ttls.get(resource, 0)
+        if ttl <= 0:
+            return fetch()
+        generation = self.generations.get(user, resource)
+        key = (user, resource, generation)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            entry = self._entries.get(key[:2])
+            if entry is not None and entry[0] > now and entry[2] == generation:
+                count_cache('read', hits=1)
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            count_cache('read', shared=1)
+            return future.result()
+        count_cache('read', misses=1)
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(e)
+            raise
+        # A write during the fetch, in any worker, means the value may predate it
+        current = self.generations.get(user, resource) == generation
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if current:
+                self._entries[key[:2]] = (time.monotonic() + ttl, value, generation)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, user, resources=None):
+        resources = list(self.ttls) if resources is None else resources
+        self.generations.bump(user, resources)
+        with self._lock:
+            for resource in resources:
+                self._entries.pop((user, resource), None)
+
+    def _sweep(self, now):
+        for key, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                del self._entries[key]
+        self._next_sweep = now + self._sweep_interval
+        self.generations.prune(time.time() - FORGET_AFTER)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+read_cache = ReadCache(parse_ttls(os.environ.get('KAPI_READ_TTLS')),
+                       GenerationStore(os.path.join(CACHE_DIR, 'read_cache.sqlite')))
@@ -0,0 +1,224 @@
+import struct
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from instrument_cache import IST
+
+# Packet layouts of ticker.py as NumPy dtypes, so a frame is decoded by viewing it
+PACKET_FIELDS = {
+    8: ("instrument_token", "last_price"),
+    28: ("instrument_token", "last_price", "high", "low", "open", "close", "price_change"),
+    32: ("instrument_token", "last_price", "high", "low", "open", "close", "price_change", "exchange_timestamp"),
+    44: ("instrument_token", "last_price", "last_traded_quantity", "average_traded_price", "volume_traded",
+         "total_buy_quantity", "total_sell_quantity", "open", "high", "low", "close"),
+}
+PACKET_FIELDS[184] = PACKET_FIELDS[44] + ("last_trade_time", "oi", "oi_day_high", "oi_day_low", "exchange_timestamp")
+DEPTH_ENTRY = np.dtype([("quantity", ">u4"), ("price", ">u4"), ("orders", ">u2"), ("pad", "V2")])
+DEPTH_ENTRIES = 10
+PACKETS = {length: np.dtype([(name, ">u4") for name in fields]) for length, fields in PACKET_FIELDS.items()}
+PACKETS[184] = np.dtype([(name, ">u4") for name in PACKET_FIELDS[184]] + [("depth", DEPTH_ENTRY, (DEPTH_ENTRIES,))])
+
+# Row modes, ordered by how much of a tick they carry
+MODE_NONE = 0
+MODE_CODES = {"ltp": 1, "quote": 2, "full": 3}
+PACKET_MODES = {8: 1, 28: 2, 32: 3, 44: 2, 184: 3}
+# Row mode a quote endpoint needs to be answered locally
+REQUIRED_MODE = {"ltp": 1, "ohlc": 2, "quote": 3}
+
+ROW = np.dtype([
+    ("instrument_token", "u4"),
+    ("mode", "u1"),
+    ("last_price", "f8"),
+    ("last_traded_quantity", "u4"),
+    ("average_traded_price", "f8"),
+    ("volume_traded", "u4"),
+    ("total_buy_quantity", "u4"),
+    ("total_sell_quantity", "u4"),
+    ("open", "f8"),
+    ("high", "f8"),
+    ("low", "f8"),
+    ("close", "f8"),
+    ("last_trade_time", "u4"),
+    ("oi", "u4"),
+    ("oi_day_high", "u4"),
+    ("oi_day_low", "u4"),
+    ("exchange_timestamp", "u4"),
+    ("depth_quantity", "u4", (DEPTH_ENTRIES,)),
+    ("depth_price", "f8", (DEPTH_ENTRIES,)),
+    ("depth_orders", "u2", (DEPTH_ENTRIES,)),
+    ("updated", "f8"),
+])
+
+_LENGTH = struct.Struct(">H")
+
+
+def split_frame(data):
+    """
+    Packets of a binary ticker frame as structured arrays keyed by packet length.
+    A frame of same sized packets, the usual case, is viewed in place without
+    copying; mixed frames are gathered into one array per packet size.
+    """
+    if len(data) < 4:
+        return {}
+    count, first = struct.unpack_from(">HH", data)
+    stride = first + 2
+    if first in PACKETS and len(data) == 2 + count * stride:
+        lengths = np.ndarray((count,), ">u2", data, 2, (stride,))
+        if (lengths == first).all():
+            return {first: np.ndarray((count,), PACKETS[first], data, 4, (stride,))}
+
+    starts = {}
+    offset = 2
+    for _ in range(count):
+        length, = _LENGTH.unpack_from(data, offset)
+        starts.setdefault(length, []).append(offset + 2)
+        offset += 2 + length
+    raw = np.frombuffer(data, np.uint8)
+    groups = {}
+    for length, offsets in starts.items():
+        if length in PACKETS:
+            rows = raw[np.asarray(offsets)[:, None] + np.arange(length)]
+            groups[length] = rows.view(PACKETS[length]).reshape(-1)
+    return groups
+
+
+def price_divisors(tokens):
+    segments = tokens & 0xff
+    return np.where(segments == 3, 10000000.0, np.where(segments == 6, 10000.0, 100.0))
+
+
+def _timestamp(epoch):
+    return datetime.fromtimestamp(epoch, IST).strftime("%Y-%m-%d %H:%M:%S") if epoch else None
+
+
+class TickTable:
+    """
+    Latest tick of every streamed instrument in one preallocated structured array.
+    Whole frames are decoded and written column by column, so updating costs a few
+    array operations per frame rather than Python work per tick.
+    Args:
+        capacity: Rows allocated up front, doubled when exceeded
+    """
+
+    def __init__(self, capacity=4096):
+        self._rows = np.zeros(capacity, ROW)
+        self._size = 0
+        self._keys = np.empty(0, "u4")
+        self._positions = np.empty(0, np.intp)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def update(self, data):
+        """Write the ticks of a binary frame, returning how many there were."""
+        groups = split_frame(data)
+        count = 0
+        with self._lock:
+            for length, packets in groups.items():
+                self._write(length, packets)
+                count += len(packets)
+        return count
+
+    def _row_positions(self, tokens):
+        keys = self._keys
+        positions = np.searchsorted(keys, tokens)
+        found = positions < len(keys)
+        found[found] = keys[positions[found]] == tokens[found]
+        if not found.all():
+            self._add(np.unique(tokens[~found]))
+            return self._positions[np.searchsorted(self._keys, tokens)]
+        return self._positions[positions]
+
+    def _add(self, tokens):
+        size = self._size + len(tokens)
+        if size > len(self._rows):
+            rows = np.zeros(max(size, 2 * len(self._rows)), ROW)
+            rows[:self._size] = self._rows[:self._size]
+            self._rows = rows
+        positions = np.arange(self._size, size)
+        self._rows["instrument_token"][positions] = tokens
+        self._size = size
+        keys = np.concatenate([self._keys, tokens])
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._positions = np.concatenate([self._positions, positions])[order]
+
+    def _write(self, length, packets):
+        tokens = packets["instrument_token"].astype("u4")
+        at = self._row_positions(tokens)
+        rows = self._rows
+        divisor = price_divisors(tokens)
+        rows["mode"][at] = PACKET_MODES[length]
+        rows["last_price"][at] = packets["last_price"] / divisor
+        if length != 8:
+            for field in ("open", "high", "low", "close"):
+                rows[field][at] = packets[field] / divisor
+        if length in (44, 184):
+            for field in ("last_traded_quantity", "volume_traded", "total_buy_quantity", "total_sell_quantity"):
+                rows[field][at] = packets[field]
+            rows["average_traded_price"][at] = packets["average_traded_price"] / divisor
+        if length == 184:
+            for field in ("last_trade_time", "oi", "oi_day_high", "oi_day_low"):
+                rows[field][at] = packets[field]
+            depth = packets["depth"]
+            rows["depth_quantity"][at] = depth["quantity"]
+            rows["depth_price"][at] = depth["price"] / divisor[:, None]
+            rows["depth_orders"][at] = depth["orders"]
+        if length in (32, 184):
+            rows["exchange_timestamp"][at] = packets["exchange_timestamp"]
+        rows["updated"][at] = time.time()
+
+    def get(self, instrument_token):
+        """Copy of the row of an instrument, None if it never ticked."""
+        with self._lock:
+            position = np.searchsorted(self._keys, instrument_token)
+            if position == len(self._keys) or self._keys[position] != instrument_token:
+                return None
+            return self._rows[self._positions[position]].copy()
+
+    def quote(self, instrument_token, mode, since=0.0, max_age=None):
+        """
+        The instrument's latest tick shaped like Kite's /quote, /quote/ohlc or
+        /quote/ltp answer for `mode`, None if the ticks held lack fields it needs.
+        Args:
+            since: Epoch seconds, None if the last tick arrived before then
+            max_age: Seconds, None if the last tick is older
+        """
+        row = self.get(instrument_token)
+        if row is None or row["mode"] < REQUIRED_MODE[mode]:
+            return None
+        updated = float(row["updated"])
+        if updated < since or max_age and time.time() - updated > max_age:
+            return None
+        data = {"instrument_token": int(row["instrument_token"]), "last_price": float(row["last_price"])}
+        if mode == "ltp":
+            return data
+        data["ohlc"] = {"open": float(row["open"]), "high": float(row["high"]),
+                        "low": float(row["low"]), "close": float(row["close"])}
+        if mode == "ohlc":
+            return data
+        half = DEPTH_ENTRIES // 2
+        depth = [{"price": float(price), "quantity": int(quantity), "orders": int(orders)}
+                 for price, quantity, orders in zip(row["depth_price"], row["depth_quantity"], row["depth_orders"])]
+        data.update({
+            "timestamp": _timestamp(int(row["exchange_timestamp"])),
+            "last_trade_time": _timestamp(int(row["last_trade_time"])),
+            "last_quantity": int(row["last_traded_quantity"]),
+            "buy_quantity": int(row["total_buy_quantity"]),
+            "sell_quantity": int(row["total_sell_quantity"]),
+            "volume": int(row["volume_traded"]),
+            "average_price": float(row["average_traded_price"]),
+            "oi": int(row["oi"]),
+            "oi_day_high": int(row["oi_day_high"]),
+            "oi_day_low": int(row["oi_day_low"]),
+            "net_change": float(row["last_price"] - row["close"]),
+            "depth": {"buy": depth[:half], "sell": depth[half:]},
+        })
+        return data
+
+
+tick_table = TickTable()
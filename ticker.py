@@ -0,0 +1,536 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import struct
+import threading
+import time
+from urllib.parse import quote
+
+# aiohttp and tick_table (NumPy) are imported on first use, as most processes never open a ticker
+
+MODE_LTP = "ltp"
+MODE_QUOTE = "quote"
+MODE_FULL = "full"
+MODES = (MODE_LTP, MODE_QUOTE, MODE_FULL)
+
+# Instruments Kite streams on one connection
+MAX_TOKENS = 3000
+
+TICKER_URL = os.environ.get(
+    'KAPI_TICKER_URL',
+    "wss://ws.zerodha.com/?api_key=kitefront&user_id={user_id}&enctoken={enctoken}&user-agent=kite3-web&version=3.0.0")
+HEARTBEAT = 30
+RECONNECT_MIN = 1.0
+RECONNECT_MAX = 60.0
+# Seconds a ticker is kept without streaming clients, ticker API calls or quotes answered from its ticks
+IDLE_TIMEOUT = float(os.environ.get('KAPI_TICKER_IDLE', 900))
+# Seconds since its last tick after which a quote is fetched upstream rather than from the tick table, 0 for no limit
+TICK_MAX_AGE = float(os.environ.get('KAPI_TICK_MAX_AGE', 10))
+
+log = logging.getLogger('kapi.ticker')
+
+# Binary frame: packet count u16, then per packet its length u16 and the packet.
+# Packets are big-endian u32 fields, prices in paise (see price_divisor).
+FRAME_HEADER = struct.Struct(">H")
+PACKET_LTP = struct.Struct(">II")            # 8 bytes: token, last price
+PACKET_INDEX = struct.Struct(">7I")          # 28: token, ltp, high, low, open, close, change
+PACKET_INDEX_FULL = struct.Struct(">8I")     # 32: index + exchange timestamp
+PACKET_QUOTE = struct.Struct(">11I")         # 44: token, ltp, last qty, avg price, volume, buy qty,
+                                             #     sell qty, open, high, low, close
+PACKET_FULL = struct.Struct(">16I")          # 184: quote + last trade time, oi, oi high, oi low,
+                                             #      exchange timestamp, then 10 depth entries
+DEPTH_ENTRY = struct.Struct(">IIH2x")        # quantity, price, orders
+DEPTH_LEVELS = 5
+FULL_PACKET_SIZE = PACKET_FULL.size + 2 * DEPTH_LEVELS * DEPTH_ENTRY.size
+
+SEGMENT_CDS = 3
+SEGMENT_BCD = 6
+SEGMENT_INDICES = 9
+
+
+def price_divisor(instrument_token):
+    segment = instrument_token & 0xff
+    if segment == SEGMENT_CDS:
+        return 10000000.0
+    if segment == SEGMENT_BCD:
+        return 10000.0
+    return 100.0
+
+
+def _change(last_price, close):
+    return (last_price - close) * 100 / close if close else 0
+
+
+def decode_packet(buf, offset, length):
+    """
+    One tick from the packet at `offset` of `buf` (bytes or memoryview), read in
+    place with struct.unpack_from. Returns None for unknown packet sizes.
+    """
+    if length == PACKET_LTP.size:
+        token, ltp = PACKET_LTP.unpack_from(buf, offset)
+        return {"tradable": token & 0xff != SEGMENT_INDICES, "mode": MODE_LTP, "instrument_token": token,
+                "last_price": ltp / price_divisor(token)}
+
+    if length in (PACKET_INDEX.size, PACKET_INDEX_FULL.size):
+        fields = (PACKET_INDEX_FULL if length == PACKET_INDEX_FULL.size else PACKET_INDEX).unpack_from(buf, offset)
+        token = fields[0]
+        divisor = price_divisor(token)
+        ltp = fields[1] / divisor
+        close = fields[5] / divisor
+        tick = {"tradable": token & 0xff != SEGMENT_INDICES,
+                "mode": MODE_FULL if length == PACKET_INDEX_FULL.size else MODE_QUOTE,
+                "instrument_token": token,
+                "last_price": ltp,
+                "ohlc": {"high": fields[2] / divisor, "low": fields[3] / divisor,
+                         "open": fields[4] / divisor, "close": close},
+                "change": _change(ltp, close)}
+        if length == PACKET_INDEX_FULL.size:
+            tick["exchange_timestamp"] = fields[7]
+        return tick
+
+    if length in (PACKET_QUOTE.size, FULL_PACKET_SIZE):
+        full = length == FULL_PACKET_SIZE
+        fields = (PACKET_FULL if full else PACKET_QUOTE).unpack_from(buf, offset)
+        token = fields[0]
+        divisor = price_divisor(token)
+        ltp = fields[1] / divisor
+        close = fields[10] / divisor
+        tick = {"tradable": token & 0xff != SEGMENT_INDICES,
+                "mode": MODE_FULL if full else MODE_QUOTE,
+                "instrument_token": token,
+                "last_price": ltp,
+                "last_traded_quantity": fields[2],
+                "average_traded_price": fields[3] / divisor,
+                "volume_traded": fields[4],
+                "total_buy_quantity": fields[5],
+                "total_sell_quantity": fields[6],
+                "ohlc": {"open": fields[7] / divisor, "high": fields[8] / divisor,
+                         "low": fields[9] / divisor, "close": close},
+                "change": _change(ltp, close)}
+        if full:
+            tick["last_trade_time"] = fields[11]
+            tick["oi"] = fields[12]
+            tick["oi_day_high"] = fields[13]
+            tick["oi_day_low"] = fields[14]
+            tick["exchange_timestamp"] = fields[15]
+            depth = [{"quantity": quantity, "price": price / divisor, "orders": orders}
+                     for quantity, price, orders in DEPTH_ENTRY.iter_unpack(
+                         buf[offset + PACKET_FULL.size:offset + length])]
+            tick["depth"] = {"buy": depth[:DEPTH_LEVELS], "sell": depth[DEPTH_LEVELS:]}
+        return tick
+    return None
+
+
+def decode_frame(data):
+    """Ticks of a binary WebSocket frame. One byte frames are heartbeats and decode to nothing."""
+    if len(data) < FRAME_HEADER.size:
+        return []
+    buf = memoryview(data)
+    count, = FRAME_HEADER.unpack_from(buf, 0)
+    offset = FRAME_HEADER.size
+    ticks = []
+    for _ in range(count):
+        length, = FRAME_HEADER.unpack_from(buf, offset)
+        offset += FRAME_HEADER.size
+        tick = decode_packet(buf, offset, length)
+        if tick is not None:
+            ticks.append(tick)
+        offset += length
+    return ticks
+
+
+class Subscriber:
+    """
+    One client's view of a Ticker. Ticks are conflated per instrument, so a slow
+    client gets the latest state of every instrument rather than a backlog.
+    Args:
+        tokens: Instrument tokens to receive, None for everything the ticker streams
+        loop: Event loop of an asyncio consumer, woken with call_soon_threadsafe
+    """
+
+    def __init__(self, tokens=None, loop=None):
+        self.tokens = set(tokens) if tokens else None
+        self._ticks = {}
+        self._messages = []
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._loop = loop
+        self._async_ready = asyncio.Event() if loop is not None else None
+
+    def put(self, ticks, messages=()):
+        changed = bool(messages)
+        with self._lock:
+            for tick in ticks:
+                token = tick["instrument_token"]
+                if self.tokens is None or token in self.tokens:
+                    self._ticks[token] = tick
+                    changed = True
+            self._messages.extend(messages)
+        if changed:
+            self._ready.set()
+            if self._loop is not None:
+                try:
+                    self._loop.call_soon_threadsafe(self._async_ready.set)
+                except RuntimeError:
+                    # The consumer's loop has shut down
+                    pass
+
+    def drain(self):
+        """Pending (ticks, messages), clearing them."""
+        with self._lock:
+            ticks = list(self._ticks.values())
+            messages = self._messages
+            self._ticks = {}
+            self._messages = []
+            self._ready.clear()
+            if self._async_ready is not None:
+                self._async_ready.clear()
+        return ticks, messages
+
+    def get(self, timeout=None):
+        self._ready.wait(timeout)
+        return self.drain()
+
+    async def aget(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._async_ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.drain()
+
+
+def sse_events(ticks, messages):
+    """Server-Sent Events text for a drained batch, a keepalive comment when empty."""
+    events = []
+    if ticks:
+        events.append(f"event: ticks\ndata: {json.dumps(ticks, separators=(',', ':'))}\n\n")
+    for message in messages:
+        events.append(f"event: {message.get('type', 'message')}\n"
+                      f"data: {json.dumps(message.get('data'), separators=(',', ':'))}\n\n")
+    return "".join(events) or ": keepalive\n\n"
+
+
+class Ticker:
+    """
+    One upstream market data WebSocket per enctoken, run on an event loop in a
+    background thread and shared by every client of the process. Subscriptions
+    survive reconnects. Binary frames are decoded once and handed to every
+    Subscriber; JSON text frames (order updates, errors) are handed on as messages
+    and to `message_handlers`.
+    Args:
+        enctoken: Kite session token
+        user_id: Kite user id the session belongs to
+        url: WebSocket URL template with {enctoken} and {user_id} placeholders
+    """
+
+    def __init__(self, enctoken, user_id, url=TICKER_URL):
+        self.url = url.format(enctoken=quote(enctoken, safe=""), user_id=user_id)
+        self.subscriptions = {}
+        # Epoch seconds each token was subscribed in its current mode, and of the last (re)connect
+        self.subscribed_at = {}
+        self.connected_at = 0.0
+        self.message_handlers = []
+        self.connected = False
+        self.invalidated = False
+        self.error = None
+        self.ticks_received = 0
+        self.bad_messages = 0
+        self.last_used = time.monotonic()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._ws = None
+        self._stop = None
+        self._thread = None
+        self.stopped = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ticker", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            asyncio.run(self._main())
+        except Exception as e:
+            log.exception("Ticker thread failed")
+            self.error = f"Ticker stopped: {type(e).__name__}: {e}"
+        finally:
+            # A ticker whose thread ended is never handed out again, get_ticker starts a new one
+            self.stopped = True
+            self.connected = False
+
+    def stop(self):
+        self.stopped = True
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop.set)
+                if self._ws is not None:
+                    asyncio.run_coroutine_threadsafe(self._ws.close(), self._loop)
+            except RuntimeError:
+                # The ticker's loop has already finished
+                pass
+
+    def status(self):
+        with self._lock:
+            modes = {}
+            for token, mode in self.subscriptions.items():
+                modes.setdefault(mode, []).append(token)
+            return {"connected": self.connected, "error": self.error, "subscriptions": modes,
+                    "clients": len(self._subscribers), "ticks_received": self.ticks_received,
+                    "bad_messages": self.bad_messages}
+
+    def idle(self, now):
+        with self._lock:
+            return not self._subscribers and now - self.last_used > IDLE_TIMEOUT
+
+    def subscribe(self, tokens, mode=MODE_QUOTE):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported mode {mode}, expected one of {', '.join(MODES)}")
+        tokens = [int(token) for token in tokens]
+        with self._lock:
+            if len(set(self.subscriptions) | set(tokens)) > MAX_TOKENS:
+                raise ValueError(f"At most {MAX_TOKENS} instruments can be streamed at once")
+            now = time.time()
+            for token in tokens:
+                if self.subscriptions.get(token) != mode:
+                    self.subscribed_at[token] = now
+                self.subscriptions[token] = mode
+        self._send_threadsafe([{"a": "subscribe", "v": tokens}, {"a": "mode", "v": [mode, tokens]}])
+
+    def unsubscribe(self, tokens):
+        tokens = [int(token) for token in tokens]
+        with self._lock:
+            for token in tokens:
+                self.subscriptions.pop(token, None)
+                self.subscribed_at.pop(token, None)
+        self._send_threadsafe([{"a": "unsubscribe", "v": tokens}])
+
+    def listen(self, tokens=None, loop=None):
+        """A new Subscriber receiving this ticker's ticks; pass it to remove() when done."""
+        subscriber = Subscriber(tokens, loop)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def remove(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            self.last_used = time.monotonic()
+
+    def _send_threadsafe(self, messages):
+        if self._loop is not None and self._ws is not None:
+            asyncio.run_coroutine_threadsafe(self._send(messages), self._loop)
+
+    async def _send(self, messages):
+        ws = self._ws
+        if ws is None or ws.closed:
+            return
+        for message in messages:
+            await ws.send_str(json.dumps(message))
+
+    async def _resubscribe(self):
+        with self._lock:
+            modes = {}
+            for token, mode in self.subscriptions.items():
+                modes.setdefault(mode, []).append(token)
+        for mode, tokens in modes.items():
+            await self._send([{"a": "subscribe", "v": tokens}, {"a": "mode", "v": [mode, tokens]}])
+
+    def _on_binary(self, data):
+        from tick_table import tick_table
+        # The latest-tick table is always kept current; per tick dicts are only built for listeners
+        count = tick_table.update(data)
+        with self._lock:
+            self.ticks_received += count
+            listening = bool(self._subscribers)
+        if listening:
+            ticks = decode_frame(data)
+            if ticks:
+                self._dispatch(ticks)
+
+    def _dispatch(self, ticks, messages=()):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(ticks, messages)
+
+    def _on_text(self, text):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        for handler in list(self.message_handlers):
+            try:
+                handler(message)
+            except Exception:
+                self.bad_messages += 1
+                log.exception("Ticker message handler failed on %s message", message.get('type'))
+        self._dispatch([], [message])
+
+    def _on_message(self, message, aiohttp):
+        # A frame that fails to decode is dropped, it must not end the connection or the thread
+        try:
+            if message.type == aiohttp.WSMsgType.BINARY:
+                self._on_binary(message.data)
+            elif message.type == aiohttp.WSMsgType.TEXT:
+                self._on_text(message.data)
+        except Exception:
+            self.bad_messages += 1
+            log.exception("Dropped a ticker frame of %d bytes", len(message.data or b""))
+
+    async def _stop_when_idle(self):
+        while not self.stopped:
+            try:
+                await asyncio.wait_for(self._stop.wait(), min(IDLE_TIMEOUT, 60))
+            except asyncio.TimeoutError:
+                pass
+            if self.idle(time.monotonic()):
+                self.stop()
+
+    async def _main(self):
+        import aiohttp
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        delay = RECONNECT_MIN
+        reaper = asyncio.create_task(self._stop_when_idle())
+        async with aiohttp.ClientSession() as session:
+            while not self.stopped:
+                try:
+                    async with session.ws_connect(self.url, heartbeat=HEARTBEAT) as ws:
+                        self._ws = ws
+                        self.connected_at = time.time()
+                        self.connected = True
+                        self.error = None
+                        delay = RECONNECT_MIN
+                        await self._resubscribe()
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.ERROR:
+                                break
+                            self._on_message(message, aiohttp)
+                except aiohttp.WSServerHandshakeError as e:
+                    self.error = f"Ticker handshake failed with HTTP {e.status}"
+                    if e.status in (401, 403):
+                        # Expired enctoken, reconnecting cannot help
+                        self.invalidated = True
+                        self.stopped = True
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    self.error = str(e) or type(e).__name__
+                finally:
+                    self._ws = None
+                    self.connected = False
+                if self.stopped:
+                    break
+                try:
+                    await asyncio.wait_for(self._stop.wait(), delay + random.uniform(0, delay / 2))
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, RECONNECT_MAX)
+        reaper.cancel()
+
+
+_tickers = {}
+_tickers_lock = threading.Lock()
+
+
+def get_ticker(enctoken, user_id):
+    """The process' running Ticker for an enctoken, started on first use."""
+    with _tickers_lock:
+        for key in [key for key, ticker in _tickers.items() if ticker.stopped]:
+            del _tickers[key]
+        ticker = _tickers.get(enctoken)
+        if ticker is None:
+            ticker = _tickers[enctoken] = Ticker(enctoken, user_id)
+            ticker.start()
+        ticker.last_used = time.monotonic()
+        return ticker
+
+
+def running_ticker(enctoken):
+    """The process' running Ticker for an enctoken, None if there is none."""
+    with _tickers_lock:
+        ticker = _tickers.get(enctoken)
+        if ticker is None or ticker.stopped:
+            return None
+        ticker.last_used = time.monotonic()
+        return ticker
+
+
+def _connected_tickers():
+    with _tickers_lock:
+        return [ticker for ticker in _tickers.values() if ticker.connected]
+
+
+def live_modes():
+    """
+    Best mode each instrument is streamed in by a connected ticker of the process,
+    with the epoch seconds it has been streamed in that mode since: the later of
+    its subscription and the ticker's last reconnect. Ticks held from before then
+    may have missed changes.
+    """
+    tickers = _connected_tickers()
+    if not tickers:
+        return {}
+    from tick_table import MODE_CODES
+    modes = {}
+    for ticker in tickers:
+        with ticker._lock:
+            for token, mode in ticker.subscriptions.items():
+                live = (MODE_CODES[mode], max(ticker.connected_at, ticker.subscribed_at[token]))
+                best = modes.get(token)
+                if best is None or live[0] > best[0] or live[0] == best[0] and live[1] < best[1]:
+                    modes[token] = live
+    return modes
+
+
+def live_quotes(instruments, mode, lookup):
+    """
+    Quotes answered from the latest-tick table for the instruments a connected
+    ticker streams in a mode carrying what `mode` (ltp, ohlc or quote) returns,
+    whose last tick arrived since it did and within TICK_MAX_AGE.
+    Keyed like `instruments`; the rest have to be fetched upstream.
+    Args:
+        lookup: (exchange, tradingsymbol) -> instrument, to resolve EXCHANGE:TRADINGSYMBOL keys
+    """
+    modes = live_modes()
+    if not modes:
+        return {}
+    from tick_table import REQUIRED_MODE, tick_table
+    data = {}
+    for key in map(str, instruments):
+        if key.isdigit():
+            token = int(key)
+        else:
+            exchange, _, tradingsymbol = key.partition(':')
+            instrument = lookup(exchange, tradingsymbol)
+            if instrument is None:
+                continue
+            token = instrument.instrument_token
+        live = modes.get(token)
+        if live is not None and live[0] >= REQUIRED_MODE[mode]:
+            quote = tick_table.quote(token, mode, since=live[1], max_age=TICK_MAX_AGE)
+            if quote is not None:
+                data[key] = quote
+    if data:
+        _mark_used({quote["instrument_token"] for quote in data.values()})
+    return data
+
+
+def _mark_used(tokens):
+    # Tickers answering quotes are in use even with no streaming client
+    now = time.monotonic()
+    for ticker in _connected_tickers():
+        with ticker._lock:
+            if not tokens.isdisjoint(ticker.subscriptions):
+                ticker.last_used = now
+
+
+def stop_tickers():
+    with _tickers_lock:
+        tickers = list(_tickers.values())
+        _tickers.clear()
+    for ticker in tickers:
+        ticker.stop()
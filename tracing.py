@@ -0,0 +1,98 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Time requests by phase and report it in Server-Timing headers and the log
+TRACING = os.environ.get('KAPI_TRACING', '').lower() in ('1', 'true')
+
+log = logging.getLogger('kapi.trace')
+if TRACING and not log.handlers:
+    # One JSON line per request on stderr, which gunicorn and Render collect
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+_current = contextvars.ContextVar('kapi_trace', default=None)
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    """Time spent per phase (upstream, store, parse, serialize) of one request."""
+
+    def __init__(self):
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        # Spans of one request may be recorded from several executor threads at once
+        with self._lock:
+            total, count = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + seconds, count + 1)
+
+    def server_timing(self, total):
+        """Server-Timing header value, durations in milliseconds."""
+        metrics = [f'{name};dur={seconds * 1000:.1f};desc="{count}x"'
+                   for name, (seconds, count) in self.spans.items()]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def to_dict(self):
+        return {name: {"ms": round(seconds * 1000, 2), "count": count}
+                for name, (seconds, count) in self.spans.items()}
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.start)
+
+
+def start_trace():
+    """Trace the rest of the current request, returning the token for end_trace()."""
+    return _current.set(Trace())
+
+
+def current_trace():
+    return _current.get()
+
+
+def end_trace(token):
+    _current.reset(token)
+
+
+def span(name):
+    """Context manager timing a phase of the traced request, a shared no-op when none is traced."""
+    trace = _current.get()
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+
+def record(name, seconds):
+    """Add an already measured phase to the traced request, if any."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def log_request(trace, method, route, status, total):
+    log.info(json.dumps({
+        "method": method,
+        "route": route,
+        "status": status,
+        "ms": round(total * 1000, 2),
+        "spans": trace.to_dict(),
+    }, separators=(',', ':')))
@@ -0,0 +1,139 @@
+import os
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util import Retry, make_headers
+
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_POOL_SIZE, observe_upstream
+
+# Seconds to establish a connection and to wait for each read from upstream
+CONNECT_TIMEOUT = float(os.environ.get('KAPI_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('KAPI_READ_TIMEOUT', 10))
+
+# Retries of connection failures, and of timeouts and 5xx responses for reads
+RETRIES = int(os.environ.get('KAPI_RETRIES', 2))
+# Methods resent after a timeout or 5xx. Order modifications (PUT) and cancellations
+# (DELETE) are not, Kite may have applied the first attempt.
+RETRY_METHODS = frozenset({"GET", "HEAD"})
+RETRY_BACKOFF = 0.25
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Upstream hosts kept in the pool, and connections kept per host. Sized for the
+# request threads plus the quote, historical and order executors of a worker.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = int(os.environ.get('KAPI_UPSTREAM_CONNECTIONS', 32))
+
+
+class KiteError(Exception):
+    """
+    Failed upstream call.
+    Args:
+        message: Kite's message, or a description of the network failure
+        status: HTTP status to answer the client with
+        error_type: Kite's error_type (TokenException, OrderException, ...) or NetworkException
+    """
+
+    def __init__(self, message, status=502, error_type=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.error_type = error_type
+
+    def to_dict(self):
+        error = {"status": "error", "message": self.message}
+        if self.error_type:
+            error["error_type"] = self.error_type
+        return error
+
+
+def check_payload(status_code, body):
+    """The `data` of a decoded Kite response, or KiteError for anything else."""
+    if not isinstance(body, dict):
+        raise KiteError(f"Invalid response from Kite (HTTP {status_code})", 502, "DataException")
+    if status_code >= 400 or body.get("status") == "error" or "data" not in body:
+        raise KiteError(body.get("message") or f"Kite returned HTTP {status_code}",
+                        status_code if status_code >= 400 else 502, body.get("error_type"))
+    return body["data"]
+
+
+def connect_failed(e):
+    """Whether a requests exception means no connection was made, so nothing reached Kite."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(e, requests.ConnectionError) and isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def network_error(e, method, sent=True):
+    """
+    KiteError for a requests / aiohttp exception raised while talking to Kite.
+    Args:
+        sent: False when the connection could not be made, so Kite never saw the request
+    """
+    if sent and method not in RETRY_METHODS:
+        # The request may have reached Kite, so it must not be blindly repeated
+        return KiteError(f"No response from Kite, the {method} request may have been applied: {e}",
+                         504, "NetworkException")
+    return KiteError(f"Could not reach Kite: {e}", 504 if "timeout" in type(e).__name__.lower() else 502,
+                     "NetworkException")
+
+
+class Transport:
+    """
+    HTTP session shared by every KiteApp of the process: keep-alive connection
+    pools, compressed responses, timeouts on every call and retries that never
+    repeat a request Kite may already have acted on: writes are only retried when
+    the connection could not be made. User credentials travel as
+    per-request headers and cookies are never stored, so users cannot leak into
+    each other's calls.
+    """
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=RETRIES):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.session.headers["Accept-Encoding"] = make_headers(accept_encoding=True)["accept-encoding"]
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            other=0,
+            allowed_methods=RETRY_METHODS,
+            status_forcelist=RETRY_STATUSES,
+            backoff_factor=RETRY_BACKOFF,
+            raise_on_status=False,
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        UPSTREAM_POOL_SIZE.labels('sync').set(pool_maxsize)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        in_flight = UPSTREAM_IN_FLIGHT.labels('sync')
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException as e:
+            error = network_error(e, method, sent=not connect_failed(e))
+            observe_upstream(method, url, time.perf_counter() - start, error=error.error_type)
+            raise error from e
+        finally:
+            in_flight.dec()
+        observe_upstream(method, url, time.perf_counter() - start, response.status_code)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+transport = Transport()